@@ -0,0 +1,285 @@
+import argparse
+import json
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlencode
+
+from search import search_connection
+from storage import connect, upgrade_schema, upgrade_search
+
+# Fields of an object as the API returns it
+OBJECT_COLUMNS = ('id', 'name', 'audio', 'image', 'text', 'url', 'updated_at', 'canonical_id',
+                  'image_format', 'image_width', 'image_height', 'image_bytes')
+
+# Objects per page of /objects unless ?limit= asks for another number up to MAX_LIMIT
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class ApiError(Exception):
+    """A request the API answers with an HTTP error status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def read_only_connection(db_name):
+    """Connection that cannot write; shared between threads, one at a time"""
+    conn = sqlite3.connect(f"file:{quote(db_name)}?mode=ro", uri=True, check_same_thread=False)
+    conn.execute('PRAGMA query_only = ON')
+    return conn
+
+
+class ConnectionPool:
+    """Up to size read-only connections, opened on first use and reused by every request"""
+
+    def __init__(self, db_name, size=4):
+        self.db_name = db_name
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, waiting for one to come back when all size are in use"""
+        conn = None
+        with self._lock:
+            if self._idle.empty() and self._opened < self.size:
+                self._opened += 1
+                conn = read_only_connection(self.db_name)
+        if conn is None:
+            conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            # A read may have failed in the middle of a statement; nothing is left open for the next user
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get().close()
+
+
+class QueryCache:
+    """LRU cache of API responses that empties itself whenever the database changes.
+
+    SQLite's data_version changes on a connection each time another
+    connection commits, so one PRAGMA per lookup tells whether any writer
+    (a scraper, an export, a crawl worker) has committed since the cached
+    responses were built.
+    """
+
+    def __init__(self, db_name, max_entries=1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._watch = read_only_connection(db_name)
+        self._version = self._data_version()
+
+    def _data_version(self):
+        return self._watch.execute('PRAGMA data_version').fetchone()[0]
+
+    def get(self, key):
+        """(cached value or None, version); pass the version on to put()"""
+        with self._lock:
+            version = self._data_version()
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value, version
+
+    def put(self, key, value, version):
+        """Cache a value computed after get() returned version, unless a commit has come in between"""
+        with self._lock:
+            if version != self._version:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def close(self):
+        self._watch.close()
+
+
+class ReadApi:
+    """Read-only JSON API over the objects table.
+
+    GET /objects/<id>                     one object
+    GET /objects?after=<id>&limit=<n>     objects in id order; "next" links to the following page
+    GET /search?q=<words>&page=<n>        ranked full-text search, as search.py does it
+
+    Requests share a pool of read-only connections, and responses are kept
+    in an LRU cache until a writer commits. Tombstoned objects are not
+    served.
+    """
+
+    def __init__(self, db_name, pool_size=4, cache_size=1024):
+        self.db_name = db_name
+        # The schema and search index are created once here; afterwards the API only reads
+        conn = connect(db_name)
+        try:
+            upgrade_schema(conn)
+            self.has_search = upgrade_search(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        self.pool = ConnectionPool(db_name, pool_size)
+        self.cache = QueryCache(db_name, cache_size) if cache_size else None
+
+    def render(self, path, query=''):
+        """Return (status, body bytes, cache state) for a request path and query string"""
+        key = path + '?' + query
+        version = None
+        if self.cache:
+            body, version = self.cache.get(key)
+            if body is not None:
+                return 200, body, 'hit'
+        try:
+            result = self._route(unquote(path), parse_qs(query))
+        except ApiError as e:
+            return e.status, self._encode({'error': str(e)}), 'none'
+        except sqlite3.OperationalError as e:
+            return 400, self._encode({'error': str(e)}), 'none'
+        body = self._encode(result)
+        if self.cache:
+            self.cache.put(key, body, version)
+        return 200, body, 'miss'
+
+    def _route(self, path, params):
+        parts = [part for part in path.split('/') if part]
+        if parts == ['objects']:
+            return self.list_objects(after=self._int(params, 'after', None),
+                                     limit=self._int(params, 'limit', DEFAULT_LIMIT))
+        if len(parts) == 2 and parts[0] == 'objects':
+            try:
+                object_id = int(parts[1])
+            except ValueError:
+                raise ApiError(400, f"Invalid object id: {parts[1]!r}")
+            return self.get_object(object_id)
+        if parts == ['search']:
+            query = params.get('q', [''])[0]
+            if not query:
+                raise ApiError(400, "Missing q parameter")
+            return self.search(query, page=self._int(params, 'page', 1),
+                               per_page=self._int(params, 'per_page', 10),
+                               raw=params.get('raw', ['0'])[0] in ('1', 'true'))
+        raise ApiError(404, f"Not found: {path}")
+
+    def get_object(self, object_id):
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(OBJECT_COLUMNS)} FROM objects WHERE id = ? AND deleted_at IS NULL",
+                (object_id,)
+            ).fetchone()
+        if row is None:
+            raise ApiError(404, f"No object with id {object_id}")
+        return dict(zip(OBJECT_COLUMNS, row))
+
+    def list_objects(self, after=None, limit=DEFAULT_LIMIT):
+        """One page of objects with ids above after (keyset pagination, as export.iter_batches does)"""
+        limit = max(1, min(limit, MAX_LIMIT))
+        with self.pool.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT {', '.join(OBJECT_COLUMNS)} FROM objects
+                WHERE id > ? AND deleted_at IS NULL
+                ORDER BY id LIMIT ?
+            ''', (after if after is not None else -(1 << 63), limit)).fetchall()
+        items = [dict(zip(OBJECT_COLUMNS, row)) for row in rows]
+        following = None
+        if len(items) == limit:
+            following = '/objects?' + urlencode({'after': items[-1]['id'], 'limit': limit})
+        return {'items': items, 'next': following}
+
+    def search(self, query, page=1, per_page=10, raw=False):
+        if not self.has_search:
+            raise ApiError(501, "This SQLite build has no FTS5 support")
+        page = max(page, 1)
+        per_page = max(1, min(per_page, MAX_LIMIT))
+        with self.pool.connection() as conn:
+            total, rows = search_connection(conn, query, page, per_page, raw)
+        return {'total': total, 'page': page, 'per_page': per_page, 'items': rows}
+
+    def _int(self, params, name, default):
+        if name not in params:
+            return default
+        try:
+            return int(params[name][0])
+        except ValueError:
+            raise ApiError(400, f"{name} must be an integer")
+
+    def _encode(self, value):
+        return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+    def make_server(self, host='127.0.0.1', port=8000):
+        """ThreadingHTTPServer answering GET requests from this API"""
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; Nagle would delay the body by ~40 ms
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                path, _, query = self.path.partition('?')
+                status, body, cache_state = api.render(path, query)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('X-Cache', cache_state)
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        return server
+
+    def close(self):
+        self.pool.close()
+        if self.cache:
+            self.cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный HTTP/JSON API для чтения таблицы objects")
+    parser.add_argument('--db', default='khpet27_data.db', help="файл базы данных")
+    parser.add_argument('--host', default='127.0.0.1', help="адрес для входящих соединений")
+    parser.add_argument('--port', type=int, default=8000, help="порт")
+    parser.add_argument('--pool-size', type=int, default=4, help="число соединений с базой")
+    parser.add_argument('--cache-size', type=int, default=1024, help="ответов в кэше (0 — без кэша)")
+    args = parser.parse_args()
+
+    api = ReadApi(args.db, pool_size=args.pool_size, cache_size=args.cache_size)
+    server = api.make_server(args.host, args.port)
+    print(f"API запущен: http://{args.host}:{server.server_address[1]}/objects")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        api.close()
+        if api.cache:
+            print(f"Кэш: попаданий {api.cache.hits}, промахов {api.cache.misses}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import queue
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from http_client import create_session
+from khpet27_scraper import Khpet27Scraper
+from scraper import WebScraper
+from scraper_demo import WebScraperDemo
+
+TARGETS = ['khpet27', 'khpet27-crawl', 'khpet27-sitemap', 'books', 'demo']
+
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+# Posts per sitemap file of the stand-in site; WordPress itself uses up to 2000
+SITEMAP_SIZE = 100
+
+
+class StandInSite:
+    """Synthetic pages shaped like khpet27.ru, books.toscrape.com and JSONPlaceholder"""
+
+    def __init__(self, pages=10, per_page=20, body_size=20000, latency=0.0, error_rate=0.0, seed=1):
+        self.pages = pages
+        self.per_page = per_page
+        # Article and book pages are padded with sidebar filler up to roughly this many bytes
+        self.body_size = body_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+
+    def render(self, path, query=''):
+        """Return (status, content type, body) for a request path and query string"""
+        match = re.fullmatch(r'/(?:page/(\d+)/)?', path)
+        if match:
+            return self._ok(self._news_listing(int(match.group(1) or 1)))
+        match = re.fullmatch(r'/2025/01/post-(\d+)/', path)
+        if match:
+            return self._ok(self._news_article(int(match.group(1))))
+        match = re.fullmatch(r'/catalogue/page-(\d+)\.html', path)
+        if match and int(match.group(1)) <= self.pages:
+            return self._ok(self._books_listing(int(match.group(1))))
+        match = re.fullmatch(r'/catalogue/book-(\d+)_\d+/index\.html', path)
+        if match:
+            return self._ok(self._book_detail(int(match.group(1))))
+        if path == '/wp-sitemap.xml':
+            return self._ok(self._sitemap_index(), 'application/xml')
+        match = re.fullmatch(r'/wp-sitemap-posts-post-(\d+)\.xml', path)
+        if match and 1 <= int(match.group(1)) <= self._sitemap_count():
+            return self._ok(self._posts_sitemap(int(match.group(1))), 'application/xml')
+        if path == '/wp-sitemap-taxonomies-category-1.xml':
+            return self._ok(self._urlset([f'/page/{n}/' for n in range(1, self.pages + 1)]), 'application/xml')
+        if path == '/posts':
+            return self._ok(json.dumps(self._page(self._posts(), query)), 'application/json')
+        if path == '/photos':
+            return self._ok(json.dumps(self._page(self._photos(), query)), 'application/json')
+        return 404, 'text/html', b'<html><body>Not found</body></html>'
+
+    def serve(self, port_queue):
+        """Run the HTTP server forever, reporting the chosen port through port_queue"""
+        site = self
+        rng = random.Random(self.seed)
+        rng_lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; Nagle would delay the body by ~40 ms
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if site.latency:
+                    time.sleep(site.latency)
+                with rng_lock:
+                    failed = rng.random() < site.error_rate
+                if failed:
+                    status, content_type, body = 503, 'text/html', b'Service Unavailable'
+                else:
+                    path, _, query = self.path.partition('?')
+                    status, content_type, body = site.render(path, query)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        class Server(ThreadingHTTPServer):
+            def handle_error(self, request, client_address):
+                # Streaming clients hang up once they have read enough; that is not an error
+                if not isinstance(sys.exc_info()[1], ConnectionError):
+                    super().handle_error(request, client_address)
+
+        server = Server(('127.0.0.1', 0), Handler)
+        port_queue.put(server.server_address[1])
+        server.serve_forever()
+
+    def _ok(self, body, content_type='text/html; charset=utf-8'):
+        return 200, content_type, body.encode('utf-8')
+
+    def _filler(self, used):
+        paragraphs = []
+        size = used
+        index = 0
+        while size < self.body_size:
+            paragraph = f'<div class="widget"><h4>Виджет {index}</h4><p>{"Текст боковой колонки. " * 8}</p></div>'
+            paragraphs.append(paragraph)
+            size += len(paragraph.encode('utf-8'))
+            index += 1
+        return ''.join(paragraphs)
+
+    def _news_listing(self, page):
+        first = (page - 1) * self.per_page + 1
+        posts = ''.join(
+            f'<article class="post"><h2><a href="/2025/01/post-{n}/">Новость {n}</a></h2></article>'
+            for n in range(first, first + self.per_page)
+        )
+        pagination = ''.join(
+            f'<a class="page-numbers" href="/page/{n}/">{n}</a>'
+            for n in range(max(1, page - 2), min(self.pages, page + 2) + 1)
+        )
+        return f'<html><head><title>ХПЭТ</title></head><body><main>{posts}</main><nav>{pagination}</nav></body></html>'
+
+    def _news_article(self, n):
+        content = (
+            f'<article><h1 class="entry-title">Новость {n}</h1>'
+            f'<img src="/wp-content/uploads/2025/01/photo-{n}.jpg">'
+            f'<div class="entry-content"><p>Первый абзац новости {n}.</p><p>Второй абзац.</p></div></article>'
+        )
+        return (f'<html><head><title>Новость {n}</title></head><body>'
+                f'<main>{content}</main><aside>{self._filler(len(content))}</aside></body></html>')
+
+    def _sitemap_count(self):
+        return (self.pages * self.per_page + SITEMAP_SIZE - 1) // SITEMAP_SIZE
+
+    def _sitemap_index(self):
+        sitemaps = [f'/wp-sitemap-posts-post-{n}.xml' for n in range(1, self._sitemap_count() + 1)]
+        sitemaps.append('/wp-sitemap-taxonomies-category-1.xml')
+        entries = ''.join(f'<sitemap><loc>{loc}</loc></sitemap>' for loc in sitemaps)
+        return f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="{SITEMAP_NS}">{entries}</sitemapindex>'
+
+    def _posts_sitemap(self, number):
+        first = (number - 1) * SITEMAP_SIZE + 1
+        last = min(number * SITEMAP_SIZE, self.pages * self.per_page)
+        return self._urlset([f'/2025/01/post-{n}/' for n in range(first, last + 1)], lastmod='2025-01-15T10:00:00+00:00')
+
+    def _urlset(self, paths, lastmod=None):
+        lastmod = f'<lastmod>{lastmod}</lastmod>' if lastmod else ''
+        entries = ''.join(f'<url><loc>{path}</loc>{lastmod}</url>' for path in paths)
+        return f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="{SITEMAP_NS}">{entries}</urlset>'
+
+    def _books_listing(self, page):
+        pods = ''.join(
+            f'<li><article class="product_pod"><h3><a href="book-{page}_{n}/index.html" '
+            f'title="Book {page}-{n}">Book {page}-{n}</a></h3><p class="price_color">£10.00</p></article></li>'
+            for n in range(self.per_page)
+        )
+        pager = f'<li class="next"><a href="page-{page + 1}.html">next</a></li>' if page < self.pages else ''
+        return f'<html><body><ol class="row">{pods}</ol><ul class="pager">{pager}</ul></body></html>'
+
+    def _book_detail(self, page):
+        content = (
+            '<article class="product_page"><div id="product_gallery"><div class="item active">'
+            f'<img src="../../media/cache/book-{page}.jpg"></div></div>'
+            '<div id="product_description" class="sub-header"><h2>Product Description</h2></div>'
+            '<p>A synthetic book description.</p></article>'
+        )
+        return f'<html><body>{content}<aside>{self._filler(len(content))}</aside></body></html>'
+
+    def _page(self, items, query):
+        # json-server paging, as JSONPlaceholder supports: ?_start=100&_limit=50
+        params = parse_qs(query)
+        start = int(params.get('_start', ['0'])[0])
+        if '_limit' in params:
+            return items[start:start + int(params['_limit'][0])]
+        return items[start:]
+
+    def _posts(self):
+        return [
+            {'userId': 1, 'id': n, 'title': f'post title {n}', 'body': f'post body {n}'}
+            for n in range(1, self.pages * self.per_page + 1)
+        ]
+
+    def _photos(self):
+        return [
+            {'albumId': 1, 'id': n, 'title': f'photo {n}', 'url': f'https://via.placeholder.com/600/{n}'}
+            for n in range(1, 5001)
+        ]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_target(target, base_url, objects, workers, result_queue):
+    """Run one scraper against the stand-in site and report its measurements"""
+    latencies = []
+
+    session = create_session(pool_maxsize=max(workers, 10))
+    session.hooks['response'].append(lambda response, *args, **kwargs: latencies.append(response.elapsed.total_seconds()))
+
+    db_name = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.db')
+    output = io.StringIO()
+    started = time.perf_counter()
+
+    with contextlib.redirect_stdout(output):
+        if target in ('khpet27', 'khpet27-crawl', 'khpet27-sitemap'):
+            scraper = Khpet27Scraper(db_name=db_name, max_workers=workers, max_per_host=workers,
+                                     min_interval=0, session=session)
+            scraper.base_url = base_url
+            if target == 'khpet27':
+                scraper.run(objects)
+            elif target == 'khpet27-crawl':
+                scraper.run_crawl(max_depth=2, max_pages=objects)
+            else:
+                scraper.run_sitemap(max_pages=objects)
+        elif target == 'books':
+            scraper = WebScraper(db_name=db_name, session=session, max_per_host=workers, min_interval=0)
+            scraper.base_url = base_url + '/'
+            scraper.run(objects)
+        else:
+            scraper = WebScraperDemo(db_name=db_name, session=session, max_workers=workers)
+            scraper.api_url = base_url
+            scraper.run(objects)
+
+    elapsed = time.perf_counter() - started
+    stages = scraper.metrics.stage_totals()
+    parse_seconds = sum(stages.get(stage, (0, 0))[0] for stage in ('parse', 'extract'))
+    result_queue.put({
+        'target': target,
+        'seconds': elapsed,
+        'requests': len(latencies),
+        'pages_per_sec': len(latencies) / elapsed if elapsed else None,
+        'fetch_p50': percentile(latencies, 0.50),
+        'fetch_p95': percentile(latencies, 0.95),
+        'fetch_p99': percentile(latencies, 0.99),
+        'parse_per_page': parse_seconds / len(latencies) if latencies else None,
+        'db_write': stages.get('db_write', (0, 0))[0],
+        # ru_maxrss is reported in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def wait_for_result(target, process, result_queue, timeout):
+    """The result a target process put on result_queue, or a failed result if it died or ran out of time"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return result_queue.get(timeout=1)
+        except queue.Empty:
+            pass
+        if not process.is_alive():
+            # The result may have arrived just before the process exited
+            try:
+                return result_queue.get(timeout=1)
+            except queue.Empty:
+                return {'target': target, 'error': f"exited with code {process.exitcode}"}
+        if time.monotonic() > deadline:
+            process.terminate()
+            return {'target': target, 'error': f"no result after {timeout:.0f} s"}
+
+
+def run_benchmark(site, targets, objects=100, workers=8, timeout=600):
+    """Start the stand-in site and benchmark each target in a fresh process"""
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=site.serve, args=(port_queue,), daemon=True)
+    server.start()
+    base_url = f"http://127.0.0.1:{port_queue.get(timeout=10)}"
+
+    results = []
+    try:
+        for target in targets:
+            result_queue = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=run_target, args=(target, base_url, objects, workers, result_queue)
+            )
+            process.start()
+            results.append(wait_for_result(target, process, result_queue, timeout))
+            process.join()
+    finally:
+        server.terminate()
+    return results
+
+
+def format_results(results):
+    def ms(value):
+        return f"{value * 1000:.1f}" if value is not None else "-"
+
+    lines = [
+        f"{'Target':<15} | {'Time, s':>8} | {'Req':>5} | {'Pages/s':>8} | {'p50 ms':>7} | {'p95 ms':>7} | "
+        f"{'p99 ms':>7} | {'Parse ms':>8} | {'DB ms':>7} | {'RSS MB':>7}",
+        "-" * 111,
+    ]
+    for result in results:
+        if 'error' in result:
+            lines.append(f"{result['target']:<15} | failed: {result['error']}")
+            continue
+        lines.append(
+            f"{result['target']:<15} | {result['seconds']:>8.2f} | {result['requests']:>5} | "
+            f"{result['pages_per_sec']:>8.1f} | {ms(result['fetch_p50']):>7} | {ms(result['fetch_p95']):>7} | "
+            f"{ms(result['fetch_p99']):>7} | {ms(result['parse_per_page']):>8} | {ms(result['db_write']):>7} | "
+            f"{result['peak_rss_mb']:>7.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scrapers against a local stand-in site")
+    parser.add_argument('--targets', nargs='+', choices=TARGETS, default=TARGETS)
+    parser.add_argument('--objects', type=int, default=100, help="objects to collect per target")
+    parser.add_argument('--workers', type=int, default=8, help="concurrent fetches per host")
+    parser.add_argument('--pages', type=int, default=10, help="listing pages on the stand-in site")
+    parser.add_argument('--per-page', type=int, default=20, help="items per listing page")
+    parser.add_argument('--body-size', type=int, default=20000, help="approximate article page size in bytes")
+    parser.add_argument('--latency', type=float, default=0.0, help="server delay per response, seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of responses answered with 503")
+    parser.add_argument('--timeout', type=float, default=600, help="seconds to wait for each target")
+    parser.add_argument('--json', help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    site = StandInSite(pages=args.pages, per_page=args.per_page, body_size=args.body_size,
+                       latency=args.latency, error_rate=args.error_rate)
+    results = run_benchmark(site, args.targets, objects=args.objects, workers=args.workers, timeout=args.timeout)
+
+    print(format_results(results))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import multiprocessing
+import time
+
+from frontier import CrawlFrontier, default_worker_id
+from khpet27_scraper import Khpet27Scraper
+
+
+def seed(db_name, urls=(), reset=False, requeue_failed=False):
+    """Queue start URLs (the home page by default); returns how many were new"""
+    scraper = Khpet27Scraper(db_name=db_name)
+    frontier = CrawlFrontier(db_name)
+    try:
+        if reset:
+            frontier.reset()
+        if requeue_failed:
+            print(f"Возвращено в очередь после ошибок: {frontier.requeue_failed()}")
+        entries = []
+        for url in urls or [scraper.base_url + '/']:
+            url = scraper.canonical_url(url)
+            kind = scraper.classify_url(url)
+            if kind:
+                entries.append((url, 0, kind))
+            else:
+                print(f"Пропуск {url}: адрес не относится к сайту")
+        return frontier.add(entries)
+    finally:
+        frontier.close()
+
+
+def print_status(frontier):
+    counts = frontier.counts()
+    state = "останавливается" if frontier.is_draining() else "работает"
+    print(f"Очередь ({state}): " + ', '.join(f"{status} {count}" for status, count in sorted(counts.items())))
+    now = time.time()
+    for worker_id, leased, expires in frontier.leases():
+        left = expires - now
+        note = f"аренда истекает через {left:.0f} с" if left >= 0 else "аренда истекла"
+        print(f"  {worker_id}: {leased} адресов, {note}")
+    return counts
+
+
+def monitor(db_name, interval=5.0):
+    """Print the queue state every interval seconds until nothing is pending or leased"""
+    frontier = CrawlFrontier(db_name)
+    try:
+        previous = None
+        while True:
+            # Leases of dead workers are requeued even when no worker is claiming
+            requeued, failed = frontier.reclaim()
+            if requeued or failed:
+                print(f"Истекшие аренды: возвращено {requeued}, отказано {failed}")
+            counts = print_status(frontier)
+            finished = sum(counts.get(status, 0) for status in ('done', 'failed', 'known'))
+            if previous is not None:
+                print(f"  скорость: {(finished - previous) / interval:.2f} адресов/с")
+            previous = finished
+            if frontier.is_finished() or (frontier.is_draining() and not counts.get('leased')):
+                break
+            time.sleep(interval)
+    finally:
+        frontier.close()
+
+
+def drain(db_name, draining=True):
+    """Stop (or resume) handing out URLs; workers finish their leases and exit"""
+    frontier = CrawlFrontier(db_name)
+    try:
+        frontier.set_draining(draining)
+    finally:
+        frontier.close()
+
+
+def run_worker(db_name, max_depth, max_pages, lease_seconds, max_workers, min_interval):
+    """Entry point of one worker process"""
+    scraper = Khpet27Scraper(db_name=db_name, max_workers=max_workers, min_interval=min_interval)
+    scraper.run_worker(worker_id=default_worker_id(), max_depth=max_depth, max_pages=max_pages,
+                       lease_seconds=lease_seconds)
+
+
+def work(db_name, processes=1, max_depth=2, max_pages=None, lease_seconds=300, max_workers=4, min_interval=1.0):
+    """Start worker processes on this machine and wait for them"""
+    workers = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(db_name, max_depth, max_pages, lease_seconds, max_workers, min_interval)
+        )
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # The workers got the Ctrl+C too and release their leases on the way out
+        for worker in workers:
+            worker.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Общая очередь обхода khpet27.ru для нескольких процессов")
+    parser.add_argument('--db', default='khpet27_data.db', help="файл базы данных с таблицей frontier")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help="добавить стартовые адреса в очередь")
+    seed_parser.add_argument('urls', nargs='*', help="адреса (по умолчанию главная страница)")
+    seed_parser.add_argument('--reset', action='store_true', help="очистить очередь перед добавлением")
+    seed_parser.add_argument('--requeue-failed', action='store_true', help="вернуть в очередь адреса с ошибками")
+
+    commands.add_parser('status', help="показать состояние очереди и аренды обработчиков")
+
+    monitor_parser = commands.add_parser('monitor', help="следить за очередью до её опустошения")
+    monitor_parser.add_argument('--interval', type=float, default=5.0, help="период обновления, секунды")
+
+    drain_parser = commands.add_parser('drain', help="перестать выдавать адреса и дождаться обработчиков")
+    drain_parser.add_argument('--no-wait', action='store_true', help="не ждать завершения аренд")
+    commands.add_parser('resume', help="снова выдавать адреса после drain")
+
+    work_parser = commands.add_parser('work', help="запустить обработчики на этой машине")
+    work_parser.add_argument('--processes', type=int, default=1, help="число процессов")
+    work_parser.add_argument('--max-depth', type=int, default=2, help="глубина обхода")
+    work_parser.add_argument('--max-pages', type=int, help="лимит страниц на процесс")
+    work_parser.add_argument('--lease', type=float, default=300, help="срок аренды пачки адресов, секунды")
+    work_parser.add_argument('--max-workers', type=int, default=4, help="параллельных загрузок в процессе")
+    work_parser.add_argument('--min-interval', type=float, default=1.0,
+                             help="начальный интервал между запросами одного процесса, секунды")
+    args = parser.parse_args()
+
+    if args.command == 'seed':
+        added = seed(args.db, args.urls, reset=args.reset, requeue_failed=args.requeue_failed)
+        print(f"Добавлено адресов: {added}")
+    elif args.command == 'status':
+        frontier = CrawlFrontier(args.db)
+        try:
+            print_status(frontier)
+        finally:
+            frontier.close()
+    elif args.command == 'monitor':
+        monitor(args.db, interval=args.interval)
+    elif args.command == 'drain':
+        drain(args.db)
+        print("Выдача адресов остановлена")
+        if not args.no_wait:
+            monitor(args.db)
+    elif args.command == 'resume':
+        drain(args.db, draining=False)
+        print("Выдача адресов возобновлена")
+    elif args.command == 'work':
+        work(args.db, processes=args.processes, max_depth=args.max_depth, max_pages=args.max_pages,
+             lease_seconds=args.lease, max_workers=args.max_workers, min_interval=args.min_interval)
+
+
+if __name__ == "__main__":
+    main()
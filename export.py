@@ -0,0 +1,286 @@
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+import time
+
+from storage import connect, upgrade_schema
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Columns written by every format, in this order
+EXPORT_COLUMNS = ('id', 'name', 'audio', 'image', 'text', 'url', 'updated_at', 'deleted_at', 'canonical_id')
+
+FORMAT_SUFFIXES = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+}
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+
+
+def guess_format(path):
+    """(format, compression) from a file name such as objects.jsonl.gz"""
+    root, suffix = os.path.splitext(path)
+    compression = COMPRESSION_SUFFIXES.get(suffix.lower())
+    if compression:
+        suffix = os.path.splitext(root)[1]
+    return FORMAT_SUFFIXES.get(suffix.lower()), compression
+
+
+def iter_batches(conn, batch_size=10000, since=None, include_deleted=False):
+    """Yield lists of EXPORT_COLUMNS rows in id order, batch_size rows at a time.
+
+    Each batch continues after the last id of the previous one (keyset
+    pagination), so every query reads only its own rows through the
+    primary key and memory stays bounded by batch_size. With since set,
+    only rows updated or tombstoned after that time are returned, deleted
+    ones included.
+    """
+    conditions = ['id > ?']
+    params = []
+    if since is not None:
+        conditions.append('(updated_at > ? OR deleted_at > ?)')
+        params.extend([since, since])
+    elif not include_deleted:
+        conditions.append('deleted_at IS NULL')
+    query = f'''
+        SELECT {', '.join(EXPORT_COLUMNS)} FROM objects
+        WHERE {' AND '.join(conditions)}
+        ORDER BY id LIMIT ?
+    '''
+
+    last_id = -(1 << 63)
+    while True:
+        rows = conn.execute(query, [last_id] + params + [batch_size]).fetchall()
+        if not rows:
+            break
+        yield rows
+        last_id = rows[-1][0]
+
+
+class CsvWriter:
+    def __init__(self, stream):
+        self.text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        self.writer = csv.writer(self.text)
+        self.writer.writerow(EXPORT_COLUMNS)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        # Leave the stream open, its owner closes it
+        self.text.flush()
+        self.text.detach()
+
+
+class JsonlWriter:
+    def __init__(self, stream):
+        self.text = io.TextIOWrapper(stream, encoding='utf-8', newline='\n')
+
+    def write(self, rows):
+        self.text.write(''.join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows
+        ))
+
+    def close(self):
+        self.text.flush()
+        self.text.detach()
+
+
+def arrow_schema():
+    return pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('name', pyarrow.string()),
+        ('audio', pyarrow.string()),
+        ('image', pyarrow.string()),
+        ('text', pyarrow.string()),
+        ('url', pyarrow.string()),
+        ('updated_at', pyarrow.float64()),
+        ('deleted_at', pyarrow.float64()),
+        ('canonical_id', pyarrow.int64()),
+    ])
+
+
+class ArrowWriter:
+    """Parquet or Arrow IPC file written one record batch (row group) per export batch"""
+
+    def __init__(self, stream, format, compression=None):
+        self.schema = arrow_schema()
+        if format == 'parquet':
+            # Parquet compresses column chunks itself; without a codec it uses snappy
+            self.writer = pyarrow.parquet.ParquetWriter(stream, self.schema, compression=compression or 'snappy')
+        else:
+            options = pyarrow.ipc.IpcWriteOptions(compression=compression)
+            self.writer = pyarrow.ipc.new_file(stream, self.schema, options=options)
+
+    def write(self, rows):
+        arrays = [pyarrow.array(column, type=field.type) for column, field in zip(zip(*rows), self.schema)]
+        self.writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def compressed(raw, compression=None):
+    """Wrap a binary stream in a gzip or zstd compressor that leaves it open when closed"""
+    if compression is None:
+        return None
+    if compression == 'gzip':
+        # Level 6 is several times faster than the default 9 at nearly the same size
+        return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=False)
+    raise ValueError(f"Unknown compression: {compression!r}")
+
+
+def make_writer(stream, format, compression=None):
+    if format == 'csv':
+        return CsvWriter(stream)
+    if format == 'jsonl':
+        return JsonlWriter(stream)
+    if format in ('parquet', 'arrow'):
+        return ArrowWriter(stream, format, compression)
+    raise ValueError(f"Unknown export format: {format!r}")
+
+
+def export_objects(db_name, path, format=None, compression=None, batch_size=10000, incremental=False,
+                   name='default', include_deleted=False):
+    """Stream objects into a CSV, JSONL, Parquet or Arrow file.
+
+    format and compression default to what the file name says
+    (objects.csv.gz, objects.parquet). Parquet and Arrow need pyarrow and
+    compress internally; CSV and JSONL are wrapped in gzip or zstd. The
+    file is written under a temporary name and renamed when complete.
+    With incremental=True only rows changed since the last successful
+    export under the same name are written; the high-water mark is kept
+    in the exports table. ValueError is raised when a full save has
+    replaced the table since then, or rows have no updated_at. Returns
+    {'rows', 'since', 'watermark'}.
+    """
+    guessed_format, guessed_compression = guess_format(path)
+    format = format or guessed_format
+    if format is None:
+        raise ValueError(f"Cannot tell the export format from {path!r}, pass format=")
+    if format in ('parquet', 'arrow'):
+        if pyarrow is None:
+            raise RuntimeError(f"{format} export needs the pyarrow package")
+    else:
+        compression = compression or guessed_compression
+        if compression == 'zstd' and zstandard is None:
+            raise RuntimeError("zstd compression needs the zstandard package")
+
+    conn = connect(db_name)
+    try:
+        upgrade_schema(conn)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS exports (
+                name TEXT PRIMARY KEY,
+                watermark REAL,
+                exported_at REAL NOT NULL,
+                rows INTEGER NOT NULL
+            )
+        ''')
+        conn.commit()
+
+        since = None
+        if incremental:
+            row = conn.execute('SELECT watermark FROM exports WHERE name = ?', (name,)).fetchone()
+            since = row[0] if row and row[0] is not None else None
+
+        target = path if path == '-' else path + '.tmp'
+        rows = 0
+        # One read transaction: every batch sees the same snapshot, while writers carry on (WAL)
+        conn.execute('BEGIN')
+        try:
+            # Rows removed by a full save are gone without a tombstone, and rows from before updated_at
+            # existed carry none, so a delta would silently leave out those changes
+            if incremental and since is not None and conn.execute(
+                    'SELECT 1 FROM full_saves WHERE saved_at > ? LIMIT 1', (since,)).fetchone():
+                raise ValueError("The table was replaced by a full save since the last export; "
+                                 "export it once without incremental")
+            if incremental and conn.execute('SELECT 1 FROM objects WHERE updated_at IS NULL LIMIT 1').fetchone():
+                raise ValueError("Incremental export needs rows with updated_at; the table has rows written "
+                                 "before it was tracked, export it without incremental")
+            # Upserts stamp updated_at while holding the write lock, so nothing committed after this
+            # snapshot can carry an older time than the newest one in it
+            watermark = conn.execute(
+                'SELECT MAX(COALESCE(MAX(updated_at), 0), COALESCE(MAX(deleted_at), 0)) FROM objects'
+            ).fetchone()[0]
+            raw = sys.stdout.buffer if path == '-' else open(target, 'wb')
+            try:
+                compressor = compressed(raw, compression) if format in ('csv', 'jsonl') else None
+                writer = make_writer(compressor or raw, format, compression)
+                for batch in iter_batches(conn, batch_size, since, include_deleted):
+                    writer.write(batch)
+                    rows += len(batch)
+                writer.close()
+                if compressor:
+                    compressor.close()
+            except BaseException:
+                if path != '-':
+                    raw.close()
+                    os.remove(target)
+                raise
+            finally:
+                if path == '-':
+                    raw.flush()
+                else:
+                    raw.close()
+        finally:
+            conn.rollback()
+
+        if path != '-':
+            os.replace(target, path)
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO exports (name, watermark, exported_at, rows) VALUES (?, ?, ?, ?)',
+                (name, watermark if watermark else since, time.time(), rows)
+            )
+    finally:
+        conn.close()
+
+    return {'rows': rows, 'since': since, 'watermark': watermark}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Потоковая выгрузка таблицы objects в CSV, JSONL, Parquet или Arrow")
+    parser.add_argument('output', help="файл выгрузки, например objects.jsonl.gz; '-' — стандартный вывод")
+    parser.add_argument('--db', default='khpet27_data.db', help="файл базы данных")
+    parser.add_argument('--format', choices=['csv', 'jsonl', 'parquet', 'arrow'], help="формат (по умолчанию по имени файла)")
+    parser.add_argument('--compression', choices=['gzip', 'zstd', 'snappy', 'lz4'],
+                        help="сжатие (по умолчанию по имени файла)")
+    parser.add_argument('--batch-size', type=int, default=10000, help="строк в одном запросе")
+    parser.add_argument('--incremental', action='store_true', help="только строки, изменённые после прошлой выгрузки")
+    parser.add_argument('--name', default='default', help="имя выгрузки для --incremental")
+    parser.add_argument('--include-deleted', action='store_true', help="выгрузить и удалённые записи")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    stats = export_objects(args.db, args.output, format=args.format, compression=args.compression,
+                           batch_size=args.batch_size, incremental=args.incremental, name=args.name,
+                           include_deleted=args.include_deleted)
+    elapsed = time.perf_counter() - started
+    # Keep stdout clean when the export itself goes there
+    out = sys.stderr if args.output == '-' else sys.stdout
+    print(f"Выгружено строк: {stats['rows']} за {elapsed:.1f} с", file=out)
+
+
+if __name__ == "__main__":
+    main()
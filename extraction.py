@@ -0,0 +1,234 @@
+import re
+
+from bs4 import SoupStrainer
+from bs4.element import Tag
+
+# Supported selector syntax: compounds like tag, .class, #id, tag.class#id
+# joined by descendant combinators (whitespace)
+COMPOUND_PATTERN = re.compile(r'([a-zA-Z][\w-]*)?((?:[.#][\w-]+)*)')
+
+
+class Compound:
+    """One compound selector such as div.item or #product_description"""
+
+    __slots__ = ('name', 'classes', 'id')
+
+    def __init__(self, text):
+        match = COMPOUND_PATTERN.fullmatch(text)
+        if not match or not text:
+            raise ValueError(f"Unsupported selector: {text!r}")
+        self.name = match.group(1)
+        self.classes = frozenset(re.findall(r'\.([\w-]+)', match.group(2)))
+        ids = re.findall(r'#([\w-]+)', match.group(2))
+        self.id = ids[0] if ids else None
+
+    def matches(self, name, attrs):
+        if self.name and name != self.name:
+            return False
+        if self.id and attrs.get('id') != self.id:
+            return False
+        if self.classes:
+            tag_classes = attrs.get('class') or ()
+            if isinstance(tag_classes, str):
+                tag_classes = tag_classes.split()
+            if not self.classes.issubset(tag_classes):
+                return False
+        return True
+
+
+class Selector:
+    """A chain of compounds joined by descendant combinators"""
+
+    def __init__(self, text):
+        self.text = text
+        self.compounds = [Compound(part) for part in text.split()]
+        self.last = self.compounds[-1]
+        # Ancestor compounds, nearest first
+        self.ancestors = self.compounds[-2::-1]
+
+    def matches(self, tag):
+        if not self.last.matches(tag.name, tag.attrs):
+            return False
+        if not self.ancestors:
+            return True
+        # Greedy nearest-ancestor matching is exact for descendant combinators
+        index = 0
+        for parent in tag.parents:
+            if parent.parent is None:
+                break
+            if self.ancestors[index].matches(parent.name, parent.attrs):
+                index += 1
+                if index == len(self.ancestors):
+                    return True
+        return False
+
+
+class FieldRule:
+    """Priority-ordered selectors for one output field.
+
+    For a single-value rule the first selector that matches anything wins;
+    with skip_empty=True a falsy extracted value moves on to the next
+    selector. With all_matches=True the field is a list of every match,
+    grouped by selector in priority order.
+    """
+
+    def __init__(self, name, selectors, extract=None, all_matches=False, skip_empty=False, default=None):
+        self.name = name
+        self.selectors = list(selectors)
+        self.extract = extract or (lambda element: element)
+        self.all_matches = all_matches
+        self.skip_empty = skip_empty
+        self.default = default
+
+
+class ExtractionRules:
+    """Field rules compiled once and evaluated in a single traversal of the tree"""
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.selectors = {}
+        self.collect_all = set()
+        # Single-value rules using each selector, with the selector's priority in the rule
+        self._users = {}
+        for rule in self.rules:
+            for priority, text in enumerate(rule.selectors):
+                if text not in self.selectors:
+                    self.selectors[text] = Selector(text)
+                    self._users[text] = []
+                if rule.all_matches:
+                    self.collect_all.add(text)
+                else:
+                    self._users[text].append((rule, priority))
+
+        # Index selectors by what their last compound requires, to skip most checks per tag
+        self._by_name = {}
+        self._by_class = {}
+        self._by_id = {}
+        self._universal = []
+        for selector in self.selectors.values():
+            last = selector.last
+            if last.name:
+                self._by_name.setdefault(last.name, []).append(selector)
+            elif last.id:
+                self._by_id.setdefault(last.id, []).append(selector)
+            elif last.classes:
+                self._by_class.setdefault(next(iter(last.classes)), []).append(selector)
+            else:
+                self._universal.append(selector)
+
+    def strainer(self):
+        """SoupStrainer keeping the subtrees every selector starts from"""
+        # The strainer runs for every start tag while parsing, so index the roots too
+        by_name = {}
+        by_class = {}
+        by_id = {}
+        for selector in self.selectors.values():
+            root = selector.compounds[0]
+            if root.name:
+                by_name.setdefault(root.name, []).append(root)
+            elif root.id:
+                by_id.setdefault(root.id, []).append(root)
+            else:
+                by_class.setdefault(next(iter(root.classes)), []).append(root)
+
+        def keep(name, attrs):
+            candidates = by_name.get(name, [])
+            if attrs:
+                if attrs.get('id') in by_id:
+                    candidates = candidates + by_id[attrs['id']]
+                tag_classes = attrs.get('class') or ()
+                if isinstance(tag_classes, str):
+                    tag_classes = tag_classes.split()
+                for class_name in tag_classes:
+                    if class_name in by_class:
+                        candidates = candidates + by_class[class_name]
+            return any(root.matches(name, attrs) for root in candidates)
+
+        return SoupStrainer(keep)
+
+    def find(self, soup):
+        """Walk the tree once and return the matched elements per selector.
+
+        Selectors used by all_matches rules get every match, the others only
+        their first one.
+        """
+        found = {text: [] for text in self.selectors}
+        for element in soup.descendants:
+            if not isinstance(element, Tag):
+                continue
+            for selector in self._candidates(element):
+                matches = found[selector.text]
+                if matches and (selector.text not in self.collect_all or matches[-1] is element):
+                    continue
+                if selector.matches(element):
+                    matches.append(element)
+        return found
+
+    def extract(self, soup):
+        """Evaluate every field rule against the soup.
+
+        Single-value fields are settled as soon as their highest-priority
+        selector yields a value, and the walk stops once every field is
+        settled and no rule needs all matches.
+        """
+        found = {text: [] for text in self.collect_all}
+        # Per rule: priority of the best selector seen so far and its value
+        best = {}
+        for rule in self.rules:
+            if not rule.all_matches:
+                best[rule] = (len(rule.selectors), rule.default)
+        unsettled = sum(1 for priority, _ in best.values() if priority > 0)
+        seen = set()
+
+        for element in soup.descendants:
+            if not isinstance(element, Tag):
+                continue
+            for selector in self._candidates(element):
+                text = selector.text
+                collect = text in found
+                if text in seen and not collect:
+                    continue
+                if collect and found[text] and found[text][-1] is element:
+                    continue
+                if not selector.matches(element):
+                    continue
+
+                if collect:
+                    found[text].append(element)
+                if text in seen:
+                    continue
+                # Only the first match of a selector counts, as with select_one()
+                seen.add(text)
+                for rule, priority in self._users[text]:
+                    if priority >= best[rule][0]:
+                        continue
+                    value = rule.extract(element)
+                    if value or not rule.skip_empty:
+                        best[rule] = (priority, value)
+                        if priority == 0:
+                            unsettled -= 1
+            if not unsettled and not found:
+                break
+
+        result = {}
+        for rule in self.rules:
+            if rule.all_matches:
+                result[rule.name] = [
+                    rule.extract(element) for text in rule.selectors for element in found[text]
+                ]
+            else:
+                result[rule.name] = best[rule][1]
+        return result
+
+    def _candidates(self, element):
+        candidates = self._by_name.get(element.name, [])
+        element_id = element.attrs.get('id')
+        if element_id in self._by_id:
+            candidates = candidates + self._by_id[element_id]
+        if self._by_class:
+            for name in element.attrs.get('class') or ():
+                if name in self._by_class:
+                    candidates = candidates + self._by_class[name]
+        if self._universal:
+            candidates = candidates + self._universal
+        return candidates
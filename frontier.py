@@ -0,0 +1,193 @@
+import os
+import socket
+import time
+
+from storage import connect
+
+# Columns added to the original frontier table for leased, multi-process crawls
+LEASE_COLUMNS = [
+    ('lease_owner', 'TEXT'),
+    ('lease_expires', 'REAL'),
+    ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+
+def default_worker_id():
+    """Host and process id, unique among workers sharing one database"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class CrawlFrontier:
+    """Persistent breadth-first URL frontier kept next to the objects table.
+
+    Several worker processes can share one frontier: claim() leases pending
+    entries to a worker for lease_seconds inside a write transaction, so no
+    two workers get the same URL. A worker that dies simply stops completing
+    its entries; once the lease expires they go back to pending (or to
+    failed after max_attempts leases), so no URL is lost.
+    """
+
+    def __init__(self, db_name, max_attempts=3):
+        self.db_name = db_name
+        self.max_attempts = max_attempts
+        self.conn = connect(db_name)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS frontier (
+                url TEXT PRIMARY KEY,
+                depth INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                discovered_at REAL NOT NULL,
+                updated_at REAL
+            )
+        ''')
+        existing = {row[1] for row in self.conn.execute('PRAGMA table_info(frontier)')}
+        for name, column_type in LEASE_COLUMNS:
+            if name not in existing:
+                self.conn.execute(f'ALTER TABLE frontier ADD COLUMN {name} {column_type}')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_frontier_status ON frontier (status, depth)')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS frontier_control (
+                name TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        self.conn.commit()
+
+    def add(self, urls):
+        """Queue (url, depth, kind) tuples, ignoring URLs that are already known"""
+        now = time.time()
+        with self.conn:
+            cursor = self.conn.executemany(
+                'INSERT OR IGNORE INTO frontier (url, depth, kind, discovered_at) VALUES (?, ?, ?, ?)',
+                [(url, depth, kind, now) for url, depth, kind in urls]
+            )
+        return cursor.rowcount
+
+    def next_batch(self, limit):
+        """Return up to limit pending entries as (rowid, url, depth, kind), shallowest first"""
+        return self.conn.execute('''
+            SELECT rowid, url, depth, kind FROM frontier
+            WHERE status = 'pending'
+            ORDER BY depth, rowid
+            LIMIT ?
+        ''', (limit,)).fetchall()
+
+    def claim(self, worker_id, limit, lease_seconds=300):
+        """Lease up to limit pending entries to a worker, shallowest first.
+
+        Returns them as (rowid, url, depth, kind) like next_batch(). Nothing
+        is handed out while the frontier is draining.
+        """
+        now = time.time()
+        # IMMEDIATE takes the write lock before reading, so concurrent claims cannot pick the same rows
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._reclaim(now)
+            batch = []
+            if not self.is_draining():
+                batch = self.conn.execute('''
+                    SELECT rowid, url, depth, kind FROM frontier
+                    WHERE status = 'pending'
+                    ORDER BY depth, rowid
+                    LIMIT ?
+                ''', (limit,)).fetchall()
+                self.conn.executemany('''
+                    UPDATE frontier
+                    SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1,
+                        updated_at = ?
+                    WHERE rowid = ?
+                ''', [(worker_id, now + lease_seconds, now, entry[0]) for entry in batch])
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        return batch
+
+    def release(self, worker_id):
+        """Return a worker's unfinished leases to pending, e.g. when it shuts down"""
+        with self.conn:
+            cursor = self.conn.execute('''
+                UPDATE frontier
+                SET status = 'pending', lease_owner = NULL, lease_expires = NULL, attempts = attempts - 1
+                WHERE status = 'leased' AND lease_owner = ?
+            ''', (worker_id,))
+        return cursor.rowcount
+
+    def reclaim(self):
+        """Requeue entries whose lease has expired; returns (requeued, failed)"""
+        with self.conn:
+            return self._reclaim(time.time())
+
+    def _reclaim(self, now):
+        # An entry whose lease keeps expiring probably kills its worker, so it is given up on
+        failed = self.conn.execute('''
+            UPDATE frontier SET status = 'failed', lease_owner = NULL, lease_expires = NULL, updated_at = ?
+            WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?
+        ''', (now, now, self.max_attempts)).rowcount
+        requeued = self.conn.execute('''
+            UPDATE frontier SET status = 'pending', lease_owner = NULL, lease_expires = NULL, updated_at = ?
+            WHERE status = 'leased' AND lease_expires < ?
+        ''', (now, now)).rowcount
+        return requeued, failed
+
+    def complete(self, url, status='done', discovered=()):
+        """Checkpoint one URL together with the links found on it in a single transaction"""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO frontier (url, depth, kind, discovered_at) VALUES (?, ?, ?, ?)',
+                [(link, depth, kind, now) for link, depth, kind in discovered]
+            )
+            self.conn.execute(
+                'UPDATE frontier SET status = ?, updated_at = ?, lease_owner = NULL, lease_expires = NULL '
+                'WHERE url = ?',
+                (status, now, url)
+            )
+
+    def requeue_failed(self):
+        """Give failed entries another round of attempts"""
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE frontier SET status = 'pending', attempts = 0, updated_at = ? WHERE status = 'failed'",
+                (time.time(),)
+            )
+        return cursor.rowcount
+
+    def counts(self):
+        """Number of frontier entries per status"""
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM frontier GROUP BY status'))
+
+    def leases(self):
+        """(worker_id, leased entries, earliest lease expiry) per worker holding leases"""
+        return self.conn.execute('''
+            SELECT lease_owner, COUNT(*), MIN(lease_expires) FROM frontier
+            WHERE status = 'leased'
+            GROUP BY lease_owner
+            ORDER BY lease_owner
+        ''').fetchall()
+
+    def is_finished(self):
+        """True when nothing is pending or leased any more"""
+        counts = self.counts()
+        return not counts.get('pending') and not counts.get('leased')
+
+    def set_draining(self, draining=True):
+        """Stop (or resume) handing out work; leased entries are still completed"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO frontier_control (name, value) VALUES ('draining', ?)",
+                ('1' if draining else '0',)
+            )
+
+    def is_draining(self):
+        row = self.conn.execute("SELECT value FROM frontier_control WHERE name = 'draining'").fetchone()
+        return bool(row) and row[0] == '1'
+
+    def reset(self):
+        """Forget the whole frontier so the next crawl starts from scratch"""
+        with self.conn:
+            self.conn.execute('DELETE FROM frontier')
+
+    def close(self):
+        self.conn.close()
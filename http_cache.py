@@ -0,0 +1,160 @@
+import json
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Headers that describe the transfer rather than the cached body
+SKIPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection'}
+
+# Request headers that make a GET conditional
+CONDITIONAL_HEADERS = {'if-none-match', 'if-modified-since'}
+
+
+class CacheMiss(requests.RequestException):
+    """Raised in offline mode when a URL has no cached copy"""
+
+
+class HttpCache:
+    """Persistent response cache with ETag/Last-Modified revalidation and LRU eviction"""
+
+    def __init__(self, path="http_cache.db", max_size=200 * 1024 * 1024, offline=False):
+        self.path = path
+        self.max_size = max_size
+        # offline=True serves only cached responses and never touches the network
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                content BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)')
+        self._conn.commit()
+
+    def get(self, session, url, headers=None, timeout=10, validate=None):
+        """Fetch url through the cache, revalidating stored copies with a conditional GET.
+
+        validate, if given, is called with the streamed 200 response before it
+        is read and stored; it may raise to reject the body.
+        """
+        entry = self._lookup(url)
+
+        if self.offline:
+            if entry is None:
+                raise CacheMiss(f"No cached copy of {url}")
+            self._touch(url)
+            return self._build_response(url, entry)
+
+        request_headers = dict(headers or {})
+        if entry is not None:
+            if entry['etag']:
+                request_headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                request_headers['If-Modified-Since'] = entry['last_modified']
+
+        response = session.get(url, headers=request_headers, timeout=timeout, stream=validate is not None)
+
+        if response.status_code == 304:
+            response.close()
+            if entry is not None:
+                self._touch(url)
+                return self._build_response(url, entry)
+            # Nothing cached to stand in for the empty 304 body: ask again for the full page
+            request_headers = {
+                name: value for name, value in request_headers.items()
+                if name.lower() not in CONDITIONAL_HEADERS
+            }
+            response = session.get(url, headers=request_headers, timeout=timeout, stream=validate is not None)
+
+        if response.status_code == 200:
+            if validate is not None:
+                validate(response)
+            self._store(url, response)
+
+        return response
+
+    def clear(self):
+        """Drop every cached response"""
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def _lookup(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT status, headers, content, etag, last_modified FROM responses WHERE url = ?',
+                (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, headers, content, etag, last_modified = row
+        return {
+            'status': status,
+            'headers': json.loads(headers),
+            'content': content,
+            'etag': etag,
+            'last_modified': last_modified,
+        }
+
+    def _touch(self, url):
+        with self._lock:
+            self._conn.execute('UPDATE responses SET last_access = ? WHERE url = ?', (time.time(), url))
+            self._conn.commit()
+
+    def _store(self, url, response):
+        content = response.content
+        headers = {
+            name: value for name, value in response.headers.items()
+            if name.lower() not in SKIPPED_HEADERS
+        }
+        now = time.time()
+        with self._lock:
+            self._conn.execute('''
+                INSERT OR REPLACE INTO responses
+                    (url, status, headers, content, etag, last_modified, size, fetched_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (url, response.status_code, json.dumps(headers), content,
+                  response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                  len(content), now, now))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Delete least recently used entries until the cache fits in max_size"""
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        cursor = self._conn.execute('SELECT url, size FROM responses ORDER BY last_access')
+        expired = []
+        for url, size in cursor:
+            if total <= self.max_size:
+                break
+            expired.append((url,))
+            total -= size
+        self._conn.executemany('DELETE FROM responses WHERE url = ?', expired)
+
+    def _build_response(self, url, entry):
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response._content = entry['content']
+        response.url = url
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.from_cache = True
+        return response
@@ -0,0 +1,126 @@
+import os
+import random
+import threading
+from urllib.parse import unquote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Links to these files are never worth downloading as pages
+DENIED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.bmp', '.ico', '.tif', '.tiff',
+    '.mp3', '.wav', '.ogg', '.mp4', '.avi', '.mov', '.webm',
+    '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.odt', '.rtf',
+    '.zip', '.rar', '.7z', '.gz', '.tar', '.exe', '.apk',
+}
+
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+
+# Bodies larger than this are not pages we want to parse
+MAX_BODY_SIZE = 5 * 1024 * 1024
+
+_shared_session = None
+_shared_lock = threading.Lock()
+
+
+class SkippedContent(requests.RequestException):
+    """Raised when a URL or response is rejected before its body is downloaded"""
+
+
+class JitteredRetry(Retry):
+    """Retry policy that spreads exponential backoff with random jitter"""
+
+    # Each backoff is scaled by a random factor in [1 - JITTER, 1 + JITTER]
+    JITTER = 0.5
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return backoff
+        return backoff * random.uniform(1 - self.JITTER, 1 + self.JITTER)
+
+
+def create_session(pool_connections=10, pool_maxsize=10, max_retries=3,
+                   backoff_factor=0.5, status_forcelist=RETRY_STATUSES):
+    """Create a keep-alive session with a connection pool and retries"""
+    retry = JitteredRetry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=status_forcelist,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True,
+        # Hand the last response back so callers can still raise_for_status()
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    """Return the session shared by all scrapers, creating it on first use"""
+    global _shared_session
+    with _shared_lock:
+        if _shared_session is None:
+            _shared_session = create_session()
+        return _shared_session
+
+
+def configure_session(**kwargs):
+    """Replace the shared session with one built from create_session() arguments"""
+    global _shared_session
+    session = create_session(**kwargs)
+    with _shared_lock:
+        old_session, _shared_session = _shared_session, session
+    if old_session is not None:
+        old_session.close()
+    return session
+
+
+def is_denied_url(url):
+    """Check whether a URL points at a file type that is never an HTML page"""
+    path = unquote(urlparse(url).path).lower()
+    return os.path.splitext(path)[1] in DENIED_EXTENSIONS
+
+
+def read_html_body(response, max_bytes=MAX_BODY_SIZE):
+    """Read a streamed response only if it is HTML and no larger than max_bytes.
+
+    The connection is dropped as soon as the headers or the running body
+    size show that the page is not worth keeping.
+    """
+    content_type = response.headers.get('Content-Type', '')
+    if content_type and not content_type.lower().startswith(HTML_CONTENT_TYPES):
+        response.close()
+        raise SkippedContent(f"not HTML ({content_type})", response=response)
+
+    declared_size = response.headers.get('Content-Length')
+    if declared_size and declared_size.isdigit() and int(declared_size) > max_bytes:
+        response.close()
+        raise SkippedContent(f"body of {declared_size} bytes exceeds {max_bytes}", response=response)
+
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        size += len(chunk)
+        if size > max_bytes:
+            response.close()
+            raise SkippedContent(f"body exceeds {max_bytes} bytes", response=response)
+        chunks.append(chunk)
+
+    response._content = b''.join(chunks)
+    return response
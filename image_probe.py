@@ -0,0 +1,301 @@
+import argparse
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from http_client import get_session
+from media import CONTENT_RANGE_PATTERN
+from rate_limit import HostLimiter
+from storage import connect, upgrade_schema
+
+# At most this many bytes are requested per image; JPEG EXIF blocks before the size are rarely longer
+PROBE_SIZE = 64 * 1024
+
+# Bytes read from the response between parse attempts
+CHUNK_SIZE = 4096
+
+# JPEG start-of-frame markers, the segments that carry the image size (not DHT, JPG or DAC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# File signatures of the supported formats
+SIGNATURES = (b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a', b'RIFF', b'\xff\xd8')
+
+# Answers that may be different on the next try; the image is left pending instead of marked as unreadable
+RETRY_STATUSES = {408, 429}
+
+# Seconds before a temporary failure is probed again; doubled after every further failure up to MAX_RETRY_DELAY
+RETRY_DELAY = 300
+MAX_RETRY_DELAY = 24 * 3600
+
+# Objects still to be probed: an http(s) image whose metadata is missing or belongs to an older image URL
+PENDING = "image LIKE 'http%' AND image_probed IS NOT image"
+
+
+def image_info(data):
+    """(format, width, height) read from the first bytes of an image file.
+
+    Returns None while data is too short to tell, and raises ValueError if
+    the bytes are not a JPEG, PNG, GIF or WebP image.
+    """
+    if len(data) < 12 and any(data[:len(signature)] == signature[:len(data)] for signature in SIGNATURES):
+        return None
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        if len(data) < 24:
+            return None
+        width, height = struct.unpack('>II', data[16:24])
+        return 'png', width, height
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        if len(data) < 10:
+            return None
+        width, height = struct.unpack('<HH', data[6:10])
+        return 'gif', width, height
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return _webp_info(data)
+    if data[:2] == b'\xff\xd8':
+        return _jpeg_info(data)
+    raise ValueError("not a JPEG, PNG, GIF or WebP image")
+
+
+def _webp_info(data):
+    if len(data) < 30:
+        return None
+    chunk = data[12:16]
+    if chunk == b'VP8 ':
+        # Lossy: a key frame header with the 14-bit sizes after its start code
+        if data[23:26] != b'\x9d\x01\x2a':
+            raise ValueError("broken VP8 frame header")
+        width, height = struct.unpack('<HH', data[26:30])
+        return 'webp', width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L':
+        # Lossless: a signature byte, then width - 1 and height - 1 in 14 bits each
+        if data[20] != 0x2F:
+            raise ValueError("broken VP8L header")
+        bits = struct.unpack('<I', data[21:25])[0]
+        return 'webp', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        # Extended: the canvas size as two 24-bit numbers minus one
+        width = int.from_bytes(data[24:27], 'little') + 1
+        height = int.from_bytes(data[27:30], 'little') + 1
+        return 'webp', width, height
+    raise ValueError(f"unknown WebP chunk {chunk!r}")
+
+
+def _jpeg_info(data):
+    # Walk the segments after SOI until a start-of-frame segment
+    position = 2
+    while True:
+        if position + 4 > len(data):
+            return None
+        if data[position] != 0xFF:
+            raise ValueError("broken JPEG segment")
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            position += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without a length
+            position += 2
+            continue
+        if marker == 0xD9 or marker == 0xDA:
+            raise ValueError("JPEG without a frame header")
+        length = struct.unpack('>H', data[position + 2:position + 4])[0]
+        if marker in JPEG_SOF_MARKERS:
+            if position + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[position + 5:position + 9])
+            return 'jpeg', width, height
+        position += 2 + length
+
+
+class ImageProber:
+    """Image format, size and file length of objects.image, read from the first bytes of each file.
+
+    Every image is requested with Range: bytes=0-<probe_size - 1> and
+    streamed only until its header can be parsed, then the connection is
+    dropped, so a few KB are transferred instead of the whole file. A
+    server that ignores Range is handled the same way. enrich() stores the
+    result in the image_* columns of every object using that URL; an
+    image that cannot be read gets image_format NULL. image_probed holds
+    the URL the metadata belongs to, so an object whose image changes is
+    probed again. Timeouts, connection errors, 408/429 and 5xx answers
+    leave the image pending; the image_retries table holds it back for
+    retry_delay seconds, doubling after every further failure up to
+    max_retry_delay, so enrich() does not ask a struggling server again
+    on every call.
+    """
+
+    def __init__(self, db_name, session=None, limiter=None, max_workers=8, probe_size=PROBE_SIZE, timeout=15,
+                 retry_delay=RETRY_DELAY, max_retry_delay=MAX_RETRY_DELAY):
+        self.db_name = db_name
+        self.session = session or get_session()
+        self.max_workers = max_workers
+        self.limiter = limiter or HostLimiter(max_per_host=max_workers, min_interval=0.1)
+        self.probe_size = probe_size
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # enrich() may be called from another thread than the one that built the prober
+        self.conn = connect(db_name, check_same_thread=False)
+        self._schema_ready = False
+
+    def _ensure_schema(self):
+        if self._schema_ready:
+            return
+        upgrade_schema(self.conn)
+        # Keeps the search for unprobed rows from scanning the whole table after every save
+        self.conn.execute(f'CREATE INDEX IF NOT EXISTS idx_objects_image_pending ON objects (id) WHERE {PENDING}')
+        # Image URLs whose last probe failed temporarily, and when to try them again
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS image_retries (
+                url TEXT PRIMARY KEY,
+                attempts INTEGER NOT NULL,
+                retry_at REAL NOT NULL
+            )
+        ''')
+        self.conn.commit()
+        self._schema_ready = True
+
+    def probe(self, url):
+        """{'format', 'width', 'height', 'bytes', 'read', 'error', 'retry'} for one image URL.
+
+        bytes is the full file length; retry is True when the failure may
+        be temporary.
+        """
+        result = {'format': None, 'width': None, 'height': None, 'bytes': None, 'read': 0, 'error': None,
+                  'retry': False}
+        try:
+            with self.limiter.slot(url) as ticket:
+                response = self.session.get(url, headers={'Range': f'bytes=0-{self.probe_size - 1}'},
+                                            stream=True, timeout=self.timeout)
+                ticket.record(response.status_code)
+            with response:
+                if response.status_code not in (200, 206):
+                    result['error'] = f"HTTP {response.status_code}"
+                    result['retry'] = response.status_code >= 500 or response.status_code in RETRY_STATUSES
+                    return result
+                result['bytes'] = self._file_length(response)
+
+                data = bytearray()
+                info = None
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    data += chunk
+                    result['read'] = len(data)
+                    info = image_info(data)
+                    if info or len(data) >= self.probe_size:
+                        break
+                if info is None:
+                    result['error'] = f"no image size in the first {len(data)} bytes"
+                    return result
+                result['format'], result['width'], result['height'] = info
+        except ValueError as e:
+            result['error'] = str(e)
+        except requests.RequestException as e:
+            result['error'] = str(e)
+            result['retry'] = True
+        return result
+
+    def _file_length(self, response):
+        if response.status_code == 206:
+            match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+            if match and match.group(3) != '*':
+                return int(match.group(3))
+            return None
+        length = response.headers.get('Content-Length')
+        # A compressed transfer says nothing about the file itself
+        if length and length.isdigit() and not response.headers.get('Content-Encoding'):
+            return int(length)
+        return None
+
+    def enrich(self, limit=None, batch_size=200):
+        """Probe the images of objects not probed yet, max_workers at a time; returns counters.
+
+        Images held back after a temporary failure are skipped until their
+        retry time.
+        """
+        self._ensure_schema()
+        stats = {'objects': 0, 'images': 0, 'failed': 0, 'retry': 0, 'bytes_read': 0}
+        started = time.time()
+        last_id = -(1 << 63)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while limit is None or stats['objects'] < limit:
+                size = batch_size if limit is None else min(batch_size, limit - stats['objects'])
+                rows = self.conn.execute(f'''
+                    SELECT objects.id, objects.image, image_retries.attempts FROM objects
+                    LEFT JOIN image_retries ON image_retries.url = objects.image
+                    WHERE {PENDING} AND objects.id > ?
+                        AND (image_retries.retry_at IS NULL OR image_retries.retry_at <= ?)
+                    ORDER BY objects.id LIMIT ?
+                ''', (last_id, started, size)).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+
+                # Objects sharing an image URL share one probe
+                attempts = {image: count or 0 for _, image, count in rows}
+                urls = list(attempts)
+                results = dict(zip(urls, executor.map(self.probe, urls)))
+                for result in results.values():
+                    stats['images'] += 1
+                    stats['bytes_read'] += result['read']
+                    if result['retry']:
+                        stats['retry'] += 1
+                    elif result['error']:
+                        stats['failed'] += 1
+
+                updates = []
+                for object_id, image, _ in rows:
+                    result = results[image]
+                    if result['retry']:
+                        # Left pending; keyset paging keeps this run from asking again, retry_at later ones
+                        continue
+                    updates.append((result['format'], result['width'], result['height'], result['bytes'], image,
+                                    object_id, image))
+                now = time.time()
+                retries = [(url, attempts[url] + 1,
+                            now + min(self.max_retry_delay, self.retry_delay * 2 ** min(attempts[url], 16)))
+                           for url, result in results.items() if result['retry']]
+                self.conn.execute('BEGIN IMMEDIATE')
+                with self.conn:
+                    self.conn.executemany(
+                        'INSERT OR REPLACE INTO image_retries (url, attempts, retry_at) VALUES (?, ?, ?)', retries
+                    )
+                    self.conn.executemany('DELETE FROM image_retries WHERE url = ?',
+                                          [(url,) for url, result in results.items() if not result['retry']])
+                    # Only rows whose image is still the probed one; a concurrent upsert may have changed it
+                    self.conn.executemany('''
+                        UPDATE objects
+                        SET image_format = ?, image_width = ?, image_height = ?, image_bytes = ?, image_probed = ?
+                        WHERE id = ? AND image = ?
+                    ''', updates)
+                stats['objects'] += len(rows)
+        return stats
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Размеры и формат изображений по первым байтам файлов")
+    parser.add_argument('--db', default='khpet27_data.db', help="файл базы данных")
+    parser.add_argument('--limit', type=int, help="сколько записей проверить")
+    parser.add_argument('--workers', type=int, default=8, help="параллельных запросов")
+    parser.add_argument('--probe-size', type=int, default=PROBE_SIZE, help="максимум байт на изображение")
+    args = parser.parse_args()
+
+    prober = ImageProber(args.db, max_workers=args.workers, probe_size=args.probe_size)
+    started = time.perf_counter()
+    try:
+        stats = prober.enrich(limit=args.limit)
+    finally:
+        prober.close()
+    elapsed = time.perf_counter() - started
+    print(f"Записей: {stats['objects']}, изображений: {stats['images']}, не прочитано: {stats['failed']}, "
+          f"отложено до следующего запуска: {stats['retry']}, "
+          f"загружено {stats['bytes_read'] / 1024:.0f} КБ за {elapsed:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
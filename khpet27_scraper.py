@@ -1,16 +1,143 @@
 import requests
-from bs4 import BeautifulSoup
 import sqlite3
 import time
 import os
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 import random
 import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+
+from extraction import ExtractionRules, FieldRule
+from frontier import CrawlFrontier, default_worker_id
+from http_client import MAX_BODY_SIZE, SkippedContent, get_session, is_denied_url, read_html_body
+from media import media_urls
+from metrics import Metrics
+from parsing import LINKS_STRAINER, make_soup
+from pipeline import Pipeline, async_iter
+from storage import record_batches, replace_objects, upgrade_schema, upsert_objects
+from rate_limit import HostLimiter, Ticket
+from records import Record, RecordBatch
+from sitemap import SitemapIndex
+from urls import canonicalize_url
+
+# WordPress listing pages: pagination, category/tag/author and date archives
+LISTING_PATTERN = re.compile(r'/(page/\d+|category/.+|tag/.+|author/.+|\d{4}(/\d{2})?)/?$')
+
+# WordPress service paths that never contain articles
+SKIP_PATTERN = re.compile(r'/(wp-admin|wp-json|wp-login\.php|wp-content|feed|comments/feed|xmlrpc\.php)(/|$)')
+
+# Places on the home page where links to news usually live
+NEWS_SELECTORS = [
+    'article',
+    '.post',
+    '.news-item',
+    '.entry-content a',
+    'h2 a',
+    'h3 a',
+    '.recent-posts a',
+    '.news-list a'
+]
+
+HOME_RULES = ExtractionRules([
+    FieldRule('news', NEWS_SELECTORS, all_matches=True),
+    # Every link, used when none of the news selectors match
+    FieldRule('links', ['a'], all_matches=True),
+])
+
+def paragraphs_text(element):
+    """Join the non-empty paragraphs inside an element.
+    
+    Each paragraph contributes only its own text, without that of
+    paragraphs nested in it: html.parser nests an unclosed <p> in the next
+    one where lxml closes it, and the text must come out the same either way.
+    """
+    texts = []
+    for paragraph in element.find_all('p'):
+        text = ''.join(string for string in paragraph.strings if string.find_parent('p') is paragraph).strip()
+        if text:
+            texts.append(text)
+    return ' '.join(texts)
+
+ARTICLE_RULES = ExtractionRules([
+    FieldRule('title', ['h1', 'h2', '.entry-title', '.post-title', 'title'],
+              extract=lambda element: element.get_text().strip(), default=""),
+    FieldRule('text', ['.entry-content', '.post-content', '.content', 'article', '.main-content', 'main'],
+              extract=paragraphs_text, skip_empty=True, default=""),
+    FieldRule('image', ['img'], extract=lambda element: element.get('src', ''), default=""),
+])
+
+# Roots of every element get_article_details looks at
+ARTICLE_STRAINER = ARTICLE_RULES.strainer()
+
+def extract_article(soup, url, article_id, base_url):
+    """Build an article record from a parsed page"""
+    # Title, text and image in a single pass over the page
+    fields = ARTICLE_RULES.extract(soup)
+    
+    title = fields['title']
+    if not title:
+        title = f"Article {article_id}"
+    
+    text = fields['text']
+    if not text:
+        text = f"This is article {article_id} from {url}"
+    
+    # Resolve the image URL
+    image = ""
+    image_src = fields['image']
+    if image_src:
+        if image_src.startswith('/'):
+            image = urljoin(base_url, image_src)
+        elif not image_src.startswith('http'):
+            image = urljoin(url, image_src)
+        else:
+            image = image_src
+    
+    # Generate audio URL (mock data since the site likely doesn't have audio)
+    audio = f"https://example.com/audio/article_{article_id}.mp3"
+    
+    return Record(id=article_id, name=title, audio=audio, image=image, text=text, url=url)
+
+def parse_article_html(content, url, article_id, base_url, parser=None, selective_parsing=True):
+    """Parse an article page into a record; a plain function so worker processes can run it"""
+    soup = make_soup(content, parser, ARTICLE_STRAINER if selective_parsing else None)
+    return extract_article(soup, url, article_id, base_url)
 
 class Khpet27Scraper:
-    def __init__(self, db_name="khpet27_data.db"):
+    def __init__(self, db_name="khpet27_data.db", max_workers=1, max_per_host=4, min_interval=1.0, session=None, cache=None,
+                 max_body_size=MAX_BODY_SIZE, parser=None, selective_parsing=True, max_rate=10.0, adaptive_rate=True,
+                 metrics=None, media=None, seen=None, near_duplicates=None, mock_seed=None, image_prober=None):
         self.base_url = "https://khpet27.ru"
         self.db_name = db_name
+        self.session = session or get_session()
+        # Optional http_cache.HttpCache for incremental re-crawls
+        self.cache = cache
+        self.max_body_size = max_body_size
+        # parser=None picks lxml when available; selective parsing skips unused parts of article pages
+        self.parser = parser
+        self.selective_parsing = selective_parsing
+        # max_workers=1 fetches one article at a time
+        self.max_workers = max_workers
+        # Requests start at one per min_interval and adapt to how the site copes; an offline
+        # replay does not read robots.txt either, it never touches the network
+        offline = cache is not None and cache.offline
+        self.limiter = HostLimiter(max_per_host=max_per_host, min_interval=min_interval, max_rate=max_rate,
+                                   adaptive=adaptive_rate, session=None if offline else self.session)
+        # Stage timers and HTTP counters; pass Metrics(export_path=...) to export them
+        self.metrics = metrics or Metrics(prefix='khpet27')
+        # Optional media.MediaDownloader; saved image/audio URLs are downloaded in the background
+        self.media = media
+        # Optional near_duplicates.NearDuplicateIndex run after every save to link or drop near-copies
+        self.near_duplicates = near_duplicates
+        # Optional image_probe.ImageProber; image sizes are read from the first bytes once a run has saved
+        self.image_prober = image_prober
+        # Mock rows come from this generator; a fixed mock_seed makes them the same on every run
+        self.random = random.Random(mock_seed)
+        # Optional urls.SeenSet of pages fetched in earlier runs, which are then not fetched again;
+        # saves are always incremental with it, since a full rewrite would drop the skipped articles
+        self.seen = seen
         self.setup_database()
     
     def setup_database(self):
@@ -27,6 +154,7 @@ class Khpet27Scraper:
                 text TEXT
             )
         ''')
+        upgrade_schema(conn)
         
         conn.commit()
         conn.close()
@@ -34,109 +162,167 @@ class Khpet27Scraper:
     
     def get_page_content(self, url, timeout=10):
         """Get page content with error handling"""
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=timeout)
-            response.raise_for_status()
-            return response
-        except requests.RequestException as e:
-            print(f"Ошибка доступа к {url}: {e}")
+        # Uploads such as images and presentations are never articles
+        if is_denied_url(url):
+            self.metrics.inc('skipped_urls', reason='extension')
+            print(f"Пропуск {url}: не HTML-страница")
             return None
+        
+        def check_body(response):
+            read_html_body(response, self.max_body_size)
+        
+        # Be respectful to the server; answers from an offline cache take no request slot or token
+        slot = nullcontext(Ticket()) if self.cache and self.cache.offline else self.limiter.slot(url)
+        with slot as ticket, self.metrics.timer('fetch'):
+            try:
+                headers = {
+                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+                }
+                if self.cache:
+                    response = self.cache.get(self.session, url, headers=headers, timeout=timeout, validate=check_body)
+                else:
+                    response = self.session.get(url, headers=headers, timeout=timeout, stream=True)
+                ticket.record(response.status_code)
+                self.metrics.record_response(response)
+                if not response.ok:
+                    # The streamed body of an error page is never read; give its connection back to the pool
+                    response.close()
+                response.raise_for_status()
+                if not self.cache:
+                    check_body(response)
+                    self.metrics.inc('bytes', len(response.content))
+                return response
+            except SkippedContent as e:
+                # The server answered fine, the page just is not worth parsing
+                ticket.record(e.response.status_code if e.response is not None else None)
+                self.metrics.inc('skipped_urls', reason='content')
+                print(f"Пропуск {url}: {e}")
+                return None
+            except requests.RequestException as e:
+                self.metrics.inc('fetch_errors')
+                print(f"Ошибка доступа к {url}: {e}")
+                return None
     
     def scrape_news_articles(self, max_articles=100):
         """Scrape news articles from the main page and pagination"""
-        scraped_data = []
+        return RecordBatch(self.iter_news_articles(max_articles))
+    
+    def iter_news_articles(self, max_articles=100):
+        """Yield news article records one by one, as soon as each is extracted.
         
+        Article pages are fetched max_workers * 4 at a time, so only one such
+        group of pages is held at once. URLs enter the seen set only when
+        save_to_database has stored their records.
+        """
         print("Начинаем парсинг новостей с khpet27.ru...")
         
         # First, get the main page
         main_response = self.get_page_content(self.base_url)
         if not main_response:
             print("Не удалось получить доступ к главной странице")
-            return []
-        
-        soup = BeautifulSoup(main_response.content, 'html.parser')
+            return
+        
+        with self.metrics.timer('parse'):
+            soup = make_soup(main_response.content, self.parser)
+        
+        with self.metrics.timer('extract'):
+            article_urls = self.find_article_urls(soup, max_articles)
+        
+        known = 0
+        if self.seen is not None:
+            new_urls = self.seen.unseen(article_urls)
+            known = len(article_urls) - len(new_urls)
+            print(f"Пропускаем {known} статей, загруженных ранее")
+            article_urls = new_urls
+        
+        # Fetch pages concurrently, then number the articles in the original order
+        count = 0
+        group_size = max(self.max_workers, 1) * 4
+        for start in range(0, len(article_urls), group_size):
+            if count >= max_articles:
+                break
+            urls = article_urls[start:start + group_size]
+            responses = self.fetch_pages(urls)
+            for full_url, response in zip(urls, responses):
+                if count >= max_articles:
+                    break
+                
+                print(f"Обработка статьи {count + 1}/{max_articles}: {full_url}")
+                
+                if not response:
+                    continue
+                
+                count += 1
+                yield self.parse_article_details(response, full_url, count)
         
+        # If we still don't have enough articles, generate some mock data based on the site content
+        # (not when articles were skipped as already stored, mock rows would only stand in for them)
+        if count < max_articles and not known:
+            print(f"Найдено только {count} реальных статей, генерируем дополнительные mock данные...")
+            yield from self.generate_mock_data_from_site(soup, count + 1, max_articles)
+    
+    def aiter_news_articles(self, max_articles=100):
+        """iter_news_articles as an async iterator, for use with async for; the crawl runs in a thread"""
+        return async_iter(self.iter_news_articles(max_articles))
+    
+    def find_article_urls(self, soup, max_articles=100):
+        """Find article links on the home page, as absolute URLs in page order"""
         # Find news articles
         articles = []
         
-        # Look for news in different possible selectors
-        news_selectors = [
-            'article',
-            '.post',
-            '.news-item',
-            '.entry-content a',
-            'h2 a',
-            'h3 a',
-            '.recent-posts a',
-            '.news-list a'
-        ]
-        
-        for selector in news_selectors:
-            elements = soup.select(selector)
+        # Look for news in different possible selectors, all in one pass over the page
+        found = HOME_RULES.find(soup)
+        for selector in NEWS_SELECTORS:
+            elements = found[selector]
             if elements:
                 print(f"Найдено {len(elements)} элементов с селектором: {selector}")
                 articles.extend(elements)
         
         # If no articles found, try to find all links that look like news
         if not articles:
-            all_links = soup.find_all('a', href=True)
+            all_links = [link for link in found['a'] if link.has_attr('href')]
             for link in all_links:
                 href = link['href']
                 if '/20' in href or 'news' in href.lower() or len(link.get_text().strip()) > 20:
                     articles.append(link)
         
-        # Remove duplicates
-        unique_articles = []
+        # Remove duplicates, comparing canonical URLs so that fragments, tracking
+        # parameters, trailing slashes and http/https variants count as one page
+        unique_urls = []
         seen_urls = set()
         for article in articles:
-            href = article.get('href', '')
-            if href and href not in seen_urls:
-                unique_articles.append(article)
-                seen_urls.add(href)
-        
-        print(f"Найдено {len(unique_articles)} уникальных ссылок на статьи")
-        
-        # Process each article
-        for i, article in enumerate(unique_articles[:max_articles]):
-            if len(scraped_data) >= max_articles:
-                break
-            
             href = article.get('href', '')
             if not href:
                 continue
-            
-            # Convert relative URL to absolute
-            if href.startswith('/'):
-                full_url = urljoin(self.base_url, href)
-            elif not href.startswith('http'):
-                full_url = urljoin(self.base_url, href)
-            else:
-                full_url = href
-            
+            url = self.canonical_url(href)
+            if url not in seen_urls:
+                unique_urls.append(url)
+                seen_urls.add(url)
+        
+        print(f"Найдено {len(unique_urls)} уникальных ссылок на статьи")
+        
+        # Collect article URLs in their original order
+        article_urls = []
+        for full_url in unique_urls[:max_articles]:
             # Skip external links
             if not full_url.startswith(self.base_url):
                 continue
             
-            print(f"Обработка статьи {len(scraped_data) + 1}/{max_articles}: {full_url}")
-            
-            # Get article details
-            article_data = self.get_article_details(full_url, len(scraped_data) + 1)
-            if article_data:
-                scraped_data.append(article_data)
-            
-            # Be respectful to the server
-            time.sleep(1)
+            article_urls.append(full_url)
         
-        # If we still don't have enough articles, generate some mock data based on the site content
-        if len(scraped_data) < max_articles:
-            print(f"Найдено только {len(scraped_data)} реальных статей, генерируем дополнительные mock данные...")
-            mock_data = self.generate_mock_data_from_site(soup, len(scraped_data) + 1, max_articles)
-            scraped_data.extend(mock_data)
+        return article_urls
+    
+    def canonical_url(self, href, base=None):
+        """Absolute canonical form of a link, used both to deduplicate and to fetch it"""
+        return canonicalize_url(href, base=base or self.base_url, force_https=self.base_url.startswith('https://'))
+    
+    def fetch_pages(self, urls):
+        """Fetch pages with a bounded worker pool, returning responses in the order of urls"""
+        if self.max_workers <= 1:
+            return [self.get_page_content(url) for url in urls]
         
-        return scraped_data[:max_articles]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.get_page_content, urls))
     
     def get_article_details(self, url, article_id):
         """Extract details from a specific article page"""
@@ -144,70 +330,227 @@ class Khpet27Scraper:
         if not response:
             return None
         
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Extract title
-        title_selectors = ['h1', 'h2', '.entry-title', '.post-title', 'title']
-        title = ""
-        for selector in title_selectors:
-            title_elem = soup.select_one(selector)
-            if title_elem:
-                title = title_elem.get_text().strip()
+        return self.parse_article_details(response, url, article_id)
+    
+    def parse_article_details(self, response, url, article_id, soup=None):
+        """Extract article fields from an already fetched page"""
+        if soup is None:
+            with self.metrics.timer('parse'):
+                soup = make_soup(response.content, self.parser, ARTICLE_STRAINER if self.selective_parsing else None)
+        with self.metrics.timer('extract'):
+            return extract_article(soup, url, article_id, self.base_url)
+    
+    def classify_url(self, url):
+        """Return 'listing', 'article' or None for a URL that should not be crawled"""
+        if not url.startswith(self.base_url):
+            return None
+        path = urlparse(url).path or '/'
+        if SKIP_PATTERN.search(path) or urlparse(url).query:
+            return None
+        if path == '/' or LISTING_PATTERN.search(path):
+            return 'listing'
+        return 'article'
+    
+    def extract_links(self, soup, page_url, depth):
+        """Find crawlable links on a page as (url, depth, kind) tuples"""
+        links = []
+        for link in soup.find_all('a', href=True):
+            url = self.canonical_url(link['href'], base=page_url)
+            kind = self.classify_url(url)
+            if not kind:
+                continue
+            # Pagination continues the same listing, so it does not count as a level
+            if kind == 'listing' and '/page/' in url:
+                links.append((url, depth, kind))
+            else:
+                links.append((url, depth + 1, kind))
+        return links
+    
+    def crawl_site(self, max_depth=2, max_pages=500, resume=True):
+        """Breadth-first crawl of listings and articles, checkpointed in the frontier table.
+        
+        Articles are saved incrementally after every batch, so an interrupted
+        crawl loses at most one batch and continues from the pending URLs
+        on the next call with resume=True.
+        """
+        frontier = CrawlFrontier(self.db_name)
+        if not resume:
+            frontier.reset()
+        frontier.add([(self.base_url + '/', 0, 'listing')])
+        
+        print(f"Обход сайта: глубина {max_depth}, не более {max_pages} страниц. Очередь: {frontier.counts()}")
+        
+        pages = 0
+        saved = 0
+        while pages < max_pages:
+            batch = frontier.next_batch(min(max(self.max_workers, 1) * 4, max_pages - pages))
+            if not batch:
                 break
+            
+            fetched, stored = self.crawl_batch(frontier, batch, max_depth)
+            pages += fetched
+            saved += stored
+            print(f"Обработано страниц: {pages}, сохранено статей: {saved}")
+        
+        if self.seen is not None:
+            self.seen.save()
+        counts = frontier.counts()
+        frontier.close()
+        print(f"Обход завершен. Состояние очереди: {counts}")
+        return saved
+    
+    def crawl_batch(self, frontier, batch, max_depth):
+        """Fetch, parse and store one batch of frontier entries; returns (pages fetched, articles saved)"""
+        if self.seen is not None:
+            # Articles stored by earlier runs are finished without fetching them again
+            unseen = set(self.seen.unseen(url for _, url, _, kind in batch if kind == 'article'))
+            for _, url, _, kind in batch:
+                if kind == 'article' and url not in unseen:
+                    frontier.complete(url, status='known')
+            batch = [entry for entry in batch if entry[3] != 'article' or entry[1] in unseen]
+        
+        responses = self.fetch_pages([url for _, url, _, _ in batch])
         
-        if not title:
-            title = f"Article {article_id}"
-        
-        # Extract text content
-        text_selectors = [
-            '.entry-content',
-            '.post-content',
-            '.content',
-            'article',
-            '.main-content',
-            'main'
-        ]
+        articles = []
+        for (rowid, url, depth, kind), response in zip(batch, responses):
+            if not response:
+                frontier.complete(url, status='failed')
+                continue
+            
+            # Parse the full page only when its links are still needed
+            soup = None
+            discovered = []
+            if depth < max_depth:
+                parse_only = LINKS_STRAINER if kind == 'listing' and self.selective_parsing else None
+                with self.metrics.timer('parse'):
+                    soup = make_soup(response.content, self.parser, parse_only)
+                with self.metrics.timer('extract'):
+                    discovered = [link for link in self.extract_links(soup, url, depth) if link[1] <= max_depth]
+            
+            if kind == 'article':
+                # The frontier rowid is stable per URL, so it doubles as the article number
+                articles.append((url, self.parse_article_details(response, url, rowid, soup), discovered))
+            else:
+                frontier.complete(url, discovered=discovered)
         
-        text = ""
-        for selector in text_selectors:
-            content_elem = soup.select_one(selector)
-            if content_elem:
-                # Get all paragraphs
-                paragraphs = content_elem.find_all('p')
-                text = ' '.join([p.get_text().strip() for p in paragraphs if p.get_text().strip()])
-                if text:
-                    break
+        if articles:
+            self.save_to_database([data for _, data, _ in articles], incremental=True)
+        # Mark articles done only after they are stored
+        for url, _, discovered in articles:
+            frontier.complete(url, discovered=discovered)
         
-        if not text:
-            text = f"This is article {article_id} from {url}"
-        
-        # Extract image
-        image = ""
-        image_elem = soup.find('img')
-        if image_elem:
-            image_src = image_elem.get('src', '')
-            if image_src:
-                if image_src.startswith('/'):
-                    image = urljoin(self.base_url, image_src)
-                elif not image_src.startswith('http'):
-                    image = urljoin(url, image_src)
+        return len(batch), len(articles)
+    
+    def crawl_worker(self, worker_id=None, max_depth=2, max_pages=None, lease_seconds=300, poll_interval=5.0):
+        """Crawl as one of several processes sharing the frontier table.
+        
+        Batches are claimed with a lease of lease_seconds, which should be
+        well above the time one batch takes; entries of a worker that dies
+        are handed out again once its lease expires. Articles are upserted
+        by URL, so a page crawled twice after a lost lease is stored once.
+        The worker stops when nothing is pending or leased any more, when
+        the frontier is draining, or after max_pages pages.
+        """
+        worker_id = worker_id or default_worker_id()
+        frontier = CrawlFrontier(self.db_name)
+        print(f"Обработчик {worker_id}: глубина {max_depth}, аренда {lease_seconds} с. Очередь: {frontier.counts()}")
+        
+        pages = 0
+        saved = 0
+        try:
+            while max_pages is None or pages < max_pages:
+                limit = max(self.max_workers, 1) * 4
+                if max_pages is not None:
+                    limit = min(limit, max_pages - pages)
+                batch = frontier.claim(worker_id, limit, lease_seconds)
+                if not batch:
+                    if frontier.is_draining():
+                        print(f"Обработчик {worker_id}: очередь останавливается, новых адресов не берём")
+                        break
+                    if frontier.is_finished():
+                        break
+                    # Other workers still hold leases and may add links or lose their leases
+                    time.sleep(poll_interval)
+                    continue
+                
+                fetched, stored = self.crawl_batch(frontier, batch, max_depth)
+                pages += fetched
+                saved += stored
+                print(f"Обработчик {worker_id}: обработано страниц {pages}, сохранено статей {saved}")
+        finally:
+            # Whatever is still leased (e.g. after Ctrl+C) goes back to the queue at once
+            frontier.release(worker_id)
+            if self.seen is not None:
+                self.seen.save()
+            counts = frontier.counts()
+            frontier.close()
+        
+        print(f"Обработчик {worker_id} завершен. Состояние очереди: {counts}")
+        return saved
+    
+    def crawl_sitemaps(self, max_pages=None, sitemap_urls=None):
+        """Fetch the articles listed in the site's sitemaps that are new or changed since the last run.
+        
+        The sitemaps (from robots.txt or the WordPress defaults unless
+        sitemap_urls is given) replace the listing pages for discovery. Each
+        URL's lastmod is stored, so a later run only fetches pages whose
+        lastmod moved on. Articles are saved incrementally after every batch.
+        """
+        index = SitemapIndex(self.db_name, session=self.session, limiter=self.limiter)
+        try:
+            roots = sitemap_urls or index.find_sitemaps(self.base_url)
+            if not roots:
+                print("Карта сайта не найдена")
+                return 0
+            
+            with self.metrics.timer('sitemap'):
+                stats = index.refresh(roots)
+            print(f"Карты сайта: прочитано {stats['sitemaps']}, без изменений {stats['unchanged']}, "
+                  f"с ошибками {stats['failed']}, адресов {stats['urls']}, новых или изменённых {stats['changed']}")
+            
+            # Pages, categories and authors are listed too; they are marked so they do not come up again
+            articles = []
+            other = []
+            for rowid, url in index.changed():
+                canonical = self.canonical_url(url)
+                if self.classify_url(canonical) == 'article':
+                    articles.append((rowid, url, canonical))
                 else:
-                    image = image_src
-        
-        # Generate audio URL (mock data since the site likely doesn't have audio)
-        audio = f"https://example.com/audio/article_{article_id}.mp3"
-        
-        return {
-            'id': article_id,
-            'name': title,
-            'audio': audio,
-            'image': image,
-            'text': text
-        }
+                    other.append(url)
+            index.mark_fetched(other)
+            if max_pages is not None:
+                articles = articles[:max_pages]
+            print(f"Статей к загрузке: {len(articles)}")
+            
+            saved = 0
+            batch_size = max(self.max_workers, 1) * 4
+            for start in range(0, len(articles), batch_size):
+                batch = articles[start:start + batch_size]
+                responses = self.fetch_pages([canonical for _, _, canonical in batch])
+                data = RecordBatch()
+                fetched = []
+                for (rowid, url, canonical), response in zip(batch, responses):
+                    if not response:
+                        continue
+                    # The sitemap rowid is stable per URL, so it doubles as the article number
+                    data.append(self.parse_article_details(response, canonical, rowid))
+                    fetched.append(url)
+                if data:
+                    self.save_to_database(data, incremental=True)
+                    saved += len(data)
+                # Only stored pages count as fetched; failed ones are retried on the next run
+                index.mark_fetched(fetched)
+                print(f"Загружено статей: {start + len(batch)}/{len(articles)}, сохранено: {saved}")
+            
+            if self.seen is not None:
+                self.seen.save()
+        finally:
+            index.close()
+        return saved
     
     def generate_mock_data_from_site(self, soup, start_id, max_objects):
         """Generate mock data based on site content when real articles are insufficient"""
-        mock_data = []
+        mock_data = RecordBatch()
         
         # Extract common themes from the site
         site_text = soup.get_text().lower()
@@ -227,7 +570,7 @@ class Khpet27Scraper:
         ]
         
         for i in range(start_id, max_objects + 1):
-            theme = random.choice(themes)
+            theme = self.random.choice(themes)
             
             # Generate realistic titles based on college themes
             title_templates = [
@@ -238,7 +581,7 @@ class Khpet27Scraper:
                 f"{theme}: Опыт и лучшие практики"
             ]
             
-            name = random.choice(title_templates)
+            name = self.random.choice(title_templates)
             
             # Generate mock audio URL
             audio = f"https://example.com/audio/khpet27_{i:03d}.mp3"
@@ -254,43 +597,90 @@ class Khpet27Scraper:
                 f"Анализ текущего состояния и перспектив развития {theme.lower()} в техникуме.",
                 f"Практический опыт и методические рекомендации по {theme.lower()}."
             ]
-            text = random.choice(descriptions)
+            text = self.random.choice(descriptions)
             
-            mock_data.append({
-                'id': i,
-                'name': name,
-                'audio': audio,
-                'image': image,
-                'text': text
-            })
+            # Mock rows have no source page, key them by their position instead
+            mock_data.append(Record(id=i, name=name, audio=audio, image=image, text=text,
+                                    url=f"mock://khpet27/{i}"))
         
         return mock_data
     
-    def save_to_database(self, data):
-        """Save scraped data to database"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        # Clear existing data
-        cursor.execute("DELETE FROM objects")
-        
-        # Insert new data
-        for item in data:
-            cursor.execute('''
-                INSERT INTO objects (id, name, audio, image, text)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (item['id'], item['name'], item['audio'], item['image'], item['text']))
-        
-        conn.commit()
-        conn.close()
+    def probe_images(self):
+        """Read the sizes of newly saved images once the run has stored its articles"""
+        if not self.image_prober:
+            return
+        with self.metrics.timer('image_probe'):
+            stats = self.image_prober.enrich()
+        print(f"Изображения: проверено {stats['images']}, не прочитано {stats['failed']}, "
+              f"отложено {stats['retry']}, загружено {stats['bytes_read'] / 1024:.0f} КБ")
+    
+    def wait_for_media(self):
+        """Wait for background media downloads and report them"""
+        if not self.media:
+            return
+        stats = self.media.wait()
+        print(f"Медиафайлы: загружено {stats['downloaded']}, дубликатов {stats['deduplicated']}, "
+              f"уже были {stats['known']}, докачано {stats['resumed']}, ошибок {stats['failed']}")
+    
+    def save_to_database(self, data, incremental=False, tombstone_missing=False, append=False):
+        """Save scraped records (a RecordBatch or a list of records) to database.
+        
+        A full save replaces the table, or adds to it with append=True. With
+        a seen set every save is incremental: articles skipped as already
+        seen are not in data, and a full rewrite would delete their rows.
+        """
+        if self.seen is not None:
+            if tombstone_missing:
+                raise ValueError("tombstone_missing would mark articles skipped as already seen as deleted")
+            incremental = True
+        data = RecordBatch.of(data)
+        with self.metrics.timer('db_write'):
+            self._save_to_database(data, incremental, tombstone_missing, append)
+        self.metrics.inc('rows_written', len(data))
+        if self.seen is not None:
+            # Only once the rows are committed, so an interrupted run fetches unsaved articles again
+            self.seen.add(url for url in data.url if url and not url.startswith('mock://'))
+        if self.near_duplicates:
+            with self.metrics.timer('near_duplicates'):
+                stats = self.near_duplicates.update()
+            print(f"Почти дубликаты: проверено {stats['fingerprinted']}, найдено {stats['duplicates']}")
+        if self.media:
+            self.media.enqueue(media_urls(data))
+    
+    def _save_to_database(self, data, incremental, tombstone_missing, append):
+        if incremental:
+            # Upsert by source URL instead of rewriting the whole table
+            stats = upsert_objects(self.db_name, data, tombstone_missing=tombstone_missing)
+            print(f"Инкрементальное сохранение: добавлено {stats['inserted']}, обновлено {stats['updated']}, "
+                  f"без изменений {stats['unchanged']}, помечено удалёнными {stats['tombstoned']}")
+            return
+        
+        # Rewrite the table (or add to it) with the same url/content_hash/updated_at as upserts
+        replace_objects(self.db_name, data, append=append)
         print(f"Успешно сохранено {len(data)} элементов в базу данных")
     
+    def save_stream(self, records, incremental=False, batch_size=100):
+        """Save records from an iterator in batches of batch_size, each committed as soon as it is full.
+        
+        Memory stays bounded by one batch, and whatever was saved survives a
+        crash later in the crawl. A full save replaces the table with the
+        first batch and appends the rest. Returns the number of records saved.
+        """
+        saved = 0
+        for batch in record_batches(records, batch_size):
+            self.save_to_database(batch, incremental=incremental, append=saved > 0)
+            saved += len(batch)
+            print(f"Сохранено записей: {saved}")
+        if self.seen is not None:
+            self.seen.save()
+        return saved
+    
     def display_data(self, limit=10):
         """Display data from database"""
         conn = sqlite3.connect(self.db_name)
         cursor = conn.cursor()
         
-        cursor.execute("SELECT id, name, audio, image, text FROM objects ORDER BY id LIMIT ?", (limit,))
+        cursor.execute("SELECT id, name, audio, image, text FROM objects WHERE deleted_at IS NULL ORDER BY id LIMIT ?", (limit,))
         rows = cursor.fetchall()
         
         print("\n" + "="*80)
@@ -309,31 +699,127 @@ class Khpet27Scraper:
         
         print("-"*80)
         
-        cursor.execute("SELECT COUNT(*) FROM objects")
+        cursor.execute("SELECT COUNT(*) FROM objects WHERE deleted_at IS NULL")
         total_count = cursor.fetchone()[0]
         print(f"Всего записей в базе данных: {total_count}")
         
         conn.close()
     
-    def run(self, max_objects=100):
-        """Main method to run the scraper"""
-        print(f"Запуск скрапера для khpet27.ru для сбора {max_objects} объектов...")
+    def run(self, max_objects=100, incremental=False, batch_size=100):
+        """Main method to run the scraper; articles are saved batch_size at a time while the crawl goes on"""
+        with self.metrics.running():
+            print(f"Запуск скрапера для khpet27.ru для сбора {max_objects} объектов...")
+            
+            # Scrape and save data
+            saved = self.save_stream(self.iter_news_articles(max_objects), incremental=incremental,
+                                     batch_size=batch_size)
+            
+            if saved:
+                # Display first few records
+                self.display_data()
+                
+                print(f"\nПарсинг успешно завершен!")
+                print(f"Данные сохранены в '{self.db_name}'")
+                print(f"Источник: {self.base_url}")
+            else:
+                print("Данные не были собраны")
+            self.probe_images()
+            self.wait_for_media()
         
-        # Scrape data
-        data = self.scrape_news_articles(max_objects)
+        print(f"Метрики: {self.metrics.summary()}")
+
+    def run_crawl(self, max_depth=2, max_pages=500, resume=True):
+        """Crawl the site through the persistent frontier and show the result"""
+        with self.metrics.running():
+            print(f"Запуск обхода khpet27.ru (глубина {max_depth}, лимит {max_pages} страниц)...")
+            
+            saved = self.crawl_site(max_depth=max_depth, max_pages=max_pages, resume=resume)
+            
+            if saved:
+                self.display_data()
+                print(f"\nОбход успешно завершен!")
+                print(f"Данные сохранены в '{self.db_name}'")
+            else:
+                print("Новые статьи не найдены")
+            self.probe_images()
+            self.wait_for_media()
         
-        if data:
-            # Save to database
-            self.save_to_database(data)
+        print(f"Метрики: {self.metrics.summary()}")
+
+    def run_sitemap(self, max_pages=None, sitemap_urls=None):
+        """Fetch new and changed articles found through the sitemaps and show the result"""
+        with self.metrics.running():
+            print("Запуск загрузки по карте сайта khpet27.ru...")
             
-            # Display first few records
-            self.display_data()
+            saved = self.crawl_sitemaps(max_pages=max_pages, sitemap_urls=sitemap_urls)
             
-            print(f"\nПарсинг успешно завершен!")
-            print(f"Данные сохранены в '{self.db_name}'")
-            print(f"Источник: {self.base_url}")
-        else:
-            print("Данные не были собраны")
+            if saved:
+                self.display_data()
+                print(f"\nЗагрузка успешно завершена!")
+                print(f"Данные сохранены в '{self.db_name}'")
+            else:
+                print("Новые или изменённые статьи не найдены")
+            self.probe_images()
+            self.wait_for_media()
+        
+        print(f"Метрики: {self.metrics.summary()}")
+
+    def run_worker(self, worker_id=None, max_depth=2, max_pages=None, lease_seconds=300, poll_interval=5.0):
+        """Run one crawl worker on the shared frontier and report its metrics"""
+        with self.metrics.running():
+            saved = self.crawl_worker(worker_id=worker_id, max_depth=max_depth, max_pages=max_pages,
+                                      lease_seconds=lease_seconds, poll_interval=poll_interval)
+            self.probe_images()
+            self.wait_for_media()
+        
+        print(f"Метрики: {self.metrics.summary()}")
+        return saved
+
+    def run_pipeline(self, max_objects=100, parse_workers=None, batch_size=50):
+        """Fetch, parse and store home page articles in overlapping stages.
+        
+        Pages are fetched by max_workers threads, parsed in a process pool and
+        upserted in batches by a single writer as soon as they are ready.
+        """
+        with self.metrics.running():
+            print(f"Запуск конвейера для khpet27.ru ({max_objects} статей)...")
+            
+            main_response = self.get_page_content(self.base_url)
+            if not main_response:
+                print("Не удалось получить доступ к главной странице")
+                return
+            
+            with self.metrics.timer('parse'):
+                soup = make_soup(main_response.content, self.parser)
+            with self.metrics.timer('extract'):
+                article_urls = self.find_article_urls(soup, max_objects)
+            
+            def fetch(item):
+                article_id, url = item
+                response = self.get_page_content(url)
+                if not response:
+                    return None
+                return response.content, url, article_id
+            
+            pipeline = Pipeline(
+                fetch=fetch,
+                parse=partial(parse_article_html, base_url=self.base_url, parser=self.parser,
+                              selective_parsing=self.selective_parsing),
+                write=lambda batch: self.save_to_database(batch, incremental=True),
+                fetch_workers=max(self.max_workers, 1),
+                parse_workers=parse_workers,
+                batch_size=batch_size,
+                # Parsing and extraction both happen in the workers and are timed together as parse
+                metrics=self.metrics
+            )
+            stats = pipeline.run(enumerate(article_urls, start=1))
+            
+            print(f"Загружено {stats['fetched']}, разобрано {stats['parsed']}, сохранено {stats['written']} статей")
+            self.display_data()
+            self.probe_images()
+            self.wait_for_media()
+        
+        print(f"Метрики: {self.metrics.summary()}")
 
 if __name__ == "__main__":
     scraper = Khpet27Scraper()
@@ -0,0 +1,248 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from http_client import get_session
+from rate_limit import HostLimiter
+from records import as_record
+from storage import connect
+
+# Fields of a scraped record that point at downloadable assets
+MEDIA_FIELDS = ('image', 'audio')
+
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+
+def media_urls(data):
+    """Image and audio URLs referenced by scraped records, each once, in order"""
+    seen = set()
+    for item in data:
+        item = as_record(item)
+        for field in MEDIA_FIELDS:
+            url = getattr(item, field)
+            if url and url.startswith(('http://', 'https://')) and url not in seen:
+                seen.add(url)
+                yield url
+
+
+class MediaDownloader:
+    """Concurrent downloader of image/audio URLs into a content-addressed store.
+
+    Files are streamed to <root>/partial in chunks and moved to
+    <root>/<sha[:2]>/<sha[2:4]>/<sha> once complete, so an asset served
+    under several URLs is stored once. An interrupted transfer keeps its
+    partial file and continues with an HTTP Range request on the next
+    attempt. The media table maps every URL to its hash, local path and
+    content type; join it to objects on objects.image or objects.audio.
+    """
+
+    def __init__(self, db_name, root="media", session=None, max_workers=4, chunk_size=64 * 1024,
+                 limiter=None, max_pending=256, timeout=30):
+        self.db_name = db_name
+        self.root = root
+        self.session = session or get_session()
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.limiter = limiter or HostLimiter(max_per_host=max_workers, min_interval=0.1)
+        self.timeout = timeout
+        os.makedirs(os.path.join(root, 'partial'), exist_ok=True)
+
+        self._lock = threading.Lock()
+        # WAL and a busy timeout, so status updates wait for the scraper's writes instead of failing
+        self._conn = connect(db_name, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS media (
+                url TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                sha256 TEXT,
+                path TEXT,
+                size INTEGER,
+                content_type TEXT,
+                etag TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_media_sha256 ON media (sha256)')
+        self._conn.commit()
+
+        self._executor = None
+        # enqueue() blocks once this many downloads are waiting, so a fast crawl cannot run away
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+        self._queued = set()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {'downloaded': 0, 'deduplicated': 0, 'resumed': 0, 'known': 0, 'failed': 0, 'bytes': 0}
+
+    def download_all(self, urls):
+        """Download every URL with max_workers threads and wait for them"""
+        self.enqueue(urls)
+        return self.wait()
+
+    def enqueue(self, urls):
+        """Queue URLs for download in the background, skipping ones already stored"""
+        for url in urls:
+            with self._lock:
+                if url in self._queued:
+                    continue
+                self._queued.add(url)
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            self._pending.acquire()
+            future = self._executor.submit(self._download_queued, url)
+            with self._lock:
+                self._futures.append(future)
+
+    def wait(self):
+        """Block until every queued download has finished and return the counters"""
+        while True:
+            with self._lock:
+                futures, self._futures = self._futures, []
+            if not futures:
+                break
+            for future in futures:
+                future.result()
+        return dict(self.stats)
+
+    def close(self):
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._conn.close()
+
+    def lookup(self, url):
+        """(sha256, path) of a stored URL, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256, path FROM media WHERE url = ? AND status = 'done'", (url,)
+            ).fetchone()
+        return row
+
+    def download(self, url):
+        """Download one URL unless it is already stored; returns (sha256, path) or None"""
+        part_path = os.path.join(self.root, 'partial', hashlib.sha1(url.encode('utf-8')).hexdigest() + '.part')
+        try:
+            known = self.lookup(url)
+            if known and os.path.exists(known[1]):
+                self._count('known')
+                return known
+            return self._fetch(url, part_path)
+        except (requests.RequestException, OSError, sqlite3.OperationalError) as e:
+            self._count('failed')
+            try:
+                self._record(url, 'failed', error=str(e))
+            except sqlite3.OperationalError:
+                # Still locked; the URL has no 'done' row, so the next run tries it again
+                pass
+            return None
+
+    def _download_queued(self, url):
+        try:
+            return self.download(url)
+        finally:
+            self._pending.release()
+
+    def _fetch(self, url, part_path):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            # Only continue the partial file if the asset has not changed since
+            etag = self._stored_etag(url)
+            if etag:
+                headers['If-Range'] = etag
+
+        with self.limiter.slot(url) as ticket:
+            response = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+            ticket.record(response.status_code)
+
+        with response:
+            if response.status_code == 416 and offset:
+                # Nothing left to send: the partial file already holds the whole body
+                total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                if total != str(offset):
+                    os.remove(part_path)
+                    raise requests.HTTPError(f"416 for a partial file of {offset} bytes", response=response)
+                return self._finish(url, part_path, response)
+            response.raise_for_status()
+
+            resumed = False
+            if response.status_code == 206 and offset:
+                match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+                if not match or int(match.group(1)) != offset:
+                    raise requests.HTTPError(f"unexpected Content-Range for {url}", response=response)
+                resumed = True
+                self._count('resumed')
+            else:
+                offset = 0
+
+            self._record(url, 'partial', etag=response.headers.get('ETag'))
+            with open(part_path, 'ab' if resumed else 'wb') as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    self._count('bytes', len(chunk))
+            return self._finish(url, part_path, response)
+
+    def _finish(self, url, part_path, response):
+        digest = hashlib.sha256()
+        size = 0
+        with open(part_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+                size += len(chunk)
+        sha256 = digest.hexdigest()
+
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip() or None
+        path = os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            # Same bytes already stored under another URL
+            os.remove(part_path)
+            self._count('deduplicated')
+        else:
+            os.replace(part_path, path)
+            self._count('downloaded')
+
+        self._record(url, 'done', sha256=sha256, path=path, size=size, content_type=content_type,
+                     etag=response.headers.get('ETag'))
+        return sha256, path
+
+    def _stored_etag(self, url):
+        with self._lock:
+            row = self._conn.execute('SELECT etag FROM media WHERE url = ?', (url,)).fetchone()
+        return row[0] if row else None
+
+    def _record(self, url, status, sha256=None, path=None, size=None, content_type=None, etag=None, error=None):
+        with self._lock:
+            try:
+                self._conn.execute('''
+                    INSERT INTO media (url, status, sha256, path, size, content_type, etag, error, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(url) DO UPDATE SET
+                        status = excluded.status,
+                        sha256 = excluded.sha256,
+                        path = excluded.path,
+                        size = excluded.size,
+                        content_type = excluded.content_type,
+                        etag = COALESCE(excluded.etag, media.etag),
+                        error = excluded.error,
+                        updated_at = excluded.updated_at
+                ''', (url, status, sha256, path, size, content_type, etag, error, time.time()))
+                self._conn.commit()
+            except sqlite3.OperationalError:
+                # Release a half-open write transaction so the next update can retry
+                self._conn.rollback()
+                raise
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
@@ -0,0 +1,258 @@
+import bisect
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stages timed by the scrapers, in the order they are reported
+STAGES = ('fetch', 'parse', 'extract', 'db_write')
+
+
+class Histogram:
+    """Per-bucket counts plus the sum and count of observed values"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One slot per bucket and a final one for values above the largest bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, observations <= bound) pairs ending with '+Inf'"""
+        pairs = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+class Metrics:
+    """Counters, gauges and latency histograms for a scraper run.
+
+    Stage timers land in the stage_seconds histogram labelled by stage,
+    so the fetch timer doubles as the per-page latency histogram. Times of
+    concurrent stages add up, so they are busy time rather than wall time.
+    With export_path set, running() writes <export_path>.json and
+    <export_path>.prom every export_interval seconds and once at the end.
+    """
+
+    def __init__(self, prefix='scraper', buckets=DEFAULT_BUCKETS, export_path=None, export_interval=30.0,
+                 profile_path=None, trace_memory=False):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.export_path = export_path
+        self.export_interval = export_interval
+        # cProfile stats are dumped here when set; trace_memory records tracemalloc peaks
+        self.profile_path = profile_path
+        self.trace_memory = trace_memory
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._memory_top = []
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage):
+        """Time a block of work as one observation of the given stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - started, stage=stage)
+
+    def record_response(self, response):
+        """Count the status, body size, retries and cache use of a response"""
+        self.inc('http_responses', status=str(response.status_code))
+        if getattr(response, 'from_cache', False):
+            self.inc('cache_hits')
+        # The body of a streamed response is only known once it has been read
+        if response._content_consumed and response._content:
+            self.inc('bytes', len(response._content))
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None and retries.history:
+            self.inc('retries', len(retries.history))
+
+    def stage_totals(self):
+        """Total seconds and observation count per stage"""
+        totals = {}
+        with self._lock:
+            for (name, labels), histogram in self._histograms.items():
+                if name == 'stage_seconds':
+                    totals[dict(labels)['stage']] = (histogram.sum, histogram.count)
+        return totals
+
+    def summary(self):
+        """One line with the time spent in each stage"""
+        totals = self.stage_totals()
+        parts = []
+        for stage in STAGES + tuple(sorted(set(totals) - set(STAGES))):
+            if stage in totals:
+                seconds, count = totals[stage]
+                parts.append(f"{stage} {seconds:.2f}s/{count}")
+        return ', '.join(parts) or 'no stages timed'
+
+    def snapshot(self):
+        """All metrics as a JSON-serialisable dict"""
+        with self._lock:
+            result = {
+                'timestamp': time.time(),
+                'counters': _series(self._counters, lambda value: value),
+                'gauges': _series(self._gauges, lambda value: value),
+                'histograms': _series(self._histograms, lambda histogram: {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'buckets': {str(bound): count for bound, count in histogram.cumulative()},
+                }),
+            }
+            if self._memory_top:
+                result['memory_top'] = list(self._memory_top)
+        return result
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, series in _grouped(self._counters):
+                metric = f"{self.prefix}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for labels, value in series:
+                    lines.append(f"{metric}{_format_labels(labels)} {value}")
+            for name, series in _grouped(self._gauges):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} gauge")
+                for labels, value in series:
+                    lines.append(f"{metric}{_format_labels(labels)} {value}")
+            for name, series in _grouped(self._histograms):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for labels, histogram in series:
+                    for bound, count in histogram.cumulative():
+                        bucket_labels = labels + (('le', str(bound)),)
+                        lines.append(f"{metric}_bucket{_format_labels(bucket_labels)} {count}")
+                    lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path=None):
+        """Write <path>.json and <path>.prom, atomically replacing earlier exports"""
+        path = path or self.export_path
+        if not path:
+            return
+        for suffix, text in (('.json', self.to_json()), ('.prom', self.to_prometheus())):
+            _write_atomic(path + suffix, text)
+
+    @contextmanager
+    def running(self):
+        """Wrap a whole run: periodic export, optional profiling and a final export"""
+        stop = threading.Event()
+        exporter = None
+        if self.export_path and self.export_interval:
+            exporter = threading.Thread(target=self._export_loop, args=(stop,), daemon=True)
+            exporter.start()
+
+        profiler = cProfile.Profile() if self.profile_path else None
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if profiler:
+            profiler.enable()
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.set('run_seconds', time.perf_counter() - started)
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(self.profile_path)
+            if self.trace_memory and tracemalloc.is_tracing():
+                self._record_memory()
+                if started_tracing:
+                    tracemalloc.stop()
+            stop.set()
+            if exporter:
+                exporter.join()
+            self.export()
+
+    def _export_loop(self, stop):
+        while not stop.wait(self.export_interval):
+            try:
+                self.export()
+            except OSError as e:
+                print(f"Metrics export failed: {e}")
+
+    def _record_memory(self):
+        current, peak = tracemalloc.get_traced_memory()
+        self.set('traced_memory_bytes', current)
+        self.set('traced_memory_peak_bytes', peak)
+        top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+        with self._lock:
+            self._memory_top = [
+                {'location': str(stat.traceback), 'size': stat.size, 'count': stat.count} for stat in top
+            ]
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _grouped(values):
+    """Group {(name, labels): value} into (name, [(labels, value)]) sorted by name"""
+    groups = {}
+    for (name, labels), value in values.items():
+        groups.setdefault(name, []).append((labels, value))
+    return sorted((name, sorted(series, key=lambda pair: pair[0])) for name, series in groups.items())
+
+
+def _series(values, convert):
+    return {
+        name: [{'labels': dict(labels), 'value': convert(value)} for labels, value in series]
+        for name, series in _grouped(values)
+    }
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _write_atomic(path, text):
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        f.write(text)
+    # os.replace is atomic, so whoever polls the file never sees half an export
+    os.replace(temporary, path)
@@ -0,0 +1,285 @@
+import hashlib
+import re
+import struct
+import time
+from itertools import combinations
+
+from storage import connect, upgrade_schema
+
+# Width of a SimHash fingerprint in bits
+FINGERPRINT_BITS = 64
+
+# Fingerprints are computed from overlapping word n-grams of this size; single words
+# keep the fingerprint of a text with a few edited words within a few bits
+SHINGLE_SIZE = 1
+
+# Spread hashes of this many features are kept between calls; the cache is emptied once full
+SPREAD_CACHE_SIZE = 1 << 16
+
+_spread_cache = {}
+
+
+def words_of(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def simhash(text, shingle_size=SHINGLE_SIZE):
+    """64-bit SimHash of the word shingles of a text, or None for an empty text"""
+    return simhash_words(words_of(text), shingle_size)
+
+
+def simhash_words(words, shingle_size=SHINGLE_SIZE):
+    if not words:
+        return None
+    if len(words) >= shingle_size > 1:
+        features = [' '.join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)]
+    else:
+        features = words
+
+    # Summing the spread hashes counts the set bits of every position at once, in 16-bit lanes,
+    # so a chunk may hold at most 0xFFFF features; the fingerprint keeps the majority bit
+    counts = [0] * FINGERPRINT_BITS
+    for start in range(0, len(features), 0xFFFF):
+        lanes = _sum_spread_hashes(features[start:start + 0xFFFF])
+        counts = [a + b for a, b in zip(counts, struct.unpack('<64H', lanes.to_bytes(128, 'little')))]
+    half = len(features) / 2
+    fingerprint = 0
+    for bit, count in enumerate(counts):
+        if count > half:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def _sum_spread_hashes(features):
+    try:
+        return sum(map(_spread_cache.__getitem__, features))
+    except KeyError:
+        if len(_spread_cache) > SPREAD_CACHE_SIZE:
+            _spread_cache.clear()
+        for feature in features:
+            if feature not in _spread_cache:
+                _spread_cache[feature] = _spread_hash(feature)
+        return sum(map(_spread_cache.__getitem__, features))
+
+
+def _spread_hash(feature):
+    """The 64-bit hash of a feature with bit i moved to bit 16*i of a 1024-bit integer"""
+    value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+    # Reading the binary digits as hex with three zero digits between them puts each in its own 16-bit lane
+    return int('000'.join(format(value, '064b')), 16)
+
+
+def hamming_distance(first, second):
+    return bin(first ^ second).count('1')
+
+
+def to_signed(value):
+    """SQLite integers are signed 64-bit"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class NearDuplicateIndex:
+    """SimHash fingerprints of objects.text with LSH banding to find near-duplicates.
+
+    A fingerprint is cut into max_distance + key_blocks blocks and every
+    combination of key_blocks blocks forms one band. Fingerprints within
+    max_distance bits of each other differ in at most max_distance blocks,
+    so they share at least one band exactly, and candidates come from an
+    indexed band lookup instead of a scan. key_blocks=2 keeps bands long
+    enough that random collisions stay rare as the table grows; key_blocks=1
+    stores fewer bands per row but its short bands collide more often.
+    update() fingerprints new and changed rows in id order and points each
+    near-duplicate at the oldest row it copies through objects.canonical_id.
+    With mode='drop' duplicates are also tombstoned with deleted_at.
+    Changing max_distance or key_blocks needs rebuild(), as the bands are stored.
+    """
+
+    def __init__(self, db_name, max_distance=5, mode='link', min_words=5, key_blocks=2):
+        if mode not in ('link', 'drop'):
+            raise ValueError(f"Unknown near-duplicate mode: {mode!r}")
+        self.db_name = db_name
+        self.max_distance = max_distance
+        self.mode = mode
+        # Shorter texts are fingerprinted but never matched, their SimHash is too coarse
+        self.min_words = min_words
+
+        count = max_distance + key_blocks
+        width = FINGERPRINT_BITS // count
+        # (shift, width) per block; the last block takes the leftover bits
+        self.blocks = []
+        for block in range(count):
+            bits = width if block < count - 1 else FINGERPRINT_BITS - width * (count - 1)
+            self.blocks.append((block * width, bits))
+        # Indexes into self.blocks of the blocks forming each band
+        self.bands = list(combinations(range(count), key_blocks))
+
+        self.conn = connect(db_name)
+        self._schema_ready = False
+
+    def update(self, batch_size=1000):
+        """Fingerprint rows that have no fingerprint yet and link their near-duplicates"""
+        self._ensure_schema()
+        stats = {'fingerprinted': 0, 'duplicates': 0}
+        last_id = -1
+        while True:
+            rows = self.conn.execute('''
+                SELECT objects.id, objects.text, objects.canonical_id FROM objects
+                LEFT JOIN fingerprints ON fingerprints.object_id = objects.id
+                WHERE fingerprints.object_id IS NULL AND objects.id > ?
+                ORDER BY objects.id LIMIT ?
+            ''', (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            # Candidate lookups read before the writes, so the write lock is taken up front
+            self.conn.execute('BEGIN IMMEDIATE')
+            with self.conn:
+                for object_id, text, linked_id in rows:
+                    canonical_id = self._add(object_id, text or '', linked_id)
+                    stats['fingerprinted'] += 1
+                    if canonical_id is not None:
+                        stats['duplicates'] += 1
+            last_id = rows[-1][0]
+        return stats
+
+    def find(self, text, exclude=None):
+        """(object_id, canonical_id, distance) of fingerprinted rows near a text, closest first"""
+        self._ensure_schema()
+        words = words_of(text)
+        if len(words) < self.min_words:
+            return []
+        fingerprint = simhash_words(words)
+        return self._candidates(fingerprint, self._band_values(fingerprint), exclude)
+
+    def duplicates_of(self, object_id):
+        """Ids of the rows linked to object_id as their canonical record"""
+        self._ensure_schema()
+        rows = self.conn.execute(
+            'SELECT object_id FROM fingerprints WHERE canonical_id = ? ORDER BY object_id', (object_id,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def rebuild(self):
+        """Forget every fingerprint and link, then fingerprint all rows again"""
+        self._ensure_schema()
+        with self.conn:
+            self.conn.execute('DELETE FROM fingerprints')
+            self.conn.execute('DELETE FROM fingerprint_bands')
+            self.conn.execute(
+                'UPDATE objects SET canonical_id = NULL, updated_at = ? WHERE canonical_id IS NOT NULL', (time.time(),)
+            )
+        return self.update()
+
+    def close(self):
+        self.conn.close()
+
+    def _ensure_schema(self):
+        # Deferred until first use, so the index can be created before the scraper creates objects
+        if self._schema_ready:
+            return
+        upgrade_schema(self.conn)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                object_id INTEGER PRIMARY KEY,
+                simhash INTEGER,
+                canonical_id INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS fingerprint_bands (
+                band INTEGER NOT NULL,
+                value INTEGER NOT NULL,
+                object_id INTEGER NOT NULL,
+                PRIMARY KEY (band, value, object_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_fingerprint_bands_object ON fingerprint_bands (object_id);
+
+            -- A row whose text goes away or changes has to be fingerprinted again
+            CREATE TRIGGER IF NOT EXISTS fingerprints_delete AFTER DELETE ON objects BEGIN
+                DELETE FROM fingerprints WHERE object_id = old.id;
+                DELETE FROM fingerprint_bands WHERE object_id = old.id;
+            END;
+            CREATE TRIGGER IF NOT EXISTS fingerprints_update AFTER UPDATE OF text ON objects
+            WHEN new.text IS NOT old.text BEGIN
+                DELETE FROM fingerprints WHERE object_id = old.id;
+                DELETE FROM fingerprint_bands WHERE object_id = old.id;
+            END;
+            -- A restored tombstone is checked again, it may be a dropped duplicate coming back
+            CREATE TRIGGER IF NOT EXISTS fingerprints_restore AFTER UPDATE OF deleted_at ON objects
+            WHEN old.deleted_at IS NOT NULL AND new.deleted_at IS NULL BEGIN
+                DELETE FROM fingerprints WHERE object_id = old.id;
+                DELETE FROM fingerprint_bands WHERE object_id = old.id;
+            END;
+        ''')
+        self.conn.commit()
+        self._schema_ready = True
+
+    def _add(self, object_id, text, linked_id=None):
+        words = words_of(text)
+        fingerprint = simhash_words(words)
+        matchable = fingerprint is not None and len(words) >= self.min_words
+        band_values = self._band_values(fingerprint) if matchable else []
+        matches = self._candidates(fingerprint, band_values, exclude=object_id) if matchable else []
+        # The oldest matching row is the canonical one; a match that is itself a copy points further.
+        # A row older than all its matches (e.g. one whose text just changed) stays canonical itself.
+        canonical_id = None
+        if matches:
+            canonical_id = min(match_canonical or match_id for match_id, match_canonical, _ in matches)
+            if canonical_id > object_id:
+                canonical_id = None
+
+        self.conn.execute(
+            'INSERT OR REPLACE INTO fingerprints (object_id, simhash, canonical_id) VALUES (?, ?, ?)',
+            (object_id, to_signed(fingerprint) if fingerprint is not None else None, canonical_id)
+        )
+        if matchable:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO fingerprint_bands (band, value, object_id) VALUES (?, ?, ?)',
+                [(band, value, object_id) for band, value in enumerate(band_values)]
+            )
+
+        # updated_at moves with canonical_id, so incremental exports pick up the new link
+        now = time.time()
+        if self.mode == 'drop' and canonical_id is not None:
+            self.conn.execute(
+                'UPDATE objects SET canonical_id = ?, deleted_at = COALESCE(deleted_at, ?), updated_at = ? WHERE id = ?',
+                (canonical_id, now, now, object_id)
+            )
+        elif canonical_id != linked_id:
+            self.conn.execute(
+                'UPDATE objects SET canonical_id = ?, updated_at = ? WHERE id = ?', (canonical_id, now, object_id)
+            )
+        return canonical_id
+
+    def _band_values(self, fingerprint):
+        parts = [((fingerprint >> shift) & ((1 << bits) - 1), bits) for shift, bits in self.blocks]
+        values = []
+        for band in self.bands:
+            value = 0
+            for block in band:
+                part, bits = parts[block]
+                value = (value << bits) | part
+            values.append(to_signed(value))
+        return values
+
+    def _candidates(self, fingerprint, band_values, exclude=None):
+        conditions = ' OR '.join(['(band = ? AND value = ?)'] * len(self.bands))
+        params = []
+        for band, value in enumerate(band_values):
+            params.extend([band, value])
+        rows = self.conn.execute(f'''
+            SELECT fingerprints.object_id, fingerprints.simhash, fingerprints.canonical_id
+            FROM fingerprints
+            WHERE fingerprints.object_id IN (SELECT object_id FROM fingerprint_bands WHERE {conditions})
+        ''', params).fetchall()
+
+        matches = []
+        for object_id, stored, canonical_id in rows:
+            if object_id == exclude:
+                continue
+            distance = hamming_distance(fingerprint, to_unsigned(stored))
+            if distance <= self.max_distance:
+                matches.append((object_id, canonical_id, distance))
+        matches.sort(key=lambda match: (match[2], match[0]))
+        return matches
@@ -0,0 +1,21 @@
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+    DEFAULT_PARSER = 'lxml'
+except ImportError:
+    DEFAULT_PARSER = 'html.parser'
+
+# Only links are needed from listing pages
+LINKS_STRAINER = SoupStrainer('a', href=True)
+
+
+def make_soup(markup, parser=None, parse_only=None):
+    """Parse markup with the selected backend, lxml by default when it is installed.
+
+    The backends build different trees from malformed markup: lxml closes
+    an unclosed <p> at the next block element as browsers do, html.parser
+    nests it. Extraction code has to give the same result for both trees.
+    """
+    return BeautifulSoup(markup, parser or DEFAULT_PARSER, parse_only=parse_only)
+
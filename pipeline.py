@@ -0,0 +1,246 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+def _timed_call(function, *args):
+    """Run function in a worker process and return (seconds taken, result)"""
+    started = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - started, result
+
+
+async def async_iter(iterable, buffer_size=64):
+    """Iterate a blocking iterator with async for, running it in a thread of its own.
+
+    The thread stays at most buffer_size items ahead of the consumer.
+    Exceptions of the iterator are raised in the consumer, and leaving the
+    async for early stops and closes the iterator.
+    """
+    loop = asyncio.get_running_loop()
+    items = queue.Queue(buffer_size)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up once the consumer is gone instead of blocking on a full queue forever
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    break
+        except BaseException as e:
+            put((_DONE, e))
+            return
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close:
+                close()
+        put((_DONE, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = await loop.run_in_executor(None, items.get)
+            if error is not None:
+                raise error
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        stop.set()
+        await loop.run_in_executor(None, thread.join)
+        # Wake a get() left waiting by a cancelled consumer, so the executor can shut down
+        try:
+            items.put_nowait((_DONE, None))
+        except queue.Full:
+            pass
+
+
+class Pipeline:
+    """Fetch / parse / write pipeline connected by bounded queues.
+
+    fetch(item) runs in a pool of threads and returns a tuple of arguments
+    for parse, or None. parse(*payload) runs in a process pool, so it must
+    be a picklable module-level function (or functools.partial of one) and
+    returns a record or None. write(batch) runs in a single writer thread
+    and gets lists of up to batch_size records as they arrive. A full queue
+    blocks the stage before it, so a slow parser or writer slows fetching
+    down instead of piling up pages in memory. With a metrics.Metrics
+    object, the time parse takes inside the worker processes is recorded
+    as the parse stage.
+    """
+
+    def __init__(self, fetch, parse, write, fetch_workers=8, parse_workers=None,
+                 batch_size=100, queue_size=64, flush_interval=2.0, metrics=None):
+        self.fetch = fetch
+        self.parse = parse
+        self.write = write
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        # Partial batches are written after this many seconds without new records
+        self.flush_interval = flush_interval
+        self.metrics = metrics
+
+    def run(self, items):
+        """Push items through all stages and return per-stage counters"""
+        self.stats = {'fetched': 0, 'fetch_failed': 0, 'parsed': 0, 'parse_failed': 0, 'written': 0}
+        self._lock = threading.Lock()
+        self._feed_error = None
+        self._parse_error = None
+        self._write_error = None
+
+        item_queue = queue.Queue(self.queue_size)
+        parse_queue = queue.Queue(self.queue_size)
+        write_queue = queue.Queue(self.queue_size)
+
+        feeder = threading.Thread(target=self._feed, args=(items, item_queue), daemon=True)
+        fetchers = [
+            threading.Thread(target=self._fetch_loop, args=(item_queue, parse_queue), daemon=True)
+            for _ in range(self.fetch_workers)
+        ]
+        parser = threading.Thread(target=self._parse_loop, args=(parse_queue, write_queue), daemon=True)
+        writer = threading.Thread(target=self._write_loop, args=(write_queue,), daemon=True)
+
+        for thread in [feeder, parser, writer] + fetchers:
+            thread.start()
+
+        feeder.join()
+        for thread in fetchers:
+            thread.join()
+        parse_queue.put(_DONE)
+        parser.join()
+        writer.join()
+
+        if self._feed_error is not None:
+            raise self._feed_error
+        if self._parse_error is not None:
+            raise self._parse_error
+        if self._write_error is not None:
+            raise self._write_error
+        return self.stats
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _feed(self, items, item_queue):
+        # A failing source still ends the stages; the items fed so far are fetched and written first
+        try:
+            for item in items:
+                item_queue.put(item)
+        except BaseException as e:
+            self._feed_error = e
+        finally:
+            for _ in range(self.fetch_workers):
+                item_queue.put(_DONE)
+
+    def _fetch_loop(self, item_queue, parse_queue):
+        while True:
+            item = item_queue.get()
+            if item is _DONE:
+                return
+            try:
+                payload = self.fetch(item)
+            except Exception as e:
+                print(f"Fetch failed for {item!r}: {e}")
+                payload = None
+            if payload is None:
+                self._count('fetch_failed')
+                continue
+            self._count('fetched')
+            parse_queue.put(payload)
+
+    def _parse_loop(self, parse_queue, write_queue):
+        # At most two tasks per process are in flight; the rest wait in parse_queue
+        max_in_flight = self.parse_workers * 2
+        in_flight = deque()
+        finished = False
+        try:
+            with ProcessPoolExecutor(max_workers=self.parse_workers) as pool:
+                while True:
+                    payload = parse_queue.get()
+                    if payload is _DONE:
+                        finished = True
+                        break
+                    if len(in_flight) >= max_in_flight:
+                        self._collect(in_flight.popleft(), write_queue)
+                    if self.metrics:
+                        in_flight.append(pool.submit(_timed_call, self.parse, *payload))
+                    else:
+                        in_flight.append(pool.submit(self.parse, *payload))
+                while in_flight:
+                    self._collect(in_flight.popleft(), write_queue)
+        except BaseException as e:
+            # E.g. a broken process pool; run() raises it once every thread has stopped
+            self._parse_error = e
+            # Keep taking pages off the queue so the fetch threads can finish
+            while not finished:
+                finished = parse_queue.get() is _DONE
+        finally:
+            write_queue.put(_DONE)
+
+    def _collect(self, future, write_queue):
+        try:
+            record = future.result()
+            if self.metrics:
+                seconds, record = record
+                self.metrics.observe('stage_seconds', seconds, stage='parse')
+        except BrokenProcessPool:
+            # Not a bad page: no page can be parsed any more
+            raise
+        except Exception as e:
+            print(f"Parse failed: {e}")
+            record = None
+        if record is None:
+            self._count('parse_failed')
+            return
+        self._count('parsed')
+        write_queue.put(record)
+
+    def _write_loop(self, write_queue):
+        batch = []
+        while True:
+            try:
+                record = write_queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = None
+            if record is _DONE:
+                break
+            if record is not None:
+                batch.append(record)
+            if batch and (record is None or len(batch) >= self.batch_size):
+                self._write_batch(batch)
+                batch = []
+        if batch:
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        # After a failed write keep draining the queue so upstream stages can finish
+        if self._write_error is not None:
+            return
+        try:
+            self.write(batch)
+        except Exception as e:
+            self._write_error = e
+            return
+        with self._lock:
+            self.stats['written'] += len(batch)
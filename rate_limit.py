@@ -0,0 +1,185 @@
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+# Responses that mean the server wants us to slow down
+BACKOFF_STATUSES = {429, 503}
+
+
+class _HostState:
+    """Token bucket and health figures for one host"""
+
+    def __init__(self, max_per_host, rate):
+        self.semaphore = threading.BoundedSemaphore(max_per_host)
+        # rate is in requests per second; None means no spacing at all
+        self.rate = rate
+        self.max_rate = None
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.baseline_latency = None
+        self.recent_latency = None
+        self.last_decrease = 0.0
+        # Set once robots.txt has been applied; requests to the host wait for it
+        self.ready = threading.Event()
+
+
+class Ticket:
+    """Handed out by HostLimiter.slot() to report how the request went"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.status = None
+
+    def record(self, status):
+        """Record the HTTP status of the response, or None for a failed request"""
+        self.status = status
+
+
+class HostLimiter:
+    """Per-host concurrency cap and token-bucket rate limiter.
+
+    With adaptive=True the rate follows AIMD: every healthy response adds
+    increase_step requests per second up to max_rate, while a 429/503, a
+    failed request or a latency spike cuts the rate by decrease_factor.
+    If a session is given, robots.txt is read once per host and its
+    Crawl-delay / Request-rate cap the rate (urllib.robotparser only
+    understands whole-second Crawl-delay values).
+    """
+
+    def __init__(self, max_per_host=4, min_interval=1.0, adaptive=True, max_rate=10.0, min_rate=0.1,
+                 increase_step=0.2, decrease_factor=0.5, latency_factor=2.0, session=None, user_agent='*'):
+        self.max_per_host = max_per_host
+        self.min_interval = min_interval
+        self.adaptive = adaptive
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        # A response slower than latency_factor times the usual latency counts as a spike
+        self.latency_factor = latency_factor
+        self.session = session
+        self.user_agent = user_agent
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    @contextmanager
+    def slot(self, url):
+        """Hold one of the host's request slots and wait for a token.
+
+        Yields a Ticket; call ticket.record(status_code) with the result.
+        Leaving the block without recording counts as a failed request.
+        """
+        host = urlparse(url).netloc.lower()
+        state = self._state(url, host)
+
+        state.semaphore.acquire()
+        try:
+            self._wait_for_token(state)
+            ticket = Ticket()
+            try:
+                yield ticket
+            finally:
+                self._feedback(state, ticket.status, time.monotonic() - ticket.started)
+        finally:
+            state.semaphore.release()
+
+    def current_rate(self, url):
+        """Current request rate for the URL's host, None when unlimited"""
+        state = self._hosts.get(urlparse(url).netloc.lower())
+        return state.rate if state else None
+
+    def _state(self, url, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            first = state is None
+            if first:
+                rate = 1.0 / self.min_interval if self.min_interval > 0 else None
+                state = _HostState(self.max_per_host, rate)
+                state.max_rate = self.max_rate
+                self._hosts[host] = state
+        if not first:
+            # Concurrent first requests wait until the Crawl-delay is known
+            state.ready.wait()
+            return state
+
+        # First request to the host: honour its robots.txt limits
+        try:
+            delay = self._robots_delay(url)
+            if delay:
+                with self._lock:
+                    state.max_rate = min(self.max_rate, 1.0 / delay) if self.max_rate else 1.0 / delay
+                    if state.rate is None or state.rate > state.max_rate:
+                        state.rate = state.max_rate
+        finally:
+            state.ready.set()
+        return state
+
+    def _robots_delay(self, url):
+        """Seconds between requests asked for by robots.txt, or None"""
+        if self.session is None:
+            return None
+        parsed = urlparse(url)
+        try:
+            response = self.session.get(f"{parsed.scheme}://{parsed.netloc}/robots.txt", timeout=10)
+        except Exception:
+            return None
+        if response.status_code != 200:
+            return None
+
+        parser = RobotFileParser()
+        parser.parse(response.text.splitlines())
+        delay = parser.crawl_delay(self.user_agent)
+        request_rate = parser.request_rate(self.user_agent)
+        if request_rate and request_rate.requests:
+            delay = max(delay or 0, request_rate.seconds / request_rate.requests)
+        return float(delay) if delay else None
+
+    def _wait_for_token(self, state):
+        """Take a token from the bucket, sleeping until it has been refilled"""
+        with self._lock:
+            if state.rate is None:
+                return
+            now = time.monotonic()
+            state.tokens = min(1.0, state.tokens + (now - state.updated) * state.rate)
+            state.updated = now
+            # Reserve the token now so concurrent callers queue up behind us
+            state.tokens -= 1.0
+            delay = -state.tokens / state.rate if state.tokens < 0 else 0
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def _feedback(self, state, status, latency):
+        if not self.adaptive:
+            return
+        with self._lock:
+            healthy = status is not None and status < 500 and status not in BACKOFF_STATUSES
+            if healthy:
+                if state.baseline_latency is None:
+                    state.baseline_latency = state.recent_latency = latency
+                state.recent_latency = 0.7 * state.recent_latency + 0.3 * latency
+                # Ignore sub-100 ms wobble on fast hosts
+                spike = (state.recent_latency > self.latency_factor * state.baseline_latency
+                         and state.recent_latency - state.baseline_latency > 0.1)
+                state.baseline_latency = 0.95 * state.baseline_latency + 0.05 * latency
+                if not spike:
+                    self._increase(state)
+                    return
+            self._decrease(state)
+
+    def _increase(self, state):
+        if state.rate is None:
+            return
+        limit = state.max_rate or float('inf')
+        state.rate = min(limit, state.rate + self.increase_step)
+
+    def _decrease(self, state):
+        now = time.monotonic()
+        # One cut per second, so a burst of bad responses does not collapse the rate
+        if now - state.last_decrease < 1.0:
+            return
+        state.last_decrease = now
+        rate = state.rate if state.rate is not None else (state.max_rate or self.max_rate or 1.0)
+        state.rate = max(self.min_rate, rate * self.decrease_factor)
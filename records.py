@@ -0,0 +1,81 @@
+from collections import namedtuple
+
+# Fields of a scraped item, in the order of the objects table
+FIELDS = ('id', 'name', 'audio', 'image', 'text', 'url')
+
+# One scraped item. A tuple, so it costs a fraction of an equivalent dict and
+# pickles cheaply between the parse processes and the writer
+Record = namedtuple('Record', FIELDS, defaults=(None,))
+
+
+def as_record(item):
+    """Record from a Record or a dict with the same keys, e.g. one built by older code"""
+    if isinstance(item, Record):
+        return item
+    return Record(*(item.get(field) for field in FIELDS))
+
+
+class RecordBatch:
+    """Records kept column by column, one list per field.
+
+    batch.url[i] is the URL of the i-th record. There is no object per
+    record at all, and the writers in storage read the columns directly.
+    Iterating yields Record tuples built on the fly.
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, records=()):
+        for field in FIELDS:
+            setattr(self, field, [])
+        self.extend(records)
+
+    @classmethod
+    def of(cls, data):
+        """data itself if it is already a batch, otherwise a batch of its records"""
+        if isinstance(data, cls):
+            return data
+        return cls(data)
+
+    def append(self, record):
+        record = as_record(record)
+        self.id.append(record.id)
+        self.name.append(record.name)
+        self.audio.append(record.audio)
+        self.image.append(record.image)
+        self.text.append(record.text)
+        self.url.append(record.url)
+
+    def extend(self, records):
+        if isinstance(records, RecordBatch):
+            for field in FIELDS:
+                getattr(self, field).extend(getattr(records, field))
+            return
+        for record in records:
+            self.append(record)
+
+    def columns(self):
+        """The field lists, in FIELDS order"""
+        return [getattr(self, field) for field in FIELDS]
+
+    def clear(self):
+        for field in FIELDS:
+            getattr(self, field).clear()
+
+    def __len__(self):
+        return len(self.id)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # A new batch; the lists are copied, the values shared
+            part = RecordBatch()
+            for field in FIELDS:
+                setattr(part, field, getattr(self, field)[index])
+            return part
+        return Record(*(column[index] for column in self.columns()))
+
+    def __iter__(self):
+        return map(Record._make, zip(*self.columns()))
+
+    def __repr__(self):
+        return f"RecordBatch({len(self)} records)"
@@ -1,14 +1,86 @@
 import requests
-from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
 import sqlite3
 import time
 import os
 from urllib.parse import urljoin
 import random
+from functools import partial
+
+from extraction import ExtractionRules, FieldRule
+from http_client import get_session
+from media import media_urls
+from metrics import Metrics
+from parsing import make_soup
+from pipeline import Pipeline, async_iter
+from rate_limit import HostLimiter
+from records import Record, RecordBatch
+from storage import record_batches, replace_objects, upgrade_schema, upsert_objects
+
+# Listing pages only need the book pods, detail pages only the product block
+LISTING_STRAINER = SoupStrainer('article', class_='product_pod')
+DETAIL_STRAINER = SoupStrainer('article', class_='product_page')
+
+def description_text(element):
+    """The description is the paragraph right after the #product_description header"""
+    return element.find_next_sibling('p').text.strip()
+
+BOOK_RULES = ExtractionRules([
+    FieldRule('image', ['div.item'], extract=lambda element: element.find('img')),
+    FieldRule('text', ['div#product_description'], extract=description_text),
+])
+
+def parse_book_page(content, parser=None, selective_parsing=True):
+    """Parse a book detail page, only its product block when selective parsing is on"""
+    if selective_parsing:
+        soup = make_soup(content, parser, DETAIL_STRAINER)
+        if soup.find('article', class_='product_page'):
+            return soup
+    # Full parse, also used when the page has no product block
+    return make_soup(content, parser)
+
+def book_record(soup, book_id, title, url, base_url="http://books.toscrape.com/"):
+    """Build a book record from a parsed detail page"""
+    fields = BOOK_RULES.extract(soup)
+    
+    # Extract image URL
+    image_elem = fields['image']
+    image_url = urljoin(base_url, image_elem['src']) if image_elem else ""
+    
+    # Extract description/text
+    text = fields['text'] or "No description available"
+    
+    # Generate audio URL (mock data since books.toscrape doesn't have audio)
+    audio_url = f"https://example.com/audio/{book_id}.mp3"
+    
+    return Record(id=book_id, name=title, audio=audio_url, image=image_url, text=text, url=url)
+
+def parse_book_details(content, book_id, title, url, parser=None, selective_parsing=True,
+                       base_url="http://books.toscrape.com/"):
+    """Build a book record from its detail page; a plain function so worker processes can run it"""
+    return book_record(parse_book_page(content, parser, selective_parsing), book_id, title, url, base_url)
 
 class WebScraper:
-    def __init__(self, db_name="scraped_data.db"):
+    def __init__(self, db_name="scraped_data.db", session=None, parser=None, selective_parsing=True,
+                 max_per_host=8, min_interval=0.2, max_rate=20.0, adaptive_rate=True, metrics=None, media=None,
+                 near_duplicates=None, image_prober=None):
+        self.base_url = "http://books.toscrape.com/"
         self.db_name = db_name
+        self.session = session or get_session()
+        # Requests start at one per min_interval and adapt to how the site copes
+        self.limiter = HostLimiter(max_per_host=max_per_host, min_interval=min_interval, max_rate=max_rate,
+                                   adaptive=adaptive_rate, session=self.session)
+        # parser=None picks lxml when available
+        self.parser = parser
+        self.selective_parsing = selective_parsing
+        # Stage timers and HTTP counters; pass Metrics(export_path=...) to export them
+        self.metrics = metrics or Metrics(prefix='books')
+        # Optional media.MediaDownloader; saved image/audio URLs are downloaded in the background
+        self.media = media
+        # Optional near_duplicates.NearDuplicateIndex run after every save to link or drop near-copies
+        self.near_duplicates = near_duplicates
+        # Optional image_probe.ImageProber; image sizes are read from the first bytes once a run has saved
+        self.image_prober = image_prober
         self.setup_database()
     
     def setup_database(self):
@@ -25,110 +97,214 @@ class WebScraper:
                 text TEXT
             )
         ''')
+        upgrade_schema(conn)
         
         conn.commit()
         conn.close()
         print(f"Database '{self.db_name}' created/connected successfully")
     
+    def fetch(self, url, timeout=10):
+        """GET a page through the per-host rate limiter"""
+        # Be respectful to the server
+        with self.limiter.slot(url) as ticket, self.metrics.timer('fetch'):
+            try:
+                response = self.session.get(url, timeout=timeout)
+            except requests.RequestException:
+                self.metrics.inc('fetch_errors')
+                raise
+            ticket.record(response.status_code)
+            self.metrics.record_response(response)
+            return response
+    
     def scrape_books_to_scrape(self, max_objects=100):
         """Scrape books from books.toscrape.com"""
-        base_url = "http://books.toscrape.com/catalogue/page-{}.html"
-        scraped_data = []
+        return RecordBatch(self.iter_books(max_objects))
+    
+    def iter_books(self, max_objects=100):
+        """Yield book records from books.toscrape.com one by one, as soon as each is extracted"""
+        base_url = urljoin(self.base_url, "catalogue/page-{}.html")
+        count = 0
         page = 1
         
         print("Starting to scrape books.toscrape.com...")
         
-        while len(scraped_data) < max_objects:
+        while count < max_objects:
             url = base_url.format(page)
             print(f"Scraping page {page}: {url}")
             
             try:
-                response = requests.get(url, timeout=10)
+                response = self.fetch(url)
                 response.raise_for_status()
                 
-                soup = BeautifulSoup(response.content, 'html.parser')
-                books = soup.find_all('article', class_='product_pod')
+                with self.metrics.timer('parse'):
+                    soup = make_soup(response.content, self.parser, LISTING_STRAINER if self.selective_parsing else None)
+                with self.metrics.timer('extract'):
+                    books = soup.find_all('article', class_='product_pod')
                 
                 if not books:
                     print("No more books found")
                     break
                 
                 for book in books:
-                    if len(scraped_data) >= max_objects:
+                    if count >= max_objects:
                         break
                     
                     # Extract book data
                     title = book.h3.a['title']
                     relative_url = book.h3.a['href']
-                    full_url = urljoin("http://books.toscrape.com/catalogue/", relative_url)
+                    full_url = urljoin(urljoin(self.base_url, "catalogue/"), relative_url)
                     
                     # Get detailed book information
                     try:
-                        book_response = requests.get(full_url, timeout=10)
-                        book_soup = BeautifulSoup(book_response.content, 'html.parser')
-                        
-                        # Extract image URL
-                        image_elem = book_soup.find('div', class_='item').find('img')
-                        image_url = urljoin("http://books.toscrape.com/", image_elem['src']) if image_elem else ""
-                        
-                        # Extract description/text
-                        description_elem = book_soup.find('div', id='product_description')
-                        if description_elem:
-                            text = description_elem.find_next_sibling('p').text.strip()
-                        else:
-                            text = "No description available"
-                        
-                        # Generate audio URL (mock data since books.toscrape doesn't have audio)
-                        audio_url = f"https://example.com/audio/{len(scraped_data) + 1}.mp3"
-                        
-                        scraped_data.append({
-                            'id': len(scraped_data) + 1,
-                            'name': title,
-                            'audio': audio_url,
-                            'image': image_url,
-                            'text': text
-                        })
-                        
-                        print(f"Scraped {len(scraped_data)}/{max_objects}: {title}")
-                        
+                        book_response = self.fetch(full_url)
+                        with self.metrics.timer('parse'):
+                            book_soup = parse_book_page(book_response.content, self.parser, self.selective_parsing)
+                        with self.metrics.timer('extract'):
+                            record = book_record(book_soup, count + 1, title, full_url, self.base_url)
                     except Exception as e:
                         print(f"Error getting details for {title}: {e}")
                         continue
+                    
+                    count += 1
+                    print(f"Scraped {count}/{max_objects}: {title}")
+                    yield record
                 
                 page += 1
-                time.sleep(1)  # Be respectful to the server
                 
             except requests.RequestException as e:
                 print(f"Error scraping page {page}: {e}")
                 break
+    
+    def aiter_books(self, max_objects=100):
+        """iter_books as an async iterator, for use with async for; the crawl runs in a thread"""
+        return async_iter(self.iter_books(max_objects))
+    
+    def iter_book_links(self, max_objects=100):
+        """Yield (book_id, title, url) for books on the listing pages, page by page"""
+        page_url = urljoin(self.base_url, "catalogue/page-{}.html")
+        count = 0
+        page = 1
         
-        return scraped_data[:max_objects]
+        while count < max_objects:
+            try:
+                response = self.fetch(page_url.format(page))
+                response.raise_for_status()
+            except requests.RequestException as e:
+                print(f"Error scraping page {page}: {e}")
+                return
+            
+            with self.metrics.timer('parse'):
+                soup = make_soup(response.content, self.parser, LISTING_STRAINER if self.selective_parsing else None)
+            with self.metrics.timer('extract'):
+                books = soup.find_all('article', class_='product_pod')
+            if not books:
+                return
+            
+            for book in books:
+                if count >= max_objects:
+                    return
+                count += 1
+                full_url = urljoin(urljoin(self.base_url, "catalogue/"), book.h3.a['href'])
+                yield count, book.h3.a['title'], full_url
+            
+            page += 1
     
-    def save_to_database(self, data):
-        """Save scraped data to database"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+    def run_pipeline(self, max_objects=100, fetch_workers=8, parse_workers=None, batch_size=50):
+        """Fetch, parse and store book pages in overlapping stages"""
+        with self.metrics.running():
+            print(f"Starting pipeline to collect {max_objects} books...")
+            
+            def fetch(item):
+                book_id, title, url = item
+                response = self.fetch(url)
+                response.raise_for_status()
+                return response.content, book_id, title, url
+            
+            pipeline = Pipeline(
+                fetch=fetch,
+                parse=partial(parse_book_details, parser=self.parser, selective_parsing=self.selective_parsing,
+                              base_url=self.base_url),
+                write=lambda batch: self.save_to_database(batch, incremental=True),
+                fetch_workers=fetch_workers,
+                parse_workers=parse_workers,
+                batch_size=batch_size,
+                # Parsing and extraction both happen in the workers and are timed together as parse
+                metrics=self.metrics
+            )
+            stats = pipeline.run(self.iter_book_links(max_objects))
+            
+            print(f"Fetched {stats['fetched']}, parsed {stats['parsed']}, saved {stats['written']} books")
+            self.display_data()
+            self.probe_images()
+            self.wait_for_media()
         
-        # Clear existing data
-        cursor.execute("DELETE FROM objects")
+        print(f"Metrics: {self.metrics.summary()}")
+    
+    def probe_images(self):
+        """Read the sizes of newly saved images once the run has stored its books"""
+        if not self.image_prober:
+            return
+        with self.metrics.timer('image_probe'):
+            stats = self.image_prober.enrich()
+        print(f"Images: {stats['images']} probed, {stats['failed']} unreadable, "
+              f"{stats['retry']} left for a retry, {stats['bytes_read'] / 1024:.0f} KB read")
+    
+    def wait_for_media(self):
+        """Wait for background media downloads and report them"""
+        if not self.media:
+            return
+        stats = self.media.wait()
+        print(f"Media: {stats['downloaded']} downloaded, {stats['deduplicated']} duplicates, "
+              f"{stats['known']} already stored, {stats['resumed']} resumed, {stats['failed']} failed")
+    
+    def save_to_database(self, data, incremental=False, tombstone_missing=False, append=False):
+        """Save scraped records (a RecordBatch or a list of records) to database.
         
-        # Insert new data
-        for item in data:
-            cursor.execute('''
-                INSERT INTO objects (id, name, audio, image, text)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (item['id'], item['name'], item['audio'], item['image'], item['text']))
+        A full save replaces the table, or adds to it with append=True.
+        """
+        data = RecordBatch.of(data)
+        with self.metrics.timer('db_write'):
+            self._save_to_database(data, incremental, tombstone_missing, append)
+        self.metrics.inc('rows_written', len(data))
+        if self.near_duplicates:
+            with self.metrics.timer('near_duplicates'):
+                stats = self.near_duplicates.update()
+            print(f"Near-duplicates: {stats['fingerprinted']} checked, {stats['duplicates']} found")
+        if self.media:
+            self.media.enqueue(media_urls(data))
+    
+    def _save_to_database(self, data, incremental, tombstone_missing, append):
+        if incremental:
+            # Upsert by source URL instead of rewriting the whole table
+            stats = upsert_objects(self.db_name, data, tombstone_missing=tombstone_missing)
+            print(f"Incremental save: {stats['inserted']} inserted, {stats['updated']} updated, "
+                  f"{stats['unchanged']} unchanged, {stats['tombstoned']} tombstoned")
+            return
         
-        conn.commit()
-        conn.close()
+        # Rewrite the table (or add to it) with the same url/content_hash/updated_at as upserts
+        replace_objects(self.db_name, data, append=append)
         print(f"Successfully saved {len(data)} items to database")
     
+    def save_stream(self, records, incremental=False, batch_size=100):
+        """Save records from an iterator in batches of batch_size, each committed as soon as it is full.
+        
+        Memory stays bounded by one batch, and whatever was saved survives a
+        crash later in the crawl. A full save replaces the table with the
+        first batch and appends the rest. Returns the number of records saved.
+        """
+        saved = 0
+        for batch in record_batches(records, batch_size):
+            self.save_to_database(batch, incremental=incremental, append=saved > 0)
+            saved += len(batch)
+            print(f"Saved {saved} records so far")
+        return saved
+    
     def display_data(self, limit=10):
         """Display data from database"""
         conn = sqlite3.connect(self.db_name)
         cursor = conn.cursor()
         
-        cursor.execute("SELECT id, name, audio, image, text FROM objects ORDER BY id LIMIT ?", (limit,))
+        cursor.execute("SELECT id, name, audio, image, text FROM objects WHERE deleted_at IS NULL ORDER BY id LIMIT ?", (limit,))
         rows = cursor.fetchall()
         
         print("\n" + "="*80)
@@ -147,30 +323,33 @@ class WebScraper:
         
         print("-"*80)
         
-        cursor.execute("SELECT COUNT(*) FROM objects")
+        cursor.execute("SELECT COUNT(*) FROM objects WHERE deleted_at IS NULL")
         total_count = cursor.fetchone()[0]
         print(f"Total records in database: {total_count}")
         
         conn.close()
     
-    def run(self, max_objects=100):
-        """Main method to run the scraper"""
-        print(f"Starting web scraper to collect {max_objects} objects...")
-        
-        # Scrape data
-        data = self.scrape_books_to_scrape(max_objects)
-        
-        if data:
-            # Save to database
-            self.save_to_database(data)
+    def run(self, max_objects=100, incremental=False, batch_size=100):
+        """Main method to run the scraper; books are saved batch_size at a time while the crawl goes on"""
+        with self.metrics.running():
+            print(f"Starting web scraper to collect {max_objects} objects...")
             
-            # Display first few records
-            self.display_data()
+            # Scrape and save data
+            saved = self.save_stream(self.iter_books(max_objects), incremental=incremental,
+                                     batch_size=batch_size)
             
-            print(f"\nScraping completed successfully!")
-            print(f"Data saved to '{self.db_name}'")
-        else:
-            print("No data was scraped")
+            if saved:
+                # Display first few records
+                self.display_data()
+                
+                print(f"\nScraping completed successfully!")
+                print(f"Data saved to '{self.db_name}'")
+            else:
+                print("No data was scraped")
+            self.probe_images()
+            self.wait_for_media()
+        
+        print(f"Metrics: {self.metrics.summary()}")
 
 if __name__ == "__main__":
     scraper = WebScraper()
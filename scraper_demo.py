@@ -6,10 +6,95 @@ import os
 from urllib.parse import urljoin
 import json
 import random
+import codecs
+from concurrent.futures import ThreadPoolExecutor
+
+from http_client import get_session
+from media import media_urls
+from metrics import Metrics
+from records import Record, RecordBatch
+from storage import replace_objects, upgrade_schema, upsert_objects
+
+# Bytes read from a streamed JSON response at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_array(chunks, limit=None):
+    """Yield the items of a top-level JSON array from an iterable of byte chunks.
+
+    Items are decoded as soon as their closing bracket arrives, so reading
+    can stop after limit items without downloading or holding the rest of
+    the array.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    exhausted = False
+    started = False
+    count = 0
+    while limit is None or count < limit:
+        skip = ' \t\r\n,' if started else ' \t\r\n'
+        while position < len(buffer) and buffer[position] in skip:
+            position += 1
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError("Expected a JSON array")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+                end = None
+            # A number cut by a chunk boundary (12|34, 1.|5) decodes too soon; only a delimiter ends it
+            if end is not None and (exhausted or (end < len(buffer) and buffer[end] in ' \t\r\n,]')):
+                yield item
+                count += 1
+                position = end
+                continue
+        elif exhausted:
+            raise ValueError("JSON array ended early")
+
+        # Drop what has been consumed so the buffer stays about one chunk long
+        buffer = buffer[position:]
+        position = 0
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            buffer += text_decoder.decode(b'', final=True)
+        else:
+            buffer += text_decoder.decode(chunk)
+
 
 class WebScraperDemo:
-    def __init__(self, db_name="scraped_data.db"):
+    def __init__(self, db_name="scraped_data.db", session=None, metrics=None, media=None, near_duplicates=None, mock_seed=None, image_prober=None,
+                 max_workers=4, stream_json=True, page_size=1000):
+        self.api_url = "https://jsonplaceholder.typicode.com"
         self.db_name = db_name
+        self.session = session or get_session()
+        # Stage timers and HTTP counters; pass Metrics(export_path=...) to export them
+        self.metrics = metrics or Metrics(prefix='demo')
+        # Optional media.MediaDownloader; saved image/audio URLs are downloaded in the background
+        self.media = media
+        # Optional near_duplicates.NearDuplicateIndex run after every save to link or drop near-copies
+        self.near_duplicates = near_duplicates
+        # Optional image_probe.ImageProber; image sizes are read from the first bytes once a run has saved
+        self.image_prober = image_prober
+        # Mock rows come from this generator; a fixed mock_seed makes them the same on every run
+        self.random = random.Random(mock_seed)
+        # Parallel API requests; 1 fetches the endpoints one after another
+        self.max_workers = max_workers
+        # Decode JSON arrays while they download and stop reading once enough items arrived
+        self.stream_json = stream_json
+        # Larger requests are split into _start/_limit pages of this size fetched in parallel
+        self.page_size = page_size
         self.setup_database()
     
     def setup_database(self):
@@ -26,6 +111,7 @@ class WebScraperDemo:
                 text TEXT
             )
         ''')
+        upgrade_schema(conn)
         
         conn.commit()
         conn.close()
@@ -35,22 +121,22 @@ class WebScraperDemo:
         """Generate mock data for demonstration"""
         print("Generating mock data for demonstration...")
         
-        mock_data = []
+        mock_data = RecordBatch()
         categories = ["Science Fiction", "Fantasy", "Mystery", "Romance", "Thriller", 
                      "Biography", "History", "Technology", "Art", "Philosophy"]
         
         for i in range(1, max_objects + 1):
-            category = random.choice(categories)
+            category = self.random.choice(categories)
             
             # Generate realistic book titles
             title_templates = [
-                f"The {random.choice(['Great', 'Lost', 'Hidden', 'Ancient', 'Modern'])} {random.choice(['Journey', 'Mystery', 'Adventure', 'Story', 'Tale'])}",
-                f"{random.choice(['Understanding', 'Exploring', 'Discovering', 'Mastering'])} {category}",
-                f"{random.choice(['Secrets', 'Principles', 'Foundations', 'Essentials'])} of {category}",
-                f"The {random.choice(['Art', 'Science', 'Philosophy', 'History'])} of {random.choice(['Success', 'Innovation', 'Creativity', 'Leadership'])}"
+                f"The {self.random.choice(['Great', 'Lost', 'Hidden', 'Ancient', 'Modern'])} {self.random.choice(['Journey', 'Mystery', 'Adventure', 'Story', 'Tale'])}",
+                f"{self.random.choice(['Understanding', 'Exploring', 'Discovering', 'Mastering'])} {category}",
+                f"{self.random.choice(['Secrets', 'Principles', 'Foundations', 'Essentials'])} of {category}",
+                f"The {self.random.choice(['Art', 'Science', 'Philosophy', 'History'])} of {self.random.choice(['Success', 'Innovation', 'Creativity', 'Leadership'])}"
             ]
             
-            name = random.choice(title_templates)
+            name = self.random.choice(title_templates)
             
             # Generate mock audio URL
             audio = f"https://example.com/audio/book_{i:03d}.mp3"
@@ -66,49 +152,98 @@ class WebScraperDemo:
                 f"Discover the latest trends and innovations in {category.lower()} through this engaging and informative work.",
                 f"A masterful exploration of {category.lower()} that challenges conventional thinking and inspires new ideas."
             ]
-            text = random.choice(descriptions)
+            text = self.random.choice(descriptions)
             
-            mock_data.append({
-                'id': i,
-                'name': name,
-                'audio': audio,
-                'image': image,
-                'text': text
-            })
+            # Mock rows have no source page, key them by their position instead
+            mock_data.append(Record(id=i, name=name, audio=audio, image=image, text=text, url=f"mock://demo/{i}"))
             
             if i % 10 == 0:
                 print(f"Generated {i}/{max_objects} mock objects")
         
         return mock_data
     
+    def get_json(self, url, timeout=10, stream=False):
+        """GET an API endpoint, recording its timing and status"""
+        with self.metrics.timer('fetch'):
+            try:
+                response = self.session.get(url, timeout=timeout, stream=stream)
+            except requests.RequestException:
+                self.metrics.inc('fetch_errors')
+                raise
+        self.metrics.record_response(response)
+        response.raise_for_status()
+        return response
+    
+    def fetch_items(self, path, limit):
+        """First limit items of a JSON array endpoint such as /posts"""
+        if self.page_size and limit > self.page_size:
+            return self._read_pages(path, limit)
+        return self._read_items(f"{self.api_url}{path}", limit)
+    
+    def _read_items(self, url, limit):
+        if not self.stream_json:
+            response = self.get_json(url)
+            with self.metrics.timer('parse'):
+                return response.json()[:limit]
+        response = self.get_json(url, stream=True)
+        # Closing the response early drops the rest of the download
+        with response, self.metrics.timer('parse'):
+            return list(iter_json_array(response.iter_content(STREAM_CHUNK_SIZE), limit))
+    
+    def _read_pages(self, path, limit):
+        """Fetch limit items as page_size pages, the first one alone and the rest in parallel"""
+        urls = [
+            f"{self.api_url}{path}?_start={start}&_limit={min(self.page_size, limit - start)}"
+            for start in range(0, limit, self.page_size)
+        ]
+        # One item more than asked shows whether the server honours _start/_limit (json-server does)
+        items = self._read_items(urls[0], self.page_size + 1)
+        if len(items) > self.page_size:
+            print(f"{path} ignores paging parameters, reading it as one stream")
+            return self._read_items(f"{self.api_url}{path}", limit)
+        if len(items) < self.page_size:
+            return items
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pages = list(executor.map(lambda url: self._read_items(url, self.page_size), urls[1:]))
+        for page in pages:
+            items.extend(page)
+            if len(page) < self.page_size:
+                break
+        return items
+    
     def try_jsonplaceholder(self, max_objects=100):
         """Try to get data from JSONPlaceholder API"""
         print("Attempting to use JSONPlaceholder API...")
         
         try:
-            # Get posts from JSONPlaceholder
-            response = requests.get("https://jsonplaceholder.typicode.com/posts", timeout=10)
-            response.raise_for_status()
-            posts = response.json()
+            # Posts, and photos for their images; only the first max_objects of each are needed
+            if self.max_workers > 1:
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    posts_future = executor.submit(self.fetch_items, '/posts', max_objects)
+                    photos_future = executor.submit(self.fetch_items, '/photos', max_objects)
+                    posts = posts_future.result()
+                    photos = photos_future.result()
+            else:
+                posts = self.fetch_items('/posts', max_objects)
+                photos = self.fetch_items('/photos', max_objects)
             
-            # Get photos for images
-            photos_response = requests.get("https://jsonplaceholder.typicode.com/photos", timeout=10)
-            photos_response.raise_for_status()
-            photos = photos_response.json()
-            
-            scraped_data = []
+            scraped_data = RecordBatch()
             
+            extract_started = time.perf_counter()
             for i, post in enumerate(posts[:max_objects]):
                 # Get corresponding photo
                 photo = photos[i] if i < len(photos) else photos[0]
                 
-                scraped_data.append({
-                    'id': post['id'],
-                    'name': post['title'].title(),
-                    'audio': f"https://example.com/audio/post_{post['id']}.mp3",
-                    'image': photo['url'],
-                    'text': post['body']
-                })
+                scraped_data.append(Record(
+                    id=post['id'],
+                    name=post['title'].title(),
+                    audio=f"https://example.com/audio/post_{post['id']}.mp3",
+                    image=photo['url'],
+                    text=post['body'],
+                    url=f"{self.api_url}/posts/{post['id']}"
+                ))
+            
+            self.metrics.observe('stage_seconds', time.perf_counter() - extract_started, stage='extract')
             
             print(f"Successfully retrieved {len(scraped_data)} items from JSONPlaceholder")
             return scraped_data
@@ -117,23 +252,46 @@ class WebScraperDemo:
             print(f"Error using JSONPlaceholder: {e}")
             return None
     
-    def save_to_database(self, data):
-        """Save scraped data to database"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        # Clear existing data
-        cursor.execute("DELETE FROM objects")
-        
-        # Insert new data
-        for item in data:
-            cursor.execute('''
-                INSERT INTO objects (id, name, audio, image, text)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (item['id'], item['name'], item['audio'], item['image'], item['text']))
+    def probe_images(self):
+        """Read the sizes of newly saved images once the run has stored its records"""
+        if not self.image_prober:
+            return
+        with self.metrics.timer('image_probe'):
+            stats = self.image_prober.enrich()
+        print(f"Images: {stats['images']} probed, {stats['failed']} unreadable, "
+              f"{stats['retry']} left for a retry, {stats['bytes_read'] / 1024:.0f} KB read")
+    
+    def wait_for_media(self):
+        """Wait for background media downloads and report them"""
+        if not self.media:
+            return
+        stats = self.media.wait()
+        print(f"Media: {stats['downloaded']} downloaded, {stats['deduplicated']} duplicates, "
+              f"{stats['known']} already stored, {stats['resumed']} resumed, {stats['failed']} failed")
+    
+    def save_to_database(self, data, incremental=False, tombstone_missing=False):
+        """Save scraped records (a RecordBatch or a list of records) to database"""
+        data = RecordBatch.of(data)
+        with self.metrics.timer('db_write'):
+            self._save_to_database(data, incremental, tombstone_missing)
+        self.metrics.inc('rows_written', len(data))
+        if self.near_duplicates:
+            with self.metrics.timer('near_duplicates'):
+                stats = self.near_duplicates.update()
+            print(f"Near-duplicates: {stats['fingerprinted']} checked, {stats['duplicates']} found")
+        if self.media:
+            self.media.enqueue(media_urls(data))
+    
+    def _save_to_database(self, data, incremental, tombstone_missing):
+        if incremental:
+            # Upsert by source URL instead of rewriting the whole table
+            stats = upsert_objects(self.db_name, data, tombstone_missing=tombstone_missing)
+            print(f"Incremental save: {stats['inserted']} inserted, {stats['updated']} updated, "
+                  f"{stats['unchanged']} unchanged, {stats['tombstoned']} tombstoned")
+            return
         
-        conn.commit()
-        conn.close()
+        # Rewrite the table with the same url/content_hash/updated_at as upserts
+        replace_objects(self.db_name, data)
         print(f"Successfully saved {len(data)} items to database")
     
     def display_data(self, limit=10):
@@ -141,7 +299,7 @@ class WebScraperDemo:
         conn = sqlite3.connect(self.db_name)
         cursor = conn.cursor()
         
-        cursor.execute("SELECT id, name, audio, image, text FROM objects ORDER BY id LIMIT ?", (limit,))
+        cursor.execute("SELECT id, name, audio, image, text FROM objects WHERE deleted_at IS NULL ORDER BY id LIMIT ?", (limit,))
         rows = cursor.fetchall()
         
         print("\n" + "="*80)
@@ -160,35 +318,40 @@ class WebScraperDemo:
         
         print("-"*80)
         
-        cursor.execute("SELECT COUNT(*) FROM objects")
+        cursor.execute("SELECT COUNT(*) FROM objects WHERE deleted_at IS NULL")
         total_count = cursor.fetchone()[0]
         print(f"Total records in database: {total_count}")
         
         conn.close()
     
-    def run(self, max_objects=100):
+    def run(self, max_objects=100, incremental=False):
         """Main method to run the scraper"""
-        print(f"Starting web scraper to collect {max_objects} objects...")
-        
-        # Try real API first
-        data = self.try_jsonplaceholder(max_objects)
-        
-        # If that fails, use mock data
-        if not data:
-            print("Using mock data for demonstration...")
-            data = self.generate_mock_data(max_objects)
-        
-        if data:
-            # Save to database
-            self.save_to_database(data)
+        with self.metrics.running():
+            print(f"Starting web scraper to collect {max_objects} objects...")
             
-            # Display first few records
-            self.display_data()
+            # Try real API first
+            data = self.try_jsonplaceholder(max_objects)
             
-            print(f"\nScraping completed successfully!")
-            print(f"Data saved to '{self.db_name}'")
-        else:
-            print("No data was scraped")
+            # If that fails, use mock data
+            if not data:
+                print("Using mock data for demonstration...")
+                data = self.generate_mock_data(max_objects)
+            
+            if data:
+                # Save to database
+                self.save_to_database(data, incremental=incremental)
+                
+                # Display first few records
+                self.display_data()
+                
+                print(f"\nScraping completed successfully!")
+                print(f"Data saved to '{self.db_name}'")
+            else:
+                print("No data was scraped")
+            self.probe_images()
+            self.wait_for_media()
+        
+        print(f"Metrics: {self.metrics.summary()}")
 
 if __name__ == "__main__":
     scraper = WebScraperDemo()
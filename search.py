@@ -0,0 +1,116 @@
+import argparse
+import re
+import sqlite3
+
+from storage import fold_text, reindex_search, upgrade_search
+
+# Matches in the name count ten times as much as matches in the text
+NAME_WEIGHT = 10.0
+TEXT_WEIGHT = 1.0
+
+
+def to_match_query(text):
+    """Turn free text into an FTS5 query requiring every word, the last one as a prefix"""
+    words = re.findall(r'\w+', fold_text(text))
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search(db_name, query, page=1, per_page=10, raw=False):
+    """Ranked full-text search over objects.
+
+    Returns (total matches, rows) where rows are dicts with id, name, url,
+    snippet and rank for the requested page. With raw=True the query is
+    passed to FTS5 as is, so its operators (OR, NOT, NEAR, "phrases",
+    name:word) can be used.
+    """
+    conn = sqlite3.connect(db_name)
+    try:
+        if not upgrade_search(conn):
+            raise RuntimeError("this SQLite build has no FTS5 support")
+        conn.commit()
+        return search_connection(conn, query, page, per_page, raw)
+    finally:
+        conn.close()
+
+
+def search_connection(conn, query, page=1, per_page=10, raw=False):
+    """search() on an open connection to a database whose index already exists"""
+    match = fold_text(query) if raw else to_match_query(query)
+    if not match:
+        return 0, []
+
+    total = conn.execute('''
+        SELECT COUNT(*) FROM objects_fts
+        JOIN objects ON objects.id = objects_fts.rowid
+        WHERE objects_fts MATCH ? AND objects.deleted_at IS NULL
+    ''', (match,)).fetchone()[0]
+
+    rows = conn.execute('''
+        SELECT objects.id, objects.name, objects.url,
+               snippet(objects_fts, -1, '[', ']', '...', 12),
+               bm25(objects_fts, ?, ?) AS rank
+        FROM objects_fts
+        JOIN objects ON objects.id = objects_fts.rowid
+        WHERE objects_fts MATCH ? AND objects.deleted_at IS NULL
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+    ''', (NAME_WEIGHT, TEXT_WEIGHT, match, per_page, (page - 1) * per_page)).fetchall()
+
+    return total, [
+        {'id': row[0], 'name': row[1], 'url': row[2], 'snippet': row[3], 'rank': row[4]}
+        for row in rows
+    ]
+
+
+def rebuild_index(db_name):
+    """Re-index every row, e.g. after rows were written with the triggers missing"""
+    conn = sqlite3.connect(db_name)
+    try:
+        if not upgrade_search(conn):
+            raise RuntimeError("this SQLite build has no FTS5 support")
+        reindex_search(conn)
+        conn.execute("INSERT INTO objects_fts (objects_fts) VALUES ('optimize')")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Полнотекстовый поиск по собранным объектам")
+    parser.add_argument('query', nargs='?', help="слова для поиска")
+    parser.add_argument('--db', default='khpet27_data.db', help="файл базы данных")
+    parser.add_argument('--page', type=int, default=1, help="номер страницы результатов")
+    parser.add_argument('--per-page', type=int, default=10, help="результатов на странице")
+    parser.add_argument('--raw', action='store_true', help="передать запрос в FTS5 без изменений")
+    parser.add_argument('--rebuild', action='store_true', help="перестроить индекс")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild_index(args.db)
+        print(f"Индекс '{args.db}' перестроен")
+    if not args.query:
+        return
+
+    try:
+        total, rows = search(args.db, args.query, page=args.page, per_page=args.per_page, raw=args.raw)
+    except sqlite3.OperationalError as e:
+        print(f"Ошибка запроса: {e}")
+        return
+
+    pages = (total + args.per_page - 1) // args.per_page
+    print(f"Найдено: {total}, страница {args.page} из {max(pages, 1)}")
+    print("-" * 80)
+    for row in rows:
+        print(f"ID: {row['id']}  {row['name']}")
+        if row['url']:
+            print(f"URL: {row['url']}")
+        print(row["snippet"])
+        print("-" * 80)
+
+
+if __name__ == "__main__":
+    main()
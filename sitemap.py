@@ -0,0 +1,243 @@
+import gzip
+import time
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timezone
+from urllib.parse import urljoin, urlparse
+
+import requests
+from urllib3.exceptions import HTTPError as Urllib3Error
+
+from http_client import get_session
+from rate_limit import HostLimiter
+from storage import connect
+
+# Tried in this order when robots.txt names no sitemap: WordPress core, then the usual plugins
+DEFAULT_SITEMAP_PATHS = ('/wp-sitemap.xml', '/sitemap.xml', '/sitemap_index.xml')
+
+# URLs are written to the database in batches of this size while a sitemap is parsed
+WRITE_BATCH = 1000
+
+
+def parse_lastmod(value):
+    """Unix time of a W3C datetime such as 2025-01-15 or 2025-01-15T10:00:00+03:00, or None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def iter_sitemap(stream):
+    """Yield ('sitemap' or 'url', loc, lastmod) for every entry of a sitemap or sitemap index.
+
+    The XML is parsed incrementally and every finished entry is dropped,
+    so a sitemap with 50 000 URLs never sits in memory as a tree.
+    """
+    loc = lastmod = None
+    for event, element in ElementTree.iterparse(stream, events=('end',)):
+        # Tags carry the sitemaps.org namespace, e.g. {http://www.sitemaps.org/schemas/sitemap/0.9}loc
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 'loc':
+            loc = (element.text or '').strip()
+        elif tag == 'lastmod':
+            lastmod = parse_lastmod(element.text)
+        elif tag in ('url', 'sitemap'):
+            if loc:
+                yield tag, loc, lastmod
+            loc = lastmod = None
+            element.clear()
+
+
+class SitemapIndex:
+    """URLs and lastmod dates collected from a site's sitemaps.
+
+    refresh() streams the sitemap index and every child sitemap into the
+    sitemap_urls table, skipping child sitemaps whose own lastmod has not
+    moved since the previous run. changed() then lists the pages whose
+    lastmod is newer than the version fetched last time, and
+    mark_fetched() records that a page has been stored. Pages without a
+    lastmod are fetched once.
+    """
+
+    def __init__(self, db_name, session=None, limiter=None, timeout=30):
+        self.session = session or get_session()
+        self.limiter = limiter or HostLimiter(min_interval=1.0)
+        self.timeout = timeout
+        self.conn = connect(db_name)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS sitemaps (
+                url TEXT PRIMARY KEY,
+                lastmod REAL,
+                fetched_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS sitemap_urls (
+                url TEXT PRIMARY KEY,
+                lastmod REAL,
+                fetched_lastmod REAL,
+                changed_at REAL NOT NULL
+            );
+        ''')
+        self.conn.commit()
+
+    def find_sitemaps(self, base_url):
+        """Sitemap URLs listed in robots.txt, or the first default location that answers"""
+        parsed = urlparse(base_url)
+        root = f"{parsed.scheme}://{parsed.netloc}"
+        sitemaps = []
+        response = self._get(root + '/robots.txt')
+        if response is not None:
+            with response:
+                if response.status_code == 200:
+                    for line in response.text.splitlines():
+                        name, _, value = line.partition(':')
+                        if name.strip().lower() == 'sitemap' and value.strip():
+                            sitemaps.append(urljoin(root + '/', value.strip()))
+        if sitemaps:
+            return sitemaps
+
+        for path in DEFAULT_SITEMAP_PATHS:
+            response = self._get(root + path)
+            if response is None:
+                continue
+            with response:
+                if response.status_code == 200:
+                    return [root + path]
+        return []
+
+    def refresh(self, sitemap_urls, max_sitemaps=1000):
+        """Read the sitemaps (following indexes) and store the lastmod of every URL.
+
+        Returns counters: sitemaps read, sitemaps skipped as unchanged,
+        sitemaps that failed, URLs seen and URLs that are new or changed.
+        A failed sitemap is not remembered, so the next run reads it again.
+        """
+        stats = {'sitemaps': 0, 'unchanged': 0, 'failed': 0, 'urls': 0, 'changed': 0}
+        queue = [(url, None) for url in sitemap_urls]
+        visited = set()
+        while queue and stats['sitemaps'] < max_sitemaps:
+            url, lastmod = queue.pop(0)
+            if url in visited:
+                continue
+            visited.add(url)
+
+            if lastmod is not None:
+                row = self.conn.execute('SELECT lastmod FROM sitemaps WHERE url = ?', (url,)).fetchone()
+                if row and row[0] is not None and row[0] >= lastmod:
+                    stats['unchanged'] += 1
+                    continue
+
+            response = self._get(url, stream=True)
+            if response is None:
+                stats['failed'] += 1
+                continue
+            with response:
+                if response.status_code != 200:
+                    print(f"Карта сайта {url}: HTTP {response.status_code}")
+                    stats['failed'] += 1
+                    continue
+                try:
+                    children = self._store_entries(url, self._body(url, response), stats)
+                except ElementTree.ParseError as e:
+                    print(f"Карта сайта {url}: ошибка разбора XML: {e}")
+                    stats['failed'] += 1
+                    continue
+                except (requests.RequestException, Urllib3Error, OSError, EOFError) as e:
+                    # The body is read straight from urllib3, whose errors requests does not wrap;
+                    # a broken .gz stream ends in OSError or EOFError
+                    print(f"Карта сайта {url}: ошибка чтения: {e}")
+                    stats['failed'] += 1
+                    continue
+            stats['sitemaps'] += 1
+            queue.extend(children)
+
+            # Only remember the sitemap once all of its entries are stored
+            with self.conn:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO sitemaps (url, lastmod, fetched_at) VALUES (?, ?, ?)',
+                    (url, lastmod, time.time())
+                )
+        return stats
+
+    def changed(self, limit=None):
+        """(rowid, url) of pages never fetched or with a lastmod newer than the fetched version, newest first"""
+        query = '''
+            SELECT rowid, url FROM sitemap_urls
+            WHERE fetched_lastmod IS NULL OR lastmod > fetched_lastmod
+            ORDER BY lastmod DESC, url
+        '''
+        params = ()
+        if limit is not None:
+            query += ' LIMIT ?'
+            params = (limit,)
+        return self.conn.execute(query, params).fetchall()
+
+    def mark_fetched(self, urls):
+        """Record that these pages are stored as of their current lastmod"""
+        with self.conn:
+            # A page without a lastmod is marked with 0, so it counts as fetched but any lastmod beats it
+            self.conn.executemany(
+                'UPDATE sitemap_urls SET fetched_lastmod = COALESCE(lastmod, 0) WHERE url = ?',
+                [(url,) for url in urls]
+            )
+
+    def counts(self):
+        """Total URLs and URLs waiting to be fetched"""
+        return self.conn.execute('''
+            SELECT COUNT(*), SUM(fetched_lastmod IS NULL OR lastmod > fetched_lastmod) FROM sitemap_urls
+        ''').fetchone()
+
+    def close(self):
+        self.conn.close()
+
+    def _get(self, url, stream=False):
+        try:
+            with self.limiter.slot(url) as ticket:
+                response = self.session.get(url, timeout=self.timeout, stream=stream)
+                ticket.record(response.status_code)
+            return response
+        except requests.RequestException as e:
+            print(f"Ошибка доступа к {url}: {e}")
+            return None
+
+    def _body(self, url, response):
+        # Content-Encoding is undone by urllib3; a .xml.gz file is gzip data itself
+        response.raw.decode_content = True
+        content_type = response.headers.get('Content-Type', '')
+        if urlparse(url).path.endswith('.gz') or 'gzip' in content_type:
+            return gzip.GzipFile(fileobj=response.raw)
+        return response.raw
+
+    def _store_entries(self, sitemap_url, stream, stats):
+        """Store the URLs of one sitemap; returns the (url, lastmod) child sitemaps of an index"""
+        children = []
+        batch = []
+        for kind, loc, lastmod in iter_sitemap(stream):
+            if kind == 'sitemap':
+                children.append((urljoin(sitemap_url, loc), lastmod))
+                continue
+            batch.append((urljoin(sitemap_url, loc), lastmod))
+            if len(batch) >= WRITE_BATCH:
+                self._write_urls(batch, stats)
+                batch = []
+        if batch:
+            self._write_urls(batch, stats)
+        return children
+
+    def _write_urls(self, batch, stats):
+        now = time.time()
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany('''
+                INSERT INTO sitemap_urls (url, lastmod, changed_at) VALUES (?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET lastmod = excluded.lastmod, changed_at = excluded.changed_at
+                WHERE excluded.lastmod IS NOT sitemap_urls.lastmod
+            ''', [(url, lastmod, now) for url, lastmod in batch])
+            stats['changed'] += self.conn.total_changes - before
+        stats['urls'] += len(batch)
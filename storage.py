@@ -0,0 +1,315 @@
+import hashlib
+import sqlite3
+import time
+from itertools import islice, repeat
+
+from records import RecordBatch
+
+# Columns added on top of the original objects table for incremental saves
+EXTRA_COLUMNS = [
+    ('url', 'TEXT'),
+    ('content_hash', 'TEXT'),
+    ('updated_at', 'REAL'),
+    ('deleted_at', 'REAL'),
+    # Oldest row this one nearly duplicates, set by near_duplicates.NearDuplicateIndex
+    ('canonical_id', 'INTEGER'),
+    # Image metadata read by image_probe.ImageProber; image_probed is the image URL it was read from
+    ('image_format', 'TEXT'),
+    ('image_width', 'INTEGER'),
+    ('image_height', 'INTEGER'),
+    ('image_bytes', 'INTEGER'),
+    ('image_probed', 'TEXT'),
+]
+
+# Full-text index over name and text; it reads the rows from objects itself (external content)
+SEARCH_TABLE = '''
+    CREATE VIRTUAL TABLE objects_fts USING fts5(
+        name, text, content='objects', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+'''
+
+# unicode61 does not fold the Cyrillic ё, so it is indexed and searched as е
+def fold_sql(column):
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def fold_text(text):
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+# Keep the index in step with every write path, including the full rewrite in save_to_database
+SEARCH_TRIGGERS = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS objects_fts_insert AFTER INSERT ON objects BEGIN
+        INSERT INTO objects_fts (rowid, name, text)
+        VALUES (new.id, {fold_sql('new.name')}, {fold_sql('new.text')});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS objects_fts_delete AFTER DELETE ON objects BEGIN
+        INSERT INTO objects_fts (objects_fts, rowid, name, text)
+        VALUES ('delete', old.id, {fold_sql('old.name')}, {fold_sql('old.text')});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS objects_fts_update AFTER UPDATE OF name, text ON objects BEGIN
+        INSERT INTO objects_fts (objects_fts, rowid, name, text)
+        VALUES ('delete', old.id, {fold_sql('old.name')}, {fold_sql('old.text')});
+        INSERT INTO objects_fts (rowid, name, text)
+        VALUES (new.id, {fold_sql('new.name')}, {fold_sql('new.text')});
+    END
+    ''',
+]
+
+
+# Seconds a write waits for another connection's transaction, e.g. of a parallel crawl worker
+BUSY_TIMEOUT = 30.0
+
+
+def connect(db_name, check_same_thread=True):
+    """Open a connection in WAL mode so readers are never blocked by a writer"""
+    conn = sqlite3.connect(db_name, timeout=BUSY_TIMEOUT, check_same_thread=check_same_thread)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def upgrade_schema(conn):
+    """Add the incremental-mode columns and indexes to an existing objects table"""
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(objects)')}
+    for name, column_type in EXTRA_COLUMNS:
+        if name not in existing:
+            conn.execute(f'ALTER TABLE objects ADD COLUMN {name} {column_type}')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_objects_url ON objects (url)')
+    # Times of full saves (replace_objects), whose removed rows leave no tombstones
+    conn.execute('CREATE TABLE IF NOT EXISTS full_saves (saved_at REAL NOT NULL)')
+    upgrade_search(conn)
+    conn.commit()
+
+
+def upgrade_search(conn):
+    """Create the full-text index and its triggers, indexing existing rows once.
+
+    Returns False when this SQLite build has no FTS5; the scrapers then work
+    as before, only search is unavailable.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'objects_fts'"
+    ).fetchone()
+    if not exists:
+        try:
+            conn.execute(SEARCH_TABLE)
+        except sqlite3.OperationalError:
+            return False
+        reindex_search(conn)
+    for trigger in SEARCH_TRIGGERS:
+        conn.execute(trigger)
+    return True
+
+
+def reindex_search(conn):
+    """Index every row of objects from scratch"""
+    # FTS5's own 'rebuild' would index the raw columns, without folding
+    conn.execute("INSERT INTO objects_fts (objects_fts) VALUES ('delete-all')")
+    conn.execute(f'''
+        INSERT INTO objects_fts (rowid, name, text)
+        SELECT id, {fold_sql('name')}, {fold_sql('text')} FROM objects
+    ''')
+
+
+# Batches are written through this table so each reaches objects in a single statement
+STAGING_TABLE = '''
+    CREATE TEMP TABLE IF NOT EXISTS staged_objects (
+        name TEXT, audio TEXT, image TEXT, text TEXT, url TEXT, content_hash TEXT, updated_at REAL
+    )
+'''
+
+
+def content_hash(item):
+    """Hash the stored fields of a record so unchanged rows can be skipped"""
+    return _hash_fields(item.name, item.audio, item.image, item.text)
+
+
+def _hash_fields(*values):
+    digest = hashlib.sha1()
+    for value in values:
+        digest.update((value or '').encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _object_row(name, audio, image, text, url, now):
+    """(name, audio, image, text, url, content_hash, updated_at) as every write path stores a record"""
+    return name, audio, image, text, url, _hash_fields(name, audio, image, text), now
+
+
+def record_batches(data, batch_size):
+    """Split records (a RecordBatch, or any iterable of records or dicts) into RecordBatches of batch_size.
+
+    An iterable is consumed one batch at a time, so a generator of
+    millions of records never sits in memory as a whole.
+    """
+    if isinstance(data, RecordBatch):
+        for start in range(0, len(data), batch_size):
+            yield data[start:start + batch_size]
+        return
+    items = iter(data)
+    while True:
+        batch = RecordBatch(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def upsert_objects(db_name, data, batch_size=500, tombstone_missing=False):
+    """Insert or update records keyed on their source URL, one transaction per batch.
+
+    data is a RecordBatch or any iterable of records. Rows whose content
+    hash did not change are not written at all. With
+    tombstone_missing=True, rows whose URL was not seen in data are marked
+    with deleted_at instead of being removed. Row ids are assigned by SQLite
+    and stay stable for a URL across runs.
+    """
+    stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'tombstoned': 0}
+    conn = connect(db_name)
+    upgrade_schema(conn)
+
+    if tombstone_missing:
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS seen_urls (url TEXT PRIMARY KEY)')
+        conn.execute('DELETE FROM temp.seen_urls')
+        conn.commit()
+
+    for batch in record_batches(data, batch_size):
+        # Position of the last record of every URL: later duplicates win, as they would with sequential writes
+        latest = {url: index for index, url in enumerate(batch.url)}
+
+        # Take the write lock up front: a transaction that reads first cannot wait for another
+        # writer (e.g. a parallel crawl worker) and fails with "database is locked" instead
+        conn.execute('BEGIN IMMEDIATE')
+        with conn:
+            _upsert_batch(conn, batch, latest, stats)
+            if tombstone_missing:
+                conn.executemany('INSERT OR IGNORE INTO temp.seen_urls (url) VALUES (?)',
+                                 [(url,) for url in latest])
+
+    if tombstone_missing:
+        with conn:
+            # Rows without a URL, e.g. from a full save before URLs were stored, were not seen either
+            cursor = conn.execute('''
+                UPDATE objects SET deleted_at = ?
+                WHERE deleted_at IS NULL
+                  AND (url IS NULL OR url NOT IN (SELECT url FROM temp.seen_urls))
+            ''', (time.time(),))
+            stats['tombstoned'] = cursor.rowcount
+
+    conn.close()
+    return stats
+
+
+def _upsert_batch(conn, batch, latest, stats):
+    placeholders = ','.join('?' * len(latest))
+    existing = dict(conn.execute(
+        f'SELECT url, content_hash FROM objects WHERE url IN ({placeholders}) AND deleted_at IS NULL',
+        list(latest)
+    ).fetchall())
+
+    now = time.time()
+    rows = []
+    for url, index in latest.items():
+        row = _object_row(batch.name[index], batch.audio[index], batch.image[index], batch.text[index], url, now)
+        if url not in existing:
+            stats['inserted'] += 1
+        elif existing[url] != row[5]:
+            stats['updated'] += 1
+        else:
+            stats['unchanged'] += 1
+            continue
+        rows.append(row)
+
+    # Stage the batch and upsert it with one statement: FTS5 flushes its pending index
+    # data at the end of every statement, so row-by-row trigger updates are several times slower
+    conn.execute(STAGING_TABLE)
+    conn.executemany('INSERT INTO temp.staged_objects VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.execute('''
+        INSERT INTO objects (name, audio, image, text, url, content_hash, updated_at, deleted_at)
+        SELECT name, audio, image, text, url, content_hash, updated_at, NULL
+        FROM temp.staged_objects WHERE true ORDER BY rowid
+        ON CONFLICT(url) DO UPDATE SET
+            name = excluded.name,
+            audio = excluded.audio,
+            image = excluded.image,
+            text = excluded.text,
+            content_hash = excluded.content_hash,
+            updated_at = excluded.updated_at,
+            deleted_at = NULL
+    ''')
+    conn.execute('DELETE FROM temp.staged_objects')
+
+
+def insert_objects(db_name, items, batch_size=10000):
+    """Bulk-insert records without looking at the stored rows first, one transaction per batch.
+
+    items may be a RecordBatch or any iterable, e.g. a generator of
+    millions of records; it is consumed batch_size records at a time.
+    Records whose URL is already stored are skipped. Returns the number of
+    rows inserted.
+    """
+    conn = connect(db_name)
+    upgrade_schema(conn)
+    conn.execute(STAGING_TABLE)
+
+    inserted = 0
+    for batch in record_batches(items, batch_size):
+        # Rows are built straight from the batch columns
+        rows = map(_object_row, batch.name, batch.audio, batch.image, batch.text, batch.url, repeat(time.time()))
+        conn.execute('BEGIN IMMEDIATE')
+        with conn:
+            conn.executemany('INSERT INTO temp.staged_objects VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            inserted += conn.execute('''
+                INSERT INTO objects (name, audio, image, text, url, content_hash, updated_at)
+                SELECT name, audio, image, text, url, content_hash, updated_at
+                FROM temp.staged_objects WHERE true ORDER BY rowid
+                ON CONFLICT(url) DO NOTHING
+            ''').rowcount
+            conn.execute('DELETE FROM temp.staged_objects')
+
+    conn.close()
+    return inserted
+
+
+def replace_objects(db_name, data, append=False):
+    """Write records under their own ids, replacing every stored row unless append=True.
+
+    This is the full save of the scrapers. Rows get url, content_hash and
+    updated_at like upserted ones, so a database can later switch to
+    upsert_objects without storing every item twice. A later duplicate of
+    a URL overwrites the earlier row. Returns the number of records.
+    """
+    data = RecordBatch.of(data)
+    conn = connect(db_name)
+    upgrade_schema(conn)
+    now = time.time()
+    rows = [
+        (object_id,) + _object_row(name, audio, image, text, url, now)
+        for object_id, name, audio, image, text, url in zip(*data.columns())
+    ]
+    conn.execute('BEGIN IMMEDIATE')
+    with conn:
+        if not append:
+            conn.execute('DELETE FROM objects')
+            conn.execute('INSERT INTO full_saves (saved_at) VALUES (?)', (now,))
+        conn.executemany('''
+            INSERT INTO objects (id, name, audio, image, text, url, content_hash, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET
+                name = excluded.name,
+                audio = excluded.audio,
+                image = excluded.image,
+                text = excluded.text,
+                content_hash = excluded.content_hash,
+                updated_at = excluded.updated_at,
+                deleted_at = NULL
+        ''', rows)
+    conn.close()
+    return len(data)
@@ -0,0 +1,135 @@
+import argparse
+import itertools
+import math
+import random
+import sqlite3
+import time
+from collections import deque
+
+from records import Record
+from storage import insert_objects, upgrade_schema
+
+# Syllables of the made-up vocabulary; Cyrillic so search and ё-folding see realistic text
+SYLLABLES = ['ка', 'ро', 'ми', 'ле', 'на', 'ту', 'ве', 'за', 'по', 'ст', 'ри', 'до', 'ён', 'ль', 'ша', 'ур']
+
+
+class SyntheticGenerator:
+    """Seeded stream of records shaped like scraped articles, for load tests.
+
+    Word frequencies follow Zipf's law over a made-up vocabulary, text
+    lengths follow a log-normal distribution around median_words, and a
+    share of duplicate_rate records copy the name and text of a recent
+    record under a new URL, with edit_words words replaced. The same seed
+    and arguments always give the same records. Texts are assembled from a
+    pool of pre-built sentences, which keeps generation at a few
+    microseconds per record.
+    """
+
+    def __init__(self, seed=0, median_words=120, sigma=0.6, max_words=5000, duplicate_rate=0.0, edit_words=0,
+                 vocabulary_size=20000, sentence_pool=4096, url_prefix='mock://synthetic/'):
+        self.rng = random.Random(seed)
+        self.median_words = median_words
+        self.sigma = sigma
+        self.max_words = max_words
+        self.duplicate_rate = duplicate_rate
+        self.edit_words = edit_words
+        self.url_prefix = url_prefix
+
+        self.vocabulary = self._vocabulary(vocabulary_size)
+        weights = list(itertools.accumulate(1 / rank for rank in range(1, vocabulary_size + 1)))
+        self.sentences = []
+        for _ in range(sentence_pool):
+            words = self.rng.choices(self.vocabulary, cum_weights=weights, k=self.rng.randint(6, 18))
+            self.sentences.append(' '.join(words).capitalize() + '.')
+        self.words_per_sentence = sum(sentence.count(' ') + 1 for sentence in self.sentences) / sentence_pool
+        # Recent originals that duplicates are copied from
+        self.recent = deque(maxlen=1000)
+
+    def _vocabulary(self, size):
+        words = set()
+        while len(words) < size:
+            words.add(''.join(self.rng.choices(SYLLABLES, k=self.rng.randint(1, 4))))
+        return sorted(words)
+
+    def records(self, count, start=1):
+        """Yield count records numbered from start, as Record tuples like the scrapers produce"""
+        rng = self.rng
+        for number in range(start, start + count):
+            if self.recent and rng.random() < self.duplicate_rate:
+                name, text = rng.choice(self.recent)
+                if self.edit_words:
+                    words = text.split(' ')
+                    for _ in range(self.edit_words):
+                        words[rng.randrange(len(words))] = rng.choice(self.vocabulary)
+                    text = ' '.join(words)
+            else:
+                words = min(self.max_words, rng.lognormvariate(math.log(self.median_words), self.sigma))
+                sentences = max(1, round(words / self.words_per_sentence))
+                text = ' '.join(rng.choices(self.sentences, k=sentences))
+                name = rng.choice(self.sentences)[:-1]
+                self.recent.append((name, text))
+            yield Record(
+                id=number,
+                name=name,
+                audio=f"https://example.com/audio/synthetic_{number}.mp3",
+                image=f"https://picsum.photos/seed/synthetic{number}/400/300.jpg",
+                text=text,
+                url=f"{self.url_prefix}{number}",
+            )
+
+
+def load(db_name, count, batch_size=10000, start=None, **options):
+    """Generate count records straight into objects with bulk inserts; returns (rows inserted, seconds taken).
+
+    Records are numbered from start, by default from just past the highest
+    stored id, so a second load adds new URLs instead of colliding with
+    the first. Records whose URL is already stored are skipped and not
+    counted.
+    """
+    conn = sqlite3.connect(db_name)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS objects (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            audio TEXT,
+            image TEXT,
+            text TEXT
+        )
+    ''')
+    upgrade_schema(conn)
+    if start is None:
+        start = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM objects').fetchone()[0]
+    conn.close()
+
+    generator = SyntheticGenerator(**options)
+    started = time.perf_counter()
+    inserted = insert_objects(db_name, generator.records(count, start=start), batch_size=batch_size)
+    elapsed = time.perf_counter() - started
+    return inserted, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерация синтетических записей для нагрузочных тестов")
+    parser.add_argument('--db', default='synthetic.db', help="файл базы данных")
+    parser.add_argument('--rows', type=int, default=1000000, help="число записей")
+    parser.add_argument('--batch-size', type=int, default=10000, help="записей в одной транзакции")
+    parser.add_argument('--seed', type=int, default=0, help="зерно генератора")
+    parser.add_argument('--median-words', type=int, default=120, help="медианная длина текста в словах")
+    parser.add_argument('--sigma', type=float, default=0.6, help="разброс длины текста (логнормальное распределение)")
+    parser.add_argument('--duplicate-rate', type=float, default=0.0, help="доля записей-копий")
+    parser.add_argument('--edit-words', type=int, default=0, help="сколько слов заменить в копии")
+    parser.add_argument('--start', type=int, help="номер первой записи (по умолчанию следующий за наибольшим id)")
+    parser.add_argument('--url-prefix', default='mock://synthetic/', help="начало адресов записей")
+    args = parser.parse_args()
+
+    inserted, elapsed = load(args.db, args.rows, batch_size=args.batch_size, start=args.start, seed=args.seed,
+                             median_words=args.median_words, sigma=args.sigma, duplicate_rate=args.duplicate_rate,
+                             edit_words=args.edit_words, url_prefix=args.url_prefix)
+    rate = f"{inserted / elapsed:.0f}" if elapsed > 0 else "—"
+    print(f"Добавлено записей: {inserted} за {elapsed:.1f} с ({rate} записей/с)")
+    if inserted < args.rows:
+        print(f"Пропущено записей с уже сохранёнными адресами: {args.rows - inserted}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import struct
+
+from image_probe import ImageProber
+from rate_limit import HostLimiter
+from records import Record
+from storage import upsert_objects
+from synthetic import load
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00\x00\x00\rIHDR' + struct.pack('>II', 400, 300) + b'\x08\x02\x00\x00\x00'
+
+
+class FakeResponse:
+    headers = {}
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size):
+        yield PNG
+
+
+class FakeSession:
+    def __init__(self):
+        self.status_code = 503
+        self.requests = 0
+
+    def get(self, url, **kwargs):
+        self.requests += 1
+        return FakeResponse(self.status_code)
+
+
+def test_temporary_failure_waits_for_its_backoff(tmp_path):
+    db_name = str(tmp_path / 'objects.db')
+    load(db_name, 0)
+    upsert_objects(db_name, [Record(1, 'name', None, 'https://example.com/a.png', 'text', 'https://example.com/1')])
+    session = FakeSession()
+    prober = ImageProber(db_name, session=session, limiter=HostLimiter(min_interval=0), retry_delay=60)
+
+    assert prober.enrich()['retry'] == 1
+    # Still inside the backoff: not asked again
+    assert prober.enrich()['images'] == 0
+    assert session.requests == 1
+
+    prober.conn.execute('UPDATE image_retries SET retry_at = 0')
+    prober.conn.commit()
+    session.status_code = 200
+    assert prober.enrich()['images'] == 1
+    assert prober.conn.execute('SELECT image_width, image_height FROM objects').fetchone() == (400, 300)
+    assert prober.conn.execute('SELECT COUNT(*) FROM image_retries').fetchone()[0] == 0
+    prober.close()
@@ -0,0 +1,49 @@
+import sqlite3
+
+import storage
+from media import MediaDownloader
+from rate_limit import HostLimiter
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {'Content-Type': 'image/jpeg'}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        yield b'image bytes'
+
+
+class FakeSession:
+    def get(self, url, **kwargs):
+        return FakeResponse()
+
+
+def test_locked_database_fails_the_download_instead_of_raising(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'BUSY_TIMEOUT', 0.1)
+    db_name = str(tmp_path / 'objects.db')
+    downloader = MediaDownloader(db_name, root=str(tmp_path / 'media'), session=FakeSession(),
+                                 limiter=HostLimiter(min_interval=0))
+    url = 'https://example.com/a.jpg'
+
+    blocker = sqlite3.connect(db_name)
+    blocker.execute('BEGIN IMMEDIATE')
+    try:
+        assert downloader.download(url) is None
+        assert downloader.stats['failed'] == 1
+    finally:
+        blocker.rollback()
+        blocker.close()
+
+    # The lock is gone and the connection is usable again
+    sha256, path = downloader.download(url)
+    assert downloader.lookup(url) == (sha256, path)
+    downloader.close()
@@ -0,0 +1,28 @@
+import json
+
+from export import export_objects
+from near_duplicates import NearDuplicateIndex
+from records import Record
+from storage import upsert_objects
+from synthetic import load
+
+TEXT = 'the quick brown fox jumps over the lazy dog near the river bank every single morning'
+
+
+def test_linked_duplicate_shows_up_in_the_next_incremental_export(tmp_path):
+    db_name = str(tmp_path / 'objects.db')
+    load(db_name, 0)
+    upsert_objects(db_name, [
+        Record(1, 'original', None, None, TEXT, 'https://example.com/1'),
+        Record(2, 'copy', None, None, TEXT + ' again', 'https://example.com/2'),
+    ])
+    export_objects(db_name, str(tmp_path / 'first.jsonl'), incremental=True)
+
+    index = NearDuplicateIndex(db_name, max_distance=10)
+    assert index.update()['duplicates'] == 1
+    index.close()
+
+    path = tmp_path / 'second.jsonl'
+    assert export_objects(db_name, str(path), incremental=True)['rows'] == 1
+    row = json.loads(path.read_text(encoding='utf-8'))
+    assert (row['name'], row['canonical_id']) == ('copy', 1)
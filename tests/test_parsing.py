@@ -0,0 +1,31 @@
+import pytest
+
+from khpet27_scraper import parse_article_html
+
+pytest.importorskip('lxml')
+
+# Article pages with markup the two parsers repair differently
+MALFORMED_PAGES = [
+    '<h1>Title</h1><div class="entry-content"><p>Unclosed<p>Deep</div>',
+    '<h1>Title</h1><div class="entry-content"><p>Unclosed<div><p>Deep</div></div>',
+    '<h1>Title</h1><div class="entry-content"><p>Unclosed<span><p>Deep</span></div>',
+    '<h1>Title</h1><article><p>Unclosed <b>bold<p>Deep</article>',
+    '<h1>Title<div class="content"><p>One<p>Two<p>Three</div>',
+    '<html><body><main><p>First</p><p>Second<img src="/a.jpg"></main>',
+]
+
+
+@pytest.mark.parametrize('page', MALFORMED_PAGES)
+@pytest.mark.parametrize('selective', [True, False])
+def test_lxml_and_html_parser_extract_the_same_article(page, selective):
+    args = ('https://khpet27.ru/a', 1, 'https://khpet27.ru')
+    from_lxml = parse_article_html(page, *args, parser='lxml', selective_parsing=selective)
+    from_html_parser = parse_article_html(page, *args, parser='html.parser', selective_parsing=selective)
+    assert from_lxml.text == from_html_parser.text
+    assert from_lxml == from_html_parser
+
+
+def test_unclosed_paragraphs_are_not_repeated():
+    record = parse_article_html(MALFORMED_PAGES[0], 'https://khpet27.ru/a', 1, 'https://khpet27.ru',
+                                parser='html.parser')
+    assert record.text == 'Unclosed Deep'
@@ -0,0 +1,73 @@
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import pipeline
+from pipeline import Pipeline
+
+
+def parse(value):
+    return {'value': value}
+
+
+class BrokenPool:
+    """Stands in for a ProcessPoolExecutor whose worker processes have died"""
+
+    def __init__(self, max_workers=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, function, *args):
+        raise BrokenProcessPool("a worker process died")
+
+
+def run_in_thread(function, timeout=20):
+    outcome = {}
+
+    def target():
+        try:
+            outcome['result'] = function()
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "pipeline hung"
+    return outcome
+
+
+def test_broken_process_pool_fails_the_run(monkeypatch):
+    monkeypatch.setattr(pipeline, 'ProcessPoolExecutor', BrokenPool)
+    written = []
+    pipe = Pipeline(lambda item: (item,), parse, written.extend, fetch_workers=2, parse_workers=1,
+                    queue_size=2, flush_interval=0.1)
+    outcome = run_in_thread(lambda: pipe.run(range(50)))
+    assert isinstance(outcome.get('error'), BrokenProcessPool)
+    assert written == []
+
+
+def test_failing_source_fails_the_run_after_writing_what_came_before():
+    def source():
+        yield from range(5)
+        raise KeyError('broken listing page')
+
+    written = []
+    pipe = Pipeline(lambda item: (item,), parse, written.extend, fetch_workers=2, parse_workers=1,
+                    flush_interval=0.1)
+    outcome = run_in_thread(lambda: pipe.run(source()))
+    assert isinstance(outcome.get('error'), KeyError)
+    assert sorted(record['value'] for record in written) == list(range(5))
+
+
+def test_run_returns_counters():
+    written = []
+    pipe = Pipeline(lambda item: (item,) if item % 5 else None, parse, written.extend, fetch_workers=3,
+                    parse_workers=2, batch_size=4)
+    stats = pipe.run(range(20))
+    assert stats == {'fetched': 16, 'fetch_failed': 4, 'parsed': 16, 'parse_failed': 0, 'written': 16}
+    assert len(written) == 16
@@ -0,0 +1,48 @@
+import io
+
+from urllib3.exceptions import ProtocolError
+
+from rate_limit import HostLimiter
+from sitemap import SitemapIndex
+
+SITEMAP = b'''<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://example.com/a</loc><lastmod>2025-01-15</lastmod></url>
+</urlset>'''
+
+
+class BrokenStream:
+    decode_content = False
+
+    def read(self, size=-1):
+        raise ProtocolError('Connection broken: IncompleteRead')
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {'Content-Type': 'application/xml'}
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    def get(self, url, **kwargs):
+        if url.endswith('broken.xml'):
+            return FakeResponse(BrokenStream())
+        return FakeResponse(io.BytesIO(SITEMAP))
+
+
+def test_read_error_fails_only_that_sitemap(tmp_path):
+    index = SitemapIndex(str(tmp_path / 'objects.db'), session=FakeSession(), limiter=HostLimiter(min_interval=0))
+    stats = index.refresh(['https://example.com/broken.xml', 'https://example.com/sitemap.xml'])
+    assert (stats['sitemaps'], stats['failed'], stats['urls']) == (1, 1, 1)
+    remembered = [row[0] for row in index.conn.execute('SELECT url FROM sitemaps')]
+    assert remembered == ['https://example.com/sitemap.xml']
+    index.close()
@@ -0,0 +1,57 @@
+import sqlite3
+
+from records import Record
+from storage import replace_objects, upsert_objects
+from synthetic import load
+
+
+def make_records(count, text='text'):
+    return [Record(i, f'name {i}', None, None, text, f'https://example.com/{i}') for i in range(1, count + 1)]
+
+
+def live_rows(db_name):
+    conn = sqlite3.connect(db_name)
+    try:
+        return conn.execute('SELECT id, url, content_hash, updated_at FROM objects WHERE deleted_at IS NULL').fetchall()
+    finally:
+        conn.close()
+
+
+def test_full_save_then_incremental_keeps_one_row_per_item(tmp_path):
+    db_name = str(tmp_path / 'objects.db')
+    load(db_name, 0)
+    replace_objects(db_name, make_records(20))
+    assert all(url and content_hash and updated_at for _, url, content_hash, updated_at in live_rows(db_name))
+
+    stats = upsert_objects(db_name, make_records(20), tombstone_missing=True)
+    assert stats == {'inserted': 0, 'updated': 0, 'unchanged': 20, 'tombstoned': 0}
+
+    stats = upsert_objects(db_name, make_records(20, text='changed'), tombstone_missing=True)
+    assert stats['updated'] == 20
+    assert len(live_rows(db_name)) == 20
+
+
+def test_tombstone_retires_rows_without_url(tmp_path):
+    db_name = str(tmp_path / 'objects.db')
+    load(db_name, 0)
+    conn = sqlite3.connect(db_name)
+    conn.execute("INSERT INTO objects (id, name, text) VALUES (100, 'legacy', 'text')")
+    conn.commit()
+    conn.close()
+
+    stats = upsert_objects(db_name, make_records(3), tombstone_missing=True)
+    assert stats['tombstoned'] == 1
+    assert sorted(url for _, url, _, _ in live_rows(db_name)) == [r.url for r in make_records(3)]
+
+
+def test_full_save_append_and_duplicate_urls(tmp_path):
+    db_name = str(tmp_path / 'objects.db')
+    load(db_name, 0)
+    records = make_records(4)
+    replace_objects(db_name, records[:2])
+    replace_objects(db_name, records[2:] + [records[0]._replace(id=9, text='later')], append=True)
+    rows = live_rows(db_name)
+    assert len(rows) == 4
+    conn = sqlite3.connect(db_name)
+    assert conn.execute('SELECT id, text FROM objects WHERE url = ?', (records[0].url,)).fetchone() == (1, 'later')
+    conn.close()
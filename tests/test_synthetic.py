@@ -0,0 +1,9 @@
+from synthetic import load
+
+
+def test_second_load_continues_numbering(tmp_path):
+    db_name = str(tmp_path / 'load.db')
+    assert load(db_name, 50)[0] == 50
+    assert load(db_name, 50)[0] == 50
+    # Numbers that are already stored are skipped and not reported as inserted
+    assert load(db_name, 10, start=1)[0] == 0
@@ -0,0 +1,192 @@
+import hashlib
+import math
+import posixpath
+import re
+import time
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urljoin, urlsplit, urlunsplit
+
+from storage import connect
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'yclid', 'msclkid', 'mc_cid', 'mc_eid', '_ga', '_gl', '_openstat',
+    'ref_src', 'igshid',
+}
+TRACKING_PREFIXES = ('utm_',)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Characters left as they are when re-encoding a path or a query value
+SAFE_PATH = "/:@!$&'()*+,;=-._~"
+SAFE_QUERY = "/:@!$'()*,;-._~"
+
+
+def canonicalize_url(url, base=None, force_https=True, trailing_slash=True):
+    """Reduce a URL to one canonical spelling for deduplication.
+
+    Lowercases the scheme and host, drops default ports, fragments and
+    tracking parameters, sorts the remaining query and normalises
+    percent-encoding and dot segments. With force_https=True http:// and
+    https:// collapse to https://. With trailing_slash=True paths whose last
+    segment has no extension get a trailing slash, as WordPress serves
+    them; with False the slash is stripped instead.
+    """
+    if base:
+        url = urljoin(base, url)
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        return url
+
+    host = (parts.hostname or '').rstrip('.')
+    if ':' in host:
+        host = f'[{host}]'
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if force_https and scheme == 'http' and port in (None, 80):
+        scheme, port = 'https', None
+    netloc = host
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc = f'{host}:{port}'
+
+    path = quote(unquote(parts.path), safe=SAFE_PATH) or '/'
+    path = posixpath.normpath(path) if path != '/' else path
+    # normpath keeps a leading '//' and drops the trailing slash
+    path = '/' + path.lstrip('/')
+    last_segment = path.rsplit('/', 1)[1]
+    if trailing_slash:
+        if last_segment and '.' not in last_segment:
+            path += '/'
+    elif path != '/':
+        path = path.rstrip('/')
+
+    query = [
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name.lower() not in TRACKING_PARAMS and not name.lower().startswith(TRACKING_PREFIXES)
+    ]
+    query = urlencode(sorted(query), quote_via=quote, safe=SAFE_QUERY)
+
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter; answers "definitely not seen" or "maybe seen" """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class SeenSet:
+    """Persistent set of canonical URLs: a SQLite table behind an in-memory Bloom filter.
+
+    Lookups of URLs never seen before are answered by the Bloom filter
+    alone; only possible hits go to the indexed table. The filter is sized
+    for capacity URLs up front, so memory stays fixed (about 1.8 MB per
+    million URLs at the default error rate); past that it just lets more
+    lookups through to SQLite. close() stores the filter next to the table,
+    so the next run does not have to rebuild it from every row.
+    """
+
+    def __init__(self, db_name, table='seen_urls', capacity=1_000_000, error_rate=0.001):
+        if not re.fullmatch(r'\w+', table):
+            raise ValueError(f"Invalid table name: {table!r}")
+        self.table = table
+        # Used by one thread at a time, but not always the one that opened it (e.g. under async_iter)
+        self.conn = connect(db_name, check_same_thread=False)
+        self.conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                url TEXT PRIMARY KEY,
+                seen_at REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS bloom_filters (
+                name TEXT PRIMARY KEY,
+                capacity INTEGER NOT NULL,
+                error_rate REAL NOT NULL,
+                count INTEGER NOT NULL,
+                bits BLOB NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+        self.bloom = BloomFilter(capacity, error_rate)
+        saved = self.conn.execute(
+            'SELECT count, bits FROM bloom_filters WHERE name = ? AND capacity = ? AND error_rate = ?',
+            (table, capacity, error_rate)
+        ).fetchone()
+        # A saved filter is only current if no rows were added after it was stored
+        if saved and saved[0] == len(self):
+            self.bloom.bits = bytearray(saved[1])
+            self.bloom.count = saved[0]
+        else:
+            for (url,) in self.conn.execute(f'SELECT url FROM {table}'):
+                self.bloom.add(url)
+
+    def __contains__(self, url):
+        if url not in self.bloom:
+            return False
+        return self.conn.execute(f'SELECT 1 FROM {self.table} WHERE url = ?', (url,)).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def unseen(self, urls):
+        """The URLs that are not in the set, in order and without repeats"""
+        result = []
+        batch = set()
+        for url in urls:
+            if url in batch:
+                continue
+            batch.add(url)
+            if url not in self:
+                result.append(url)
+        return result
+
+    def add(self, urls):
+        """Remember URLs; returns how many of them were new"""
+        now = time.time()
+        urls = list(urls)
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                f'INSERT OR IGNORE INTO {self.table} (url, seen_at) VALUES (?, ?)',
+                [(url, now) for url in urls]
+            )
+            added = self.conn.total_changes - before
+        for url in urls:
+            self.bloom.add(url)
+        return added
+
+    def save(self):
+        """Store the Bloom filter so the next SeenSet on this table can load it"""
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO bloom_filters (name, capacity, error_rate, count, bits) VALUES (?, ?, ?, ?, ?)',
+                (self.table, self.bloom.capacity, self.bloom.error_rate, len(self), bytes(self.bloom.bits))
+            )
+
+    def close(self):
+        self.save()
+        self.conn.close()